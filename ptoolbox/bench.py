@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the scan and catalog primitives, run on the user's own data
+so that the numbers reflect their disks and their cameras.
+Every function returns its measures; printing them is up to the caller.
+"""
+
+import json
+import os.path
+import shutil
+import tempfile
+import time
+
+from datetime import datetime
+
+from .checksum import checksum_many, CHECKSUM_ALGORITHMS
+from .conf import settings, EXIF_ENGINE_EXIFREAD, EXIF_ENGINE_FAST
+from .google import PicasaClient
+from .google.fake import FakePWAServer, FakeStore
+from .google.models import GoogleAlbum, GooglePhoto, CatalogWriter, db, init_database
+from .google.records import AlbumRecord, PhotoRecord
+from .google.utils import g_json_key
+from .parallel import imap_bounded
+from .path import fastwalk, parse_tags, probe_image
+
+
+def best_time(func, repeat=3):
+    """Returns the best wall time of <repeat> calls to <func>, in seconds."""
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def bench_exif(path, deep=True, repeat=3):
+    """Parses the Exif payloads of every JPEG under <path> with each engine.
+    Returns the number of payloads, the number of them on which engines
+    agree, and the seconds per payload for every engine.
+    """
+    payloads = []
+    for e in fastwalk(path, deep):
+        probe = probe_image(e.path)
+        if probe.exif:
+            payloads.append(probe.exif)
+
+    engines = (EXIF_ENGINE_EXIFREAD, EXIF_ENGINE_FAST)
+    tags = {engine: [parse_tags(exif, engine) for exif in payloads] for engine in engines}
+    n_agree = sum(1 for a, b in zip(*[tags[engine] for engine in engines]) if a == b)
+    timings = {}
+    for engine in engines:
+        seconds = best_time(lambda: [parse_tags(exif, engine) for exif in payloads], repeat)
+        timings[engine] = seconds / len(payloads) if payloads else 0.0
+    return len(payloads), n_agree, timings
+
+
+def bench_checksum(path, deep=True, jobs=1, repeat=3):
+    """Hashes every file under <path> with every available algorithm, in
+    <jobs> threads. Returns the number of files, their total size and the
+    throughput of every algorithm, in bytes per second. As the best of
+    <repeat> runs is kept, files are usually read from the OS cache: this
+    measures the hashing itself rather than the disk.
+    """
+    paths, n_bytes = [], 0
+    for e in fastwalk(path, deep):
+        paths.append(e.path)
+        n_bytes += e.stat().st_size
+
+    throughputs = {}
+    for algorithm in CHECKSUM_ALGORITHMS:
+        seconds = best_time(lambda: list(checksum_many(paths, algorithm, jobs)), repeat)
+        throughputs[algorithm] = n_bytes / seconds if seconds else 0.0
+    return len(paths), n_bytes, throughputs
+
+
+def bench_feed(path, repeat=3):
+    """Reads the entries of the feed saved in the JSON file <path> (or of a
+    bare list of entries, albums or photos) as models and as records.
+    Returns the number of entries, the number of them read identically,
+    and the seconds per entry for every method.
+    """
+    with open(path, 'rb') as f:
+        data = json.loads(f.read().decode('utf-8'))
+    entries = data['feed'].get('entry', []) if isinstance(data, dict) else data
+    if entries and g_json_key('numphotos', 'gphoto') in entries[0]:
+        readers = {'models': GoogleAlbum.from_raw_json, 'records': AlbumRecord.from_raw_json}
+    else:
+        readers = {'models': GooglePhoto.from_raw_json, 'records': PhotoRecord.from_raw_json}
+
+    models = [readers['models'](entry) for entry in entries]
+    records = [readers['records'](entry) for entry in entries]
+    n_agree = sum(1 for model, record in zip(models, records)
+                  if record.to_model()._data == model._data)
+    timings = {}
+    for method, reader in readers.items():
+        seconds = best_time(lambda: [reader(entry) for entry in entries], repeat)
+        timings[method] = seconds / len(entries) if entries else 0.0
+    return len(entries), n_agree, timings
+
+
+def bench_db(n_rows=20000, batch_size=None):
+    """Writes synthetic photos to a scratch catalog: one save() per row with
+    the default SQLite settings (on <n_rows> / 10 rows only, it's slow), then
+    with CatalogWriter and the tuned pragmas. Returns the rows written per
+    second by each method.
+    """
+    album = AlbumRecord(id='1', name='bench', title='bench', author='bench', access='private',
+                        summary='', num_photos=n_rows, updated=datetime.utcnow(),
+                        published=datetime.utcnow())
+    photos = [PhotoRecord(album='1', uuid=str(n), url='https://x/%d.jpg' % n,
+                          time=datetime.utcnow(), size=n, title='%d.jpg' % n, width=4000,
+                          height=3000, unique_id='%032x' % n) for n in range(n_rows)]
+    directory = tempfile.mkdtemp()
+
+    def save_rows():
+        for photo in photos[:n_rows // 10]:
+            photo.to_model().save(force_insert=True)
+
+    def write_batches():
+        with CatalogWriter(batch_size) as writer:
+            writer.add(photos)
+
+    throughputs = {}
+    try:
+        for method, write, pragmas, n in (('save', save_rows, (), n_rows // 10),
+                                          ('writer', write_batches, None, n_rows)):
+            init_database(os.path.join(directory, '%s.db' % method), True, pragmas)
+            GoogleAlbum.insert_records([album])
+            start = time.time()
+            write()
+            seconds = time.time() - start
+            db.close()
+            throughputs[method] = n / seconds if seconds else 0.0
+    finally:
+        shutil.rmtree(directory)
+    return throughputs
+
+
+def bench_crawl(n_albums=10, n_photos=1000, jobs=None, latency=0.0, error_rate=0.0,
+                throttle_rate=0, page_size=None):
+    """Crawls a FakePWAServer of <n_albums> albums of <n_photos> photos, as
+    fetch_catalog does: <jobs> albums at a time. The server answers every
+    request in <latency> seconds, with the given <error_rate> and
+    <throttle_rate> (see google.fake). Returns the photos fetched, the
+    seconds spent, and the counters of the client and of the server.
+    """
+    if jobs is None:
+        jobs = settings.CATALOG['JOBS']
+    server = FakePWAServer(FakeStore.synthetic(n_albums, n_photos), latency=latency,
+                           error_rate=error_rate, throttle_rate=throttle_rate, seed=0).start()
+    try:
+        client = PicasaClient(page_size=page_size, pool_size=jobs * 4, base_url=server.url)
+        client.authenticate('bench', 'bench')
+        start = time.time()
+        fetch = lambda album: len(list(client.fetch_images(album.id, album=album)))
+        n_fetched = sum(imap_bounded(fetch, list(client.fetch_albums()), jobs, ordered=False))
+        seconds = time.time() - start
+        return n_fetched, seconds, client.pool_stats(), dict(server.stats)
+    finally:
+        server.stop()
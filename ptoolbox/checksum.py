@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+"""
+File checksums.
+
+Files are mapped in memory and handed whole to hashlib, which hashes them
+without any copy and without holding the GIL: hashing several files in
+threads (see checksum_many) actually uses several cores.
+md5 is the default, it is what ImageInfo.checksum holds.
+"""
+
+import hashlib
+import mmap
+import os
+
+from multiprocessing.pool import ThreadPool
+
+CHECKSUM_MD5 = 'md5'
+CHECKSUM_BLOCK_SIZE = 1048576  # read size when a file can't be mapped
+
+CHECKSUM_ALGORITHMS = tuple(
+    algorithm for algorithm in ('md5', 'sha1', 'sha256', 'blake2b', 'blake2s')
+    if algorithm in (getattr(hashlib, 'algorithms_available', None) or hashlib.algorithms))
+
+
+def new_hash(algorithm=CHECKSUM_MD5):
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise ValueError("unsupported checksum algorithm: '%s'" % algorithm)
+    return hashlib.new(algorithm)
+
+
+def checksum_data(data, algorithm=CHECKSUM_MD5):
+    """Checksum of a bytes-like object, e.g. an mmap."""
+    h = new_hash(algorithm)
+    h.update(data)
+    return h.hexdigest()
+
+
+def checksum(path, algorithm=CHECKSUM_MD5, blocksize=CHECKSUM_BLOCK_SIZE):
+    """Checksum of the file at <path>, as an hexadecimal string."""
+    h = new_hash(algorithm)
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:  # empty files can't be mapped
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError, OSError):  # not a regular file
+                data = None
+            if data is not None:
+                try:
+                    h.update(data)
+                finally:
+                    data.close()
+                return h.hexdigest()
+
+        buf = bytearray(blocksize)
+        view = memoryview(buf)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def _checksum_worker(args):
+    path, algorithm = args
+    return path, checksum(path, algorithm)
+
+
+def checksum_many(paths, algorithm=CHECKSUM_MD5, jobs=1):
+    """Yields (path, checksum) for every path of <paths>, in order. With
+    <jobs> greater than 1, files are hashed in as many threads.
+    """
+    args = ((path, algorithm) for path in paths)
+    if jobs <= 1:
+        for res in map(_checksum_worker, args):
+            yield res
+        return
+    pool = ThreadPool(jobs)
+    try:
+        for res in pool.imap(_checksum_worker, args):
+            yield res
+    finally:
+        pool.terminate()
+        pool.join()
@@ -11,14 +11,27 @@ import logging
 import os
 import os.path
 import sys
+import time
 
 from collections import defaultdict
 
 from ptoolbox import log
 
-from .conf import settings
+from .bench import bench_exif, bench_checksum, bench_db, bench_feed, bench_crawl
+from .checksum import CHECKSUM_ALGORITHMS, CHECKSUM_MD5
+from .conf import settings, TZ_ENGINE_ONLINE, TZ_ENGINE_OFFLINE
+from .download import DownloadManager
+from .dupes import find_duplicates, find_similar_images, hash_images, DUPES_MAX_DISTANCE
 from .google import picasa_client as pc, utils, models
-from .path import ptoolbox_dir, ensure_directory, download_file
+from .google.cache import ResponseCache
+from .google.fake import FakePWAServer, FakeStore
+from .models import init_index
+from .parallel import imap_bounded
+from .phash import is_available as phash_is_available
+from .sync import plan_sync, load_remote_photos, load_album_names
+from .tz import build_tz_index
+from .upload import UploadManager
+from .path import ptoolbox_dir, ensure_directory
 from .utils import count_files, list_valid_images, dt2str
 
 
@@ -29,19 +42,81 @@ def init_user_database(login, reset=False):
     models.init_database(db_file_path, reset)
 
 
+def init_scan_index(login, reset=False):
+    """Inits the SQLite local scan index for the given user"""
+    ensure_directory(ptoolbox_dir)
+    db_file_path = os.path.join(ptoolbox_dir, '%s.index.db' % login)
+    init_index(db_file_path, reset)
+
+
 @click.group()
 @click.option('--debug/--no-debug', default=False)
-def cli(debug):
+@click.option('--base-url', help='Server of the Picasa Web API, e.g. a fake-pwa one.')
+def cli(debug, base_url):
     settings.DEBUG = debug
     if debug:
         log.setLevel(logging.DEBUG)
+    if base_url:
+        pc.set_base_url(base_url)
+
+
+def fetch_catalog(login, password, db_name, jobs=None, refresh=False):
+    """Fetches every album and photo of <login> into the database <db_name>,
+    <jobs> albums at a time (default: settings.CATALOG['JOBS']). Albums are fetched by worker threads while the
+    calling thread writes them, so that a single thread uses the database.
+    With <refresh>, the database is updated instead of rebuilt: only the
+    albums that changed get their photos fetched again. An album is only
+    stored along with its photos, so that the albums of an interrupted
+    fetch are fetched again next time.
+    """
+    if jobs is None:
+        jobs = settings.CATALOG['JOBS']
+    init_user_database(db_name, reset=not refresh)
+    pc.authenticate(login, password)
+    if settings.RESPONSE_CACHE['ENABLED']:  # unchanged pages cost headers only
+        pc.response_cache = ResponseCache(os.path.join(ptoolbox_dir, '%s.cache' % db_name))
+    pc.resize_pool(jobs * pc.jobs)  # every album fetch has its pages fetched concurrently
+
+    print("fetching all albums... ", end='')
+    albums = list(pc.fetch_albums())
+    changed, vanished = models.GoogleAlbum.changes(albums)
+    with models.db.atomic():
+        models.GoogleAlbum.prune(vanished)
+    print("done, %d albums, %d changed, %d deleted." % (len(albums), len(changed), len(vanished)))
+
+    start = time.time()
+    n_photos = 0
+    fetch = lambda album: (album, list(pc.fetch_images(album.id, album=album)))
+    with models.CatalogWriter() as writer:
+        albums = imap_bounded(fetch, changed, jobs, ordered=False)
+        for index, (album, photos) in enumerate(albums, 1):
+            writer.replace_photos(album, photos)
+            n_photos += len(photos)
+            print("album %03d of %03d: '%s', %d pictures" % (
+                index, len(changed), album.title, len(photos)))
+            sys.stdout.flush()
+
+    elapsed = time.time() - start
+    print('> fetched %d pictures in %.1fs, %.1f pictures/s.' % (
+        n_photos, elapsed, n_photos / elapsed if elapsed else 0))
+    stats = pc.pool_stats()
+    print('> %(requests)d requests, %(retries)d retries, %(throttle_events)d throttled, '
+          'concurrency limit %(concurrency_limit)d.' % stats)
+    if pc.response_cache is not None:
+        print('> %(cache_hits)d of %(cache_lookups)d pages unchanged, %(cache_entries)d cached.'
+              % stats)
+    models.db.close()
 
 
 @cli.command('init')
 @click.argument('login')
 @click.option('--password', prompt=True, hide_input=True)
 @click.option('--dry-run/--no-dry-run', default=False)
-def init(login, password, dry_run):
+@click.option('--jobs', default=settings.CATALOG['JOBS'], type=int,
+              help='Number of albums fetched concurrently.')
+@click.option('--refresh/--reset', default=False,
+              help='Only fetch the albums that changed since the last run.')
+def init(login, password, dry_run, jobs, refresh):
     """Creates a $HOME/.ptoolbox/<login>.db containing a SQLite
     database of all pictures & albums for <login>.
     """
@@ -49,28 +124,96 @@ def init(login, password, dry_run):
         db_name = '__tmp__'  # FIXME: this is a hack, would be better that dry_run actually does not write
     else:
         db_name = utils.mail2username(login)
+    fetch_catalog(login, password, db_name, jobs, refresh)
 
-    init_user_database(db_name, reset=True)
-    pc.authenticate(login, password)
 
-    print("fetching all albums... ", end='')
-    n_albums = 0
-    for album in pc.fetch_albums():
-        album.save(force_insert=True)
-        n_albums += 1
-    print("done.")
-
-    index = 1
-    for album in models.GoogleAlbum.select():
-        print("album %03d of %03d: '%s', %d pictures" % (index, n_albums, album.title, album.num_photos))
-        for photo in pc.fetch_images(album.id):
-            print('.', end='')
-            sys.stdout.flush()
-            photo.save(force_insert=True)
-        index += 1
-        print('\n')
+def print_plan(plan, verbose=False):
+    if verbose:
+        for action in plan.upload:
+            print('must upload %s' % action['path'])
+        for action in plan.download:
+            print("must download %s/%s" % (action['album'], action['uuid']))
+        for action in plan.conflict:
+            print('conflict: %s matches %d pictures' % (action['path'], len(action['photos'])))
+        for action in plan.ignored:
+            print('ignoring %s: %s' % (action['path'], action['reason']))
+    print('> %(upload)d to upload, %(download)d to download, %(conflict)d conflicts, '
+          '%(matched)d matched, %(ignored)d ignored.' % plan.summary())
 
-    models.db.close()
+
+def resolve_albums(folders):
+    """Returns the ids of the albums of the local <folders>. A folder is the
+    album of its name, as sync downloads them (see load_album_names), or
+    else of its title. The missing albums get created, and stored in the
+    catalog; images out of any album go to the default one. Folders
+    matching several albums are refused.
+    """
+    by_name = defaultdict(list)
+    for album_id, name in load_album_names().items():
+        by_name[name].append(album_id)
+    by_title = defaultdict(list)
+    for title, album_id in models.GoogleAlbum.select(models.GoogleAlbum.title,
+                                                     models.GoogleAlbum.id).tuples():
+        by_title[title].append(album_id)
+    album_ids = {None: settings.DEFAULT_ALBUM or 'default'}
+    for folder in set(folders) - set([None]):
+        for albums, kind in ((by_name, 'named'), (by_title, 'titled')):
+            if len(albums[folder]) > 1:
+                raise click.ClickException("%d albums are %s '%s', rename all of them but one." % (
+                    len(albums[folder]), kind, folder))
+            if albums[folder]:
+                album_ids[folder] = albums[folder][0]
+                break
+        else:
+            album_ids[folder] = pc.create_album(folder)
+            models.GoogleAlbum.insert_records([pc.get_album(album_ids[folder])], upsert=True)
+            print("> created album '%s'" % folder)
+    return album_ids
+
+
+def execute_plan(plan, path):
+    album_ids = resolve_albums(action['album'] for action in plan.upload)
+    uploads = [(action['path'], os.path.basename(action['path']), album_ids[action['album']])
+               for action in plan.upload]
+    manager = UploadManager(pc)
+    pc.resize_pool(max(manager.jobs, settings.PICASA_CLIENT['POOL_SIZE']))
+    for img_path, photo, error in manager.run(uploads):
+        if error is None:
+            print("> uploaded: img '%s'" % (img_path,))
+        else:
+            print("> failed: img '%s': %s" % (img_path, error))
+    if uploads:
+        print('> uploaded %d pictures, %.1f MB in %.1fs, %.1f MB/s, %d failed, '
+              '%d worth retrying.' % (
+                  manager.n_files, manager.n_bytes / 1e6, manager.seconds,
+                  manager.throughput / 1e6, len(manager.failures), len(manager.retryable)))
+
+    downloads = []
+    planned = set()
+    for action in plan.download:
+        album_path = os.path.join(path, action['album'])
+        ensure_directory(album_path)
+        img_filename = '%s.jpg' % (action['time'].strftime('%Y-%m-%dT%H%M%S'), )
+        img_path = os.path.join(album_path, img_filename)
+        if img_path in planned or os.path.exists(img_path):  # another photo of the same second
+            img_filename = '%s-%s.jpg' % (img_filename[:-4], action['uuid'])
+            img_path = os.path.join(album_path, img_filename)
+        if not os.path.exists(img_path):
+            planned.add(img_path)
+            downloads.append((action['url'], img_path, action['size']))
+        else:
+            print("> exists: img '%s'" % (img_filename,))
+
+    manager = DownloadManager()
+    for img_path, n_bytes, error in manager.run(downloads):
+        if error is None:
+            print("> downloaded: img '%s'" % (os.path.basename(img_path),))
+        else:
+            print("> failed: img '%s': %s" % (os.path.basename(img_path), error))
+    if downloads:
+        print('> downloaded %d pictures, %.1f MB in %.1fs, %.1f MB/s, %d failed.' % (
+            manager.n_files, manager.n_bytes / 1e6, manager.seconds, manager.throughput / 1e6,
+            len(manager.failures)))
 
 
 @cli.command('sync')
@@ -78,7 +221,18 @@ def init(login, password, dry_run):
 @click.argument('path')
 @click.option('--password', prompt=True, hide_input=True)
 @click.option('--preinit/--no-preinit', default=True)
-def sync(login, path, password, preinit):
+@click.option('--jobs', default=settings.LOCAL_SCAN['JOBS'], type=int,
+              help='Number of processes used to scan local images.')
+@click.option('--rescan/--no-rescan', default=False,
+              help='Probe every local image again instead of using the scan index.')
+@click.option('--tz', type=click.Choice([TZ_ENGINE_ONLINE, TZ_ENGINE_OFFLINE]),
+              default=settings.TIMEZONE['ENGINE'],
+              help='How the timezone of GPS-tagged images is resolved.')
+@click.option('--dry-run/--no-dry-run', default=False,
+              help='Print the plan instead of executing it.')
+@click.option('--plan', 'plan_path', type=click.Path(dir_okay=False),
+              help='Save the plan, as JSON, to this file.')
+def sync(login, path, password, preinit, jobs, rescan, tz, dry_run, plan_path):
     """Synchronizes the <login> Google+ Photos account with a
     local folder in <path>.
     Procedure:
@@ -88,59 +242,176 @@ def sync(login, path, password, preinit):
     every online album.
     Pictures in <path> are deep-located and moved to their root
     album directory if needed.
+    A plan of the synchronization is made first: see it with --dry-run.
     """
     if preinit:
-        init(login, password)
+        fetch_catalog(login, password, utils.mail2username(login), refresh=True)
+    init_user_database(utils.mail2username(login))
+    init_scan_index(utils.mail2username(login))
+
+    images = list_valid_images(path, deep=True, jobs=jobs, ordered=False, index=True,
+                               rescan=rescan, tz_engine=tz)
+    start = time.time()
+    plan = plan_sync(images, load_remote_photos(), load_album_names())  # as images are scanned
+    log.debug('sync scanned and planned in %.1fs.' % (time.time() - start))
+    if plan_path:
+        plan.save(plan_path)
+    print_plan(plan, verbose=dry_run)
+    if not dry_run:
+        if plan.upload and pc.token is None:
+            pc.authenticate(login, password)
+        execute_plan(plan, path)
+
+
+@cli.command('dupes')
+@click.argument('path')
+@click.option('--min-size', default=1, type=int, help='Ignore files smaller than this, in bytes.')
+@click.option('--similar/--identical', default=False,
+              help='Look for images that look alike rather than identical files.')
+@click.option('--distance', default=DUPES_MAX_DISTANCE, type=int,
+              help='Maximal distance between the perceptual hashes of similar images.')
+@click.option('--algorithm', type=click.Choice(CHECKSUM_ALGORITHMS), default=CHECKSUM_MD5,
+              help='Checksum used to compare files.')
+@click.option('--jobs', default=settings.LOCAL_SCAN['JOBS'], type=int,
+              help='Number of processes (or threads, for checksums) used to scan local files.')
+def dupes(path, min_size, similar, distance, algorithm, jobs):
+    """Lists the groups of identical files, or similar images, in <path>."""
+    if similar:
+        if not phash_is_available():
+            raise click.UsageError('finding similar images requires Pillow.')
+        groups = find_similar_images(hash_images(path, deep=True, jobs=jobs), distance)
+        for group in groups:
+            print('%d similar images:' % len(group))
+            for img in group:
+                print('\t%s [%dx%d]' % (img.path, img.width, img.height))
+        print('> %d groups of similar images.' % len(groups))
+        return
+
+    report = find_duplicates(path, deep=True, min_size=min_size, algorithm=algorithm, jobs=jobs)
+    for size, paths in zip(report.sizes, report.groups):
+        print('%d identical files of %d bytes:' % (len(paths), size))
+        for p in paths:
+            print('\t%s' % p)
+    print('> %d files, %d groups of duplicates, %d bytes reclaimable.' % (
+        report.n_files, len(report.groups), report.reclaimable_bytes))
+    print('> %d partial hashes, %d full hashes, %d bytes read.' % (
+        report.n_partial_hashes, report.n_full_hashes, report.bytes_read))
+
+
+@cli.command('tz-index')
+@click.argument('geojson_path')
+@click.option('--grid-size', default=settings.TIMEZONE['GRID_SIZE'], type=float,
+              help='Cell size of the index, in degrees.')
+def tz_index(geojson_path, grid_size):
+    """Builds the index used by the offline timezone engine from a
+    GeoJSON file of timezone boundaries, e.g. the combined.json released
+    by the timezone-boundary-builder project.
+    """
+    index = build_tz_index(geojson_path, grid_size=grid_size)
+    print('indexed %d cells.' % len(index.cells))
+
+
+@cli.command('fake-pwa')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8080, type=int)
+@click.option('--albums', default=10, type=int, help='Number of generated albums.')
+@click.option('--photos', default=100, type=int, help='Number of photos per generated album.')
+@click.option('--samples', type=click.Path(file_okay=False, exists=True),
+              help='Serve the sample-*.json files of this directory instead.')
+@click.option('--latency', default=0.0, type=float, help='Seconds taken by every answer.')
+@click.option('--error-rate', default=0.0, type=float, help='Ratio of requests failing with 500.')
+@click.option('--throttle', default=0, type=int,
+              help='Requests per second answered, the others get 503.')
+@click.option('--seed', default=0, type=int, help='Seed of the generated data and errors.')
+def fake_pwa(host, port, albums, photos, samples, latency, error_rate, throttle, seed):
+    """Serves a local stand-in of the Picasa Web API, to try or benchmark
+    ptoolbox offline: point it there with --base-url.
+    """
+    if samples:
+        store = FakeStore.from_samples(samples)
     else:
-        init_user_database(utils.mail2username(login))
-
-    # uploads existing images
-    for img in list_valid_images(path, deep=True):
-        if img.unique_id:
-            qs = models.GooglePhoto.select().where(models.GooglePhoto.unique_id == img.unique_id)
-            if qs.count() == 1:
-                continue
-            # img.ensure_time_tag(eventual_replace=now())
-            # img.upload()
-            # models.GooglePhoto.update(status = STATUS_SYNCED)
-            continue
-
-        # if there's no image unique ID in the tags, use the time property.
-        if img.time == None:
-            print('ignoring %s' % img.name)
-            continue  # ignore images that have no time, pollutes online album. Move them ?
-        qs = models.GooglePhoto.select().where(models.GooglePhoto.time == img.time)
-        cnt = qs.count()
-        if cnt == 0:
-            # upload it, ensure timestamp both in file and in gphoto:timestamp,
-            # mark as synchronized.
-            print('must upload %s' % img.name)
-            pass
-        elif cnt == 1:
-            # there's a unique match, mark as synchronized and continue
-            continue
-        else:
-            # more than one match means a conflict. must check later on with
-            # the MD5s as uniqueIDs.
-            continue
-
-    # downloads missing images (all the ones marked as status != synchronized)
-
-    # # TODO: make a first pass to check how many we'll be downloading,
-    # # conflicts, etc. THEN, synchronize. Also enables --dry-run flags !
-    # for album in models.GoogleAlbum.select():
-    #     album_path = os.path.join(path, album.name)
-    #     ensure_directory(album_path)
-    #     for img in album.photos:
-    #         img_filename = '%s.jpg' % (img.time.strftime('%Y-%m-%dT%H%M%S'), )
-    #         img_path = os.path.join(album_path, img_filename)
-    #         if not os.path.exists(img_path):
-    #             download_file(img.url, img_path)
-    #             ensure_tag_file_date(img_path, img.time)
-    #             print("> downloaded: img '%s'" % (img_filename,))
-    #         else:
-    #             print("> exists: img '%s'" % (img_filename,))
-    # pass
+        store = FakeStore.synthetic(albums, photos, seed)
+    server = FakePWAServer(store, host, port, latency, error_rate, throttle, seed=seed)
+    print('> serving %d albums, %d photos on %s' % (
+        len(store.albums), sum(len(photos) for photos in store.photos.values()), server.url))
+    print('> e.g. ptoolbox --base-url %s init <any login>' % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('> %(requests)d requests, %(errors)d errors, %(throttled)d throttled, '
+              '%(not_modified)d not modified.' % server.stats)
+
+
+@cli.group('bench')
+def bench():
+    """Measures the performance of ptoolbox on your own data."""
+
+
+@bench.command('exif')
+@click.argument('path')
+def bench_exif_engines(path):
+    """Compares the EXIF engines on the images in <path>."""
+    n_images, n_agree, timings = bench_exif(path)
+    print('%d images with EXIF tags, %d identically parsed by every engine.' % (n_images, n_agree))
+    for engine, seconds in sorted(timings.items()):
+        print('%s:\t%.1f us/image' % (engine, seconds * 1e6))
+
+
+@bench.command('checksum')
+@click.argument('path')
+@click.option('--jobs', default=1, type=int, help='Number of hashing threads.')
+def bench_checksum_algorithms(path, jobs):
+    """Measures the throughput of the checksum algorithms on the files in <path>."""
+    n_files, n_bytes, throughputs = bench_checksum(path, jobs=jobs)
+    print('%d files, %.1f MB.' % (n_files, n_bytes / 1e6))
+    for algorithm, throughput in sorted(throughputs.items()):
+        print('%s:\t%.1f MB/s' % (algorithm, throughput / 1e6))
+
+
+@bench.command('db')
+@click.option('--rows', default=20000, type=int, help='Number of photos written.')
+@click.option('--batch-size', default=settings.CATALOG['BATCH_SIZE'], type=int,
+              help='Number of rows written per transaction.')
+def bench_db_writes(rows, batch_size):
+    """Measures the catalog writes, one transaction per row against batches."""
+    for method, throughput in sorted(bench_db(rows, batch_size).items()):
+        print('%s:\t%.0f rows/s' % (method, throughput))
+
+
+@bench.command('feed')
+@click.argument('paths', nargs=-1, required=True)
+def bench_feed_entries(paths):
+    """Compares the reading of feed entries as models and as records, on
+    feeds saved as JSON files, e.g. sample-recentpictures.json.
+    """
+    for path in paths:
+        n_entries, n_agree, timings = bench_feed(path)
+        print('%s: %d entries, %d identically read.' % (os.path.basename(path), n_entries, n_agree))
+        for method, seconds in sorted(timings.items()):
+            print('%s:\t%.1f us/entry' % (method, seconds * 1e6))
+
+
+@bench.command('crawl')
+@click.option('--albums', default=10, type=int)
+@click.option('--photos', default=1000, type=int, help='Number of photos per album.')
+@click.option('--jobs', default=settings.CATALOG['JOBS'], type=int,
+              help='Number of albums fetched concurrently.')
+@click.option('--latency', default=0.05, type=float, help='Seconds taken by every answer.')
+@click.option('--error-rate', default=0.0, type=float)
+@click.option('--throttle', default=0, type=int, help='Requests per second served.')
+def bench_crawl_catalog(albums, photos, jobs, latency, error_rate, throttle):
+    """Measures the fetch of a catalog from a local fake-pwa server."""
+    n_photos, seconds, client_stats, server_stats = bench_crawl(
+        albums, photos, jobs, latency, error_rate, throttle)
+    print('%d photos in %.2fs, %.0f photos/s.' % (
+        n_photos, seconds, n_photos / seconds if seconds else 0))
+    print('client: %(requests)d requests over %(connections)d connections, %(retries)d retries, '
+          '%(throttle_events)d throttled, concurrency limit %(concurrency_limit)d.' % client_stats)
+    print('server: %(requests)d requests, %(errors)d errors, %(throttled)d throttled.'
+          % server_stats)
 
 
 @cli.command('flatten')
@@ -5,6 +5,14 @@
 ALBUM_STRATEGY_ASK = 'ask'  # ask the user for a default name
 ALBUM_STRATEGY_USE_DEFAULT = 'default'  # use default album name
 
+""" Define how EXIF tags are read"""
+EXIF_ENGINE_EXIFREAD = 'exifread'  # complete parsing by the exifread library
+EXIF_ENGINE_FAST = 'fast'  # only the tags we use, see ptoolbox.exif
+
+""" Define how the timezone of GPS-tagged pictures gets resolved"""
+TZ_ENGINE_ONLINE = 'online'  # Google Timezone API
+TZ_ENGINE_OFFLINE = 'offline'  # local index of timezone boundaries, see ptoolbox.tz
+
 
 default_settings = {
 
@@ -13,11 +21,73 @@ default_settings = {
     'DEFAULT_ALBUM': None,
     'N_MAX_ATTEMPTS': 5,
     'ALBUM_STRATEGY': ALBUM_STRATEGY_USE_DEFAULT,
+    'EXIF_ENGINE': EXIF_ENGINE_FAST,
 
     'PICASA_CLIENT': {
+        'BASE_URL': 'https://picasaweb.google.com/',  # e.g. a google.fake server
+        'AUTH_URL': 'https://www.google.com/accounts/ClientLogin',
         'DATA_TYPE': 'json',
         'PAGE_SIZE': 50,
-    }
+        'MAX_PAGE_SIZE': 1000,  # largest page the server accepts
+        'FEED_CHUNK_SIZE': 65536,  # bytes read at once from a feed, see google.stream
+        'JOBS': 4,  # pages fetched concurrently, see PicasaClient._paginated_fetch
+        'POOL_SIZE': 10,  # connections kept alive to the Google servers
+        'BACKOFF_BASE': 0.5,  # in seconds, see google.backoff_delay
+        'BACKOFF_MAX': 30.0,
+        'RETRY_BUDGET': 0.2,  # retries allowed per request, see google.RetryBudget
+        'ALBUM_CACHE_TTL': 300,  # in seconds, see google.AlbumCache
+        'RATE': 50,  # requests per second, 0 for no limit, see google.throttle
+        'BURST': 50,  # requests sent at once before the rate applies
+        'MIN_CONCURRENCY': 1,  # requests in flight, adapted to the server in between
+        'MAX_CONCURRENCY': 32,
+        'LATENCY_THRESHOLD': 10.0,  # in seconds, slower answers count as throttling
+        'BREAKER_THRESHOLD': 10,  # failures in a row suspending the requests
+        'BREAKER_COOLDOWN': 30.0,  # in seconds, before the requests resume
+        'CONCURRENCY': 100,  # requests in flight at once, see google.aio.AsyncPicasaClient
+    },
+
+    'RESPONSE_CACHE': {
+        'ENABLED': True,  # conditional GETs of the feeds, see google.cache
+        'MAX_SIZE': 256 * 1024 * 1024,  # in bytes, least recently used responses dropped first
+    },
+
+    'DOWNLOAD': {
+        'JOBS': 8,  # files downloaded concurrently, see ptoolbox.download
+        'CHUNK_SIZE': 256 * 1024,  # bytes read and written at once
+    },
+
+    'UPLOAD': {
+        'JOBS': 4,  # files uploaded concurrently, see ptoolbox.upload
+        'QUEUE_SIZE': 16,  # files waiting for a worker
+        'BATCH_SIZE': 100,  # uploaded photos written to the catalog per transaction
+    },
+
+    'CATALOG': {
+        'JOBS': 4,  # albums fetched concurrently, see cli.fetch_catalog
+        'BATCH_SIZE': 5000,  # rows written per transaction, see google.models.CatalogWriter
+        'PRAGMAS': (
+            ('journal_mode', 'wal'),
+            ('synchronous', 'normal'),  # no fsync per transaction, the WAL stays consistent
+            ('cache_size', -64000),  # in KiB
+            ('mmap_size', 256 * 1024 * 1024),
+        ),
+    },
+
+    'LOCAL_SCAN': {
+        'JOBS': 1,  # number of worker processes used to scan local images
+        'CHUNK_SIZE': 16,  # number of files handed to a worker at once
+        'INDEX_BATCH_SIZE': 1000,  # number of scan index writes per transaction
+        'PHASH': False,  # compute perceptual hashes, requires Pillow
+    },
+
+    'TIMEZONE': {
+        'ENGINE': TZ_ENGINE_ONLINE,
+        'GRID_SIZE': 1.0,  # cell size of the offline index, in degrees
+        'CACHE': True,  # memoize the online lookups, see ptoolbox.tz.TimezoneCache
+        'CACHE_SIZE': 100000,
+        'CACHE_PRECISION': 0.01,  # in degrees, roughly 1km
+        'CACHE_PERIOD': 86400,  # in seconds
+    },
 }
 
 
@@ -27,7 +97,7 @@ class Settings(object):
     """
 
     def __init__(self, **kwargs):
-        for k, v in kwargs.iteritems():
+        for k, v in kwargs.items():
             setattr(self, k, v)
 
 settings = Settings(**default_settings)
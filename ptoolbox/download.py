@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+Downloads of the remote pictures.
+
+A file is written as '<path>.part' and renamed once complete, so that
+<path> is either absent or complete: an interrupted run never leaves a
+truncated JPEG behind. The next run resumes the '.part' file with an HTTP
+Range request. DownloadManager runs many downloads concurrently over a
+pool of connections and measures their aggregate throughput.
+"""
+
+import io
+import os
+import os.path
+import re
+import time
+
+from ptoolbox import log
+
+from .conf import settings
+from .google import new_session, request_with_retry
+from .parallel import imap_bounded
+
+DOWNLOAD_PART_SUFFIX = '.part'
+
+
+def _full_size(res):
+    """Size of the whole file, as announced by an answer to a GET, or None."""
+    match = re.match(r'bytes (?:\d+-\d+|\*)/(\d+)$', res.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    if res.status_code == 200 and 'Content-Encoding' not in res.headers and \
+            res.headers.get('Content-Length', '').isdigit():
+        return int(res.headers['Content-Length'])
+    return None
+
+
+def download(url, path, size=None, session=None, chunk_size=None):
+    """Downloads <url> to <path>, resuming a previous attempt if any. The
+    file is complete once it has the size announced by the server; a file
+    cut short is kept to be resumed. <size> is the expected size, e.g. as
+    told by the catalog: a file of this size is not requested again, and
+    a complete file of another size is only warned about. Returns the
+    number of bytes received.
+    """
+    if chunk_size is None:
+        chunk_size = settings.DOWNLOAD['CHUNK_SIZE']
+    part_path = path + DOWNLOAD_PART_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    n_bytes = 0
+    full_size = None
+    if size is None or offset != size:
+        headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+        res = request_with_retry('GET', session=session, url=url, headers=headers, stream=True)
+        try:
+            full_size = _full_size(res)
+            if res.status_code == 416 and offset and full_size == offset:
+                mode = None  # the part file is complete already
+            elif res.status_code == 206 and offset:
+                mode = 'ab'
+            elif res.status_code == 200:  # the server ignored the range, start over
+                mode = 'wb'
+            else:
+                if res.status_code == 416:  # the part file is no prefix of the file
+                    os.remove(part_path)
+                raise ValueError("could not download '%s': status %d" % (url, res.status_code))
+            if mode is not None:
+                with io.open(part_path, mode, buffering=chunk_size) as f:
+                    for chunk in res.iter_content(chunk_size):
+                        f.write(chunk)
+                        n_bytes += len(chunk)
+        finally:
+            res.close()
+
+    part_size = os.path.getsize(part_path)
+    if full_size is not None and part_size != full_size:
+        if part_size > full_size:
+            os.remove(part_path)
+        raise ValueError("could not download '%s': got %d bytes out of %d" % (
+            url, part_size, full_size))
+    if size is not None and part_size != size:
+        log.warning("download: '%s' has %d bytes, %d were expected." % (url, part_size, size))
+    os.rename(part_path, path)
+    return n_bytes
+
+
+class DownloadManager(object):
+    """Downloads files <jobs> at a time, over a pool of as many connections.
+    Failed downloads do not stop the others, they are reported along with
+    the others; run the manager again to resume them.
+    """
+
+    def __init__(self, jobs=None, chunk_size=None):
+        if jobs is None:
+            jobs = settings.DOWNLOAD['JOBS']
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+        self.session = new_session(jobs)
+        self.n_files = 0
+        self.n_bytes = 0
+        self.failures = []  # (path, error)
+        self.seconds = 0.0
+
+    def _download(self, item):
+        url, path, size = item
+        try:
+            return path, download(url, path, size, self.session, self.chunk_size), None
+        except (ValueError, IOError, OSError) as e:  # requests errors are IOErrors
+            return path, 0, e
+
+    def run(self, downloads):
+        """Downloads the (url, path, size or None) of <downloads>, yields
+        (path, bytes received, error or None) as they complete.
+        """
+        start = time.time()
+        try:
+            for path, n_bytes, error in imap_bounded(self._download, downloads, self.jobs,
+                                                     ordered=False):
+                if error is None:
+                    self.n_files += 1
+                    self.n_bytes += n_bytes
+                else:
+                    log.debug("download: '%s' failed: %s" % (path, error))
+                    self.failures.append((path, error))
+                yield path, n_bytes, error
+        finally:
+            self.seconds += time.time() - start
+
+    @property
+    def throughput(self):
+        """Bytes received per second, all downloads together."""
+        return self.n_bytes / self.seconds if self.seconds else 0.0
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+Duplicate files detection.
+
+Comparing every file by its full checksum means reading the whole library.
+Instead, files go through a funnel where each stage only keeps the files
+that still collide with another one:
+    1. files are grouped by size, which costs no read at all,
+    2. then by the hash of a small chunk at their head and tail,
+    3. and only then by the hash of their whole content.
+
+Near-duplicate images (resized, recompressed...) are found by their
+perceptual hashes instead, see ptoolbox.phash.
+"""
+
+from collections import defaultdict
+from multiprocessing import Pool
+
+from .checksum import checksum_many, new_hash, CHECKSUM_MD5
+from .conf import settings
+from .models import ImageInfo
+from .path import fastwalk, probe_image
+from .phash import BKTree
+
+DUPES_CHUNK_SIZE = 16384  # bytes hashed at the head and the tail of a file
+DUPES_MAX_DISTANCE = 6  # maximal Hamming distance of similar perceptual hashes
+
+
+class DuplicatesReport(object):
+    """Groups of identical files, along with the work needed to find them."""
+
+    def __init__(self):
+        self.groups = []  # lists of paths of identical files
+        self.sizes = []  # file size of each group
+        self.n_files = 0
+        self.n_partial_hashes = 0
+        self.n_full_hashes = 0
+        self.bytes_read = 0
+
+    def add_group(self, size, paths):
+        self.groups.append(sorted(paths))
+        self.sizes.append(size)
+
+    @property
+    def reclaimable_bytes(self):
+        """Bytes freed by keeping a single file of every group."""
+        return sum(size * (len(paths) - 1) for size, paths in zip(self.sizes, self.groups))
+
+
+def partial_hash(path, size, chunk_size=DUPES_CHUNK_SIZE, algorithm=CHECKSUM_MD5):
+    h = new_hash(algorithm)
+    with open(path, 'rb') as f:
+        h.update(f.read(chunk_size))
+        if size > chunk_size:
+            f.seek(max(chunk_size, size - chunk_size))
+            h.update(f.read(chunk_size))
+    return h.hexdigest()
+
+
+def _collisions(groups):
+    return [paths for paths in groups.values() if len(paths) > 1]
+
+
+def find_duplicates(path, deep=True, min_size=1, chunk_size=DUPES_CHUNK_SIZE,
+                    algorithm=CHECKSUM_MD5, jobs=1):
+    """Finds the identical files under <path> that weigh at least <min_size>
+    bytes, see module documentation. Full checksums are computed in <jobs>
+    threads. Returns a DuplicatesReport.
+    """
+    report = DuplicatesReport()
+
+    by_size = defaultdict(list)
+    for e in fastwalk(path, deep):
+        size = e.stat().st_size
+        report.n_files += 1
+        if size >= min_size:
+            by_size[size].append(e.path)
+
+    candidates = []  # (size, paths) that need a full checksum
+    for size, same_size in sorted(by_size.items()):
+        if len(same_size) < 2:
+            continue
+        by_chunks = defaultdict(list)
+        for p in same_size:
+            by_chunks[partial_hash(p, size, chunk_size, algorithm)].append(p)
+            report.n_partial_hashes += 1
+            report.bytes_read += min(size, 2 * chunk_size)
+
+        for same_chunks in _collisions(by_chunks):
+            if size <= 2 * chunk_size:  # the chunks covered the whole files
+                report.add_group(size, same_chunks)
+            else:
+                candidates.append((size, same_chunks))
+
+    paths = [p for _, same_chunks in candidates for p in same_chunks]
+    checksums = dict(checksum_many(paths, algorithm, jobs))
+    for size, same_chunks in candidates:
+        by_content = defaultdict(list)
+        for p in same_chunks:
+            by_content[checksums[p]].append(p)
+            report.n_full_hashes += 1
+            report.bytes_read += size
+        for same_content in _collisions(by_content):
+            report.add_group(size, same_content)
+    return report
+
+
+def _phash_image(path):
+    probe = probe_image(path, checksum=False, phash=True)
+    if not probe.is_jpeg() or not probe.has_size():
+        return None
+    return ImageInfo(path, probe.width, probe.height, None, phash=probe.phash)
+
+
+def hash_images(path, deep=True, jobs=1):
+    """Yields the ImageInfo of the JPEG images in <path>, with their
+    perceptual hash only: unlike utils.list_valid_images, neither checksums
+    nor times are computed. With <jobs> greater than 1, images are hashed by
+    a pool of worker processes.
+    """
+    paths = (e.path for e in fastwalk(path, deep))
+    if jobs <= 1:
+        for img in (_phash_image(p) for p in paths):
+            if img is not None:
+                yield img
+        return
+
+    pool = Pool(jobs)
+    try:
+        for img in pool.imap_unordered(_phash_image, paths, settings.LOCAL_SCAN['CHUNK_SIZE']):
+            if img is not None:
+                yield img
+    except BaseException:  # includes GeneratorExit, when the caller stops early
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+
+def find_similar_images(images, max_distance=DUPES_MAX_DISTANCE):
+    """Groups the ImageInfo of <images> that look alike: two images are in
+    the same group if a chain of images links them, each within
+    <max_distance> of the next. Images without a perceptual hash are
+    ignored. Returns the groups of more than one image.
+    """
+    images = [img for img in images if img.phash is not None]
+    tree = BKTree()
+    for i, img in enumerate(images):
+        tree.add(img.phash, i)
+
+    parents = list(range(len(images)))  # union-find of the image indexes
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, img in enumerate(images):
+        for _, j in tree.search(img.phash, max_distance):
+            parents[root(j)] = root(i)
+
+    groups = defaultdict(list)
+    for i, img in enumerate(images):
+        groups[root(i)].append(img)
+    return sorted((sorted(group, key=lambda img: img.path) for group in groups.values()
+                   if len(group) > 1), key=lambda group: group[0].path)
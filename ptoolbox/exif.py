@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+Minimal EXIF reader, for the handful of tags we actually use.
+
+It walks IFD0, the Exif IFD and the GPS IFD of the TIFF payload of an APP1
+segment (see path.probe_image), stops as soon as the requested tags are
+found and returns native Python values, keyed like exifread does:
+strings for ASCII tags, ints for integers, floats for rationals; tags with
+several values come as lists.
+"""
+
+import struct
+
+TIFF_LITTLE_ENDIAN = b'II'
+TIFF_BIG_ENDIAN = b'MM'
+
+IFD_IMAGE = 'Image'
+IFD_EXIF = 'EXIF'
+IFD_GPS = 'GPS'
+
+TAG_EXIF_IFD_POINTER = 0x8769
+TAG_GPS_IFD_POINTER = 0x8825
+TAG_THUMBNAIL_OFFSET = 0x0201  # JPEGInterchangeFormat, in IFD1
+TAG_THUMBNAIL_LENGTH = 0x0202  # JPEGInterchangeFormatLength, in IFD1
+
+# (ifd, tag id) -> tag name, as named by exifread
+TAG_NAMES = {
+    (IFD_IMAGE, 0x0132): 'Image DateTime',
+    (IFD_EXIF, 0x9003): 'EXIF DateTimeOriginal',
+    (IFD_EXIF, 0x9004): 'EXIF DateTimeDigitized',
+    (IFD_EXIF, 0xa420): 'EXIF ImageUniqueID',
+    (IFD_GPS, 0x0001): 'GPS GPSLatitudeRef',
+    (IFD_GPS, 0x0002): 'GPS GPSLatitude',
+    (IFD_GPS, 0x0003): 'GPS GPSLongitudeRef',
+    (IFD_GPS, 0x0004): 'GPS GPSLongitude',
+}
+
+IFD_POINTERS = {
+    TAG_EXIF_IFD_POINTER: IFD_EXIF,
+    TAG_GPS_IFD_POINTER: IFD_GPS,
+}
+
+# TIFF field type -> (struct format, size in bytes)
+FIELD_TYPES = {
+    1: ('B', 1),  # BYTE
+    2: ('s', 1),  # ASCII
+    3: ('H', 2),  # SHORT
+    4: ('I', 4),  # LONG
+    5: ('II', 8),  # RATIONAL
+    7: ('B', 1),  # UNDEFINED
+    9: ('i', 4),  # SLONG
+    10: ('ii', 8),  # SRATIONAL
+}
+
+
+class TiffReader(object):
+
+    def __init__(self, data):
+        self.data = data
+        order = data[:2]
+        if order == TIFF_LITTLE_ENDIAN:
+            self.endian = '<'
+        elif order == TIFF_BIG_ENDIAN:
+            self.endian = '>'
+        else:
+            raise ValueError('not a TIFF payload')
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def first_ifd(self):
+        return self.unpack('I', 4)[0]
+
+    def next_ifd(self, offset):
+        n_entries, = self.unpack('H', offset)
+        return self.unpack('I', offset + 2 + 12 * n_entries)[0]
+
+    def entries(self, offset):
+        """Yields (tag id, field type, count, value offset) of an IFD."""
+        n_entries, = self.unpack('H', offset)
+        for i in range(n_entries):
+            entry = offset + 2 + 12 * i
+            tag, field_type, count = self.unpack('HHI', entry)
+            yield tag, field_type, count, entry + 8
+
+    def value(self, field_type, count, offset):
+        fmt, size = FIELD_TYPES[field_type]
+        if size * count > 4:  # the value does not fit the entry: it's an offset
+            offset, = self.unpack('I', offset)
+        if field_type == 2:
+            value = self.data[offset:offset + count].split(b'\0', 1)[0]
+            if not isinstance(value, str):  # Python 3
+                value = value.decode('ascii', 'replace')
+            return value.strip()
+        if field_type in (5, 10):
+            values = self.unpack(fmt * count, offset)
+            values = [float(num) / den if den else 0.0
+                      for num, den in zip(values[::2], values[1::2])]
+        else:
+            values = list(self.unpack('%d%s' % (count, fmt), offset))
+        return values[0] if count == 1 else values
+
+
+def read_tags(data, names=None):
+    """Returns the tags of the TIFF payload <data>, restricted to <names>
+    (default: all the tags of TAG_NAMES). Missing tags are absent.
+    """
+    wanted = set(TAG_NAMES.values() if names is None else names)
+    wanted_ifds = set(ifd for (ifd, _), name in TAG_NAMES.items() if name in wanted)
+    tags = {}
+    if not data:
+        return tags
+    try:
+        reader = TiffReader(data)
+        ifds = [(IFD_IMAGE, reader.first_ifd())]
+        while ifds and wanted:
+            ifd, offset = ifds.pop(0)
+            for tag, field_type, count, value_offset in reader.entries(offset):
+                if field_type not in FIELD_TYPES:
+                    continue
+                if ifd == IFD_IMAGE and tag in IFD_POINTERS:
+                    if IFD_POINTERS[tag] in wanted_ifds:
+                        sub_ifd_offset = reader.value(field_type, count, value_offset)
+                        ifds.append((IFD_POINTERS[tag], sub_ifd_offset))
+                    continue
+                name = TAG_NAMES.get((ifd, tag))
+                if name in wanted:
+                    tags[name] = reader.value(field_type, count, value_offset)
+                    wanted.discard(name)
+                    if not wanted:
+                        break
+    except (ValueError, struct.error):
+        pass  # corrupted payload: return what was found until then
+    return tags
+
+
+def read_thumbnail(data):
+    """Returns the JPEG thumbnail embedded in the TIFF payload <data> (in
+    IFD1, the IFD following IFD0), or None.
+    """
+    if not data:
+        return None
+    try:
+        reader = TiffReader(data)
+        ifd1 = reader.next_ifd(reader.first_ifd())
+        if not ifd1:
+            return None
+        values = {}
+        for tag, field_type, count, value_offset in reader.entries(ifd1):
+            if tag in (TAG_THUMBNAIL_OFFSET, TAG_THUMBNAIL_LENGTH) and field_type in (3, 4):
+                values[tag] = reader.value(field_type, count, value_offset)
+        offset, length = values[TAG_THUMBNAIL_OFFSET], values[TAG_THUMBNAIL_LENGTH]
+    except (KeyError, ValueError, struct.error):
+        return None
+    thumbnail = data[offset:offset + length]
+    return thumbnail if len(thumbnail) == length else None
@@ -3,41 +3,230 @@
 import os
 import re
 import json
+import random
 import requests
+import threading
+import time
 
 from datetime import datetime
-from requests.exceptions import ConnectionError, SSLError
+from xml.sax.saxutils import escape
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, SSLError
 
 from ptoolbox import log
 from ptoolbox.conf import settings
+from ptoolbox.parallel import imap_bounded
 
 from .utils import dt2ts, mail2username, g_xml_value, g_json_value
-from .models import GoogleAlbum, GooglePhoto
+from .records import AlbumRecord, PhotoRecord
+from .stream import FeedParser
+from .throttle import Throttle
 from .constants import ACCESS_PRIVATE, ALBUM_FIELDS, PHOTO_FIELDS
 
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)  # any other status is final
 
-def request_with_retry(method, n_retries=settings.N_MAX_ATTEMPTS, **kwargs):
-    s = requests.Session()
-    req = requests.Request(method, **kwargs)
-    prepped = req.prepare()
+
+class RequestError(ValueError):
+    """A request answered with an unexpected status. It may succeed later
+    if the status is retryable, see RETRYABLE_STATUSES.
+    """
+
+    def __init__(self, message, status_code):
+        super(RequestError, self).__init__(message)
+        self.status_code = status_code
+
+    @property
+    def retryable(self):
+        return self.status_code in RETRYABLE_STATUSES
+
+
+def new_session(pool_size=None):
+    """Returns a session keeping up to <pool_size> connections alive per host."""
+    if pool_size is None:
+        pool_size = settings.PICASA_CLIENT['POOL_SIZE']
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def pool_stats(session):
+    """Returns the number of connections opened by <session> and the number
+    of requests they served.
+    """
+    stats = {'connections': 0, 'requests': 0}
+    for adapter in set(session.adapters.values()):  # the same adapter serves http and https
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                stats['connections'] += pool.num_connections
+                stats['requests'] += pool.num_requests
+    stats['reused'] = stats['requests'] - stats['connections']
+    return stats
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """Exponential backoff with full jitter: a random delay, in seconds,
+    up to base * 2^attempt, capped to <cap>.
+    """
+    if base is None:
+        base = settings.PICASA_CLIENT['BACKOFF_BASE']
+    if cap is None:
+        cap = settings.PICASA_CLIENT['BACKOFF_MAX']
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class RetryBudget(object):
+    """Caps the retries to a <ratio> of the requests, so that a failing
+    server does not get <n_retries> times the normal load. <min_retries>
+    are allowed at first, before any request was made.
+    """
+
+    def __init__(self, ratio=None, min_retries=10):
+        if ratio is None:
+            ratio = settings.PICASA_CLIENT['RETRY_BUDGET']
+        self.ratio = ratio
+        self.max_tokens = float(min_retries)
+        self.tokens = float(min_retries)
+        self.n_retries = 0
+        self.n_denied = 0
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.n_retries += 1
+                return True
+            self.n_denied += 1
+            return False
+
+
+def retry_after(res):
+    """Returns the delay asked by a Retry-After header, in seconds, or 0."""
     try:
-        res = s.send(prepped)
-    except (ValueError, IOError, SSLError, ConnectionError):
-        log.debug("request: '%s %s' failed, retrying." % (method, kwargs['url']))
-        if n_retries <= 1:
-            raise
-        return request_with_retry(method, n_retries=n_retries-1, **kwargs)
-    if res.status_code not in (200, 201, 202, 204):
-        return request_with_retry(method, n_retries=n_retries-1, **kwargs)
-    return res
+        return float(res.headers.get('Retry-After', 0))
+    except (AttributeError, ValueError):  # no headers, or an HTTP date
+        return 0
+
+
+def request_with_retry(method, n_retries=settings.N_MAX_ATTEMPTS, session=None, budget=None,
+                       throttle=None, read=None, **kwargs):
+    """Sends a request, tries again on network errors and retryable statuses
+    (see RETRYABLE_STATUSES) after a backoff delay, up to <n_retries>
+    attempts and within the retry <budget>, if any. Every attempt is
+    admitted by the <throttle>, if any, which may raise CircuitOpenError.
+    Other statuses are returned as is: it's up to the caller to check them.
+    With <read>, read(response) is returned instead of the response: for
+    streamed responses, the body is then read within the retries, and an
+    answer cut short is tried again as well, and the <throttle> counts the
+    request in flight until its body is read.
+    """
+    if session is None:
+        session = requests.Session()
+    # the time taken to send a body, e.g. an upload, tells nothing of the server load
+    timed = kwargs.get('data') is None
+    attempt = 1
+    while True:
+        if budget is not None:
+            budget.deposit()
+        started = throttle.acquire() if throttle is not None else None
+        status_code = None  # failed, unless answered in full
+        try:
+            res = session.request(method, **kwargs)
+        except (ValueError, IOError, SSLError, ConnectionError):
+            if attempt >= n_retries or (budget is not None and not budget.withdraw()):
+                raise
+            reason = 'failed'
+            delay = backoff_delay(attempt - 1)
+        else:
+            status_code = res.status_code
+            if res.status_code not in RETRYABLE_STATUSES or attempt >= n_retries or \
+                    (budget is not None and not budget.withdraw()):
+                if read is None:
+                    return res
+                try:
+                    return read(res)
+                except (ChunkedEncodingError, ConnectionError):
+                    status_code = None
+                    res.close()
+                    if attempt >= n_retries or (budget is not None and not budget.withdraw()):
+                        raise
+                    reason = 'was cut short'
+                    delay = backoff_delay(attempt - 1)
+            else:
+                res.close()  # back to the pool, a streamed body may not have been read
+                reason = 'got status %d' % res.status_code
+                delay = max(backoff_delay(attempt - 1),
+                            min(retry_after(res), settings.PICASA_CLIENT['BACKOFF_MAX']))
+        finally:  # once the body is read, whatever the error, e.g. KeyboardInterrupt
+            if throttle is not None:
+                throttle.release(started, status_code, timed)
+        log.debug("request: '%s %s' %s, retrying in %.1fs." % (method, kwargs['url'], reason, delay))
+        time.sleep(delay)
+        data = kwargs.get('data')
+        if hasattr(data, 'seek'):  # file bodies must be sent from the start again
+            data.seek(0)
+        attempt += 1
+
+
+class AlbumCache(object):
+    """Albums by id, kept <ttl> seconds: fetch_albums already tells the
+    number of photos of every album, there is no need to ask again before
+    fetching its photos.
+    """
 
+    def __init__(self, ttl=None):
+        if ttl is None:
+            ttl = settings.PICASA_CLIENT['ALBUM_CACHE_TTL']
+        self.ttl = ttl
+        self.albums = {}  # album id -> (expiry time, album)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
 
-class PicasaClient(object):
+    def get(self, album_id):
+        with self.lock:
+            expires, album = self.albums.get(album_id, (0, None))
+            if expires > time.time():
+                self.hits += 1
+                return album
+            self.albums.pop(album_id, None)
+            self.misses += 1
+            return None
+
+    def put(self, album):
+        with self.lock:
+            self.albums[album.id] = (time.time() + self.ttl, album)
+
+    def invalidate(self, album_id=None):
+        """Forgets an album, or every album."""
+        with self.lock:
+            if album_id is None:
+                self.albums.clear()
+            else:
+                self.albums.pop(album_id, None)
+
+
+class BasePicasaClient(object):
+    """What the blocking and the asyncio clients have in common: the
+    building of the requests to the Picasa Web API. Subclasses send them.
+    """
 
     PWA_SERVICE = 'lh2'  # internal service name for Picasa Web API
-    AUTH_URL = 'https://www.google.com/accounts/ClientLogin'
+    AUTH_PATH = 'accounts/ClientLogin'  # on the servers that authenticate too
 
-    def __init__(self, data_type=None, page_size=None):
+    def __init__(self, data_type=None, page_size=None, base_url=None):
+        self.base_url = settings.PICASA_CLIENT['BASE_URL']
+        self.auth_url = settings.PICASA_CLIENT['AUTH_URL']
+        if base_url is not None:
+            self.set_base_url(base_url)
         self.token = None
         self.login = None
         self.password = None
@@ -47,24 +236,41 @@ class PicasaClient(object):
             self.data_type = settings.PICASA_CLIENT['DATA_TYPE']
         if page_size is None:
             self.page_size = settings.PICASA_CLIENT['PAGE_SIZE']
+        self.album_cache = AlbumCache()
 
-    def authenticate(self, login, password):
+    def set_base_url(self, base_url):
+        """Points the client to another server of the API, such as a
+        google.fake.FakePWAServer, which authenticates the users too.
+        """
+        self.base_url = base_url.rstrip('/') + '/'
+        self.auth_url = self.base_url + self.AUTH_PATH
+
+    def _cache_album(self, raw):
+        """Same as AlbumRecord.from_raw_json, the album gets cached."""
+        album = AlbumRecord.from_raw_json(raw)
+        self.album_cache.put(album)
+        return album
+
+    def _auth_request(self, login, password):
+        """Returns the params and headers of an authentication request."""
         login = mail2username(login)
         self.login = login
         self.password = password
         headers = {'Content-Type': 'application/x-www-form-urlencoded'}
         params = {'Email': login, 'Passwd': password, 'service': self.PWA_SERVICE}
-        res = request_with_retry('POST', url=self.AUTH_URL, params=params, headers=headers)
-        if res.status_code != 200:
+        return params, headers
+
+    def _auth_token(self, status_code, text):
+        if status_code != 200:
             raise ValueError('authentication failed.')
-        match = re.search('Auth=(\S*)', res.text)
+        match = re.search(r'Auth=(\S*)', text)
         if not match:
             raise ValueError('unexpected authentication error: invalid answer.')
         self.token = match.group(1)
 
     def _url(self, suffix='', selector='feed'):
-        return 'https://picasaweb.google.com/data/{selector}/api/user/{user}/{suffix}'.format(
-            selector=selector, user=self.login, suffix=suffix)
+        return '{base}data/{selector}/api/user/{user}/{suffix}'.format(
+            base=self.base_url, selector=selector, user=self.login, suffix=suffix)
 
     def _headers(self):
         return {
@@ -81,40 +287,8 @@ class PicasaClient(object):
             'imgmax': 'd',  # defines the 'downloadable' size for every image
         }
 
-    def _paginated_fetch(self, url, params, callback, page_size=None, index=1, total=None):
-        """Returns an iterator to a paginated resource.
-        """
-        if page_size is None:
-            page_size = self.page_size
-
-        # update the page number
-        scope_params = self._params(page_size, index)
-        scope_params.update(params)
-
-        # get the page
-        log.debug("url = '%s', params = '%s'" % (url, json.dumps(scope_params)))
-        res = request_with_retry('GET', url=url, params=scope_params, headers=self._headers())
-        if res.status_code != 200:
-            raise ValueError("could not fetch Google resource: '%s'" % url)
-
-        # extract the information
-        data = res.json()['feed']
-        entry = data.get('entry', None)
-        if entry is None:  # collection is empty, return.
-            return
-
-        # yield every item as a generator
-        for item in data['entry']:
-            yield callback(item)
-
-        # iterate every page
-        total_results = total if total else g_json_value(data, 'totalResults', 'openSearch')
-        remaining_results = total_results - (index + page_size - 1)
-        if remaining_results > 0:
-            for item in self._paginated_fetch(url, params, callback, page_size, index + page_size, total):
-                yield item
-
-    def fetch_albums(self, page_size=None, **extra_params):
+    def _albums_feed(self, extra_params):
+        """Returns the URL and params of the feed of albums."""
         url = self._url()  # albums are requested via 'kind' param on base URL
         params = {
             'kind': 'album',
@@ -122,10 +296,10 @@ class PicasaClient(object):
         }
         if extra_params:
             params.update(extra_params)
-        return self._paginated_fetch(url, params, GoogleAlbum.from_raw_json, page_size)
+        return url, params
 
-    def fetch_images(self, album_id, page_size=None, **extra_params):
-        album = self.get_album(album_id)
+    def _images_feed(self, album_id, extra_params):
+        """Returns the URL and params of the feed of images of an album."""
         url = self._url('albumid/%s' % album_id)
         params = {
             'kind': 'photo',
@@ -133,38 +307,9 @@ class PicasaClient(object):
         }
         if extra_params:
             params.update(extra_params)
-        return self._paginated_fetch(url, params, GooglePhoto.from_raw_json, page_size,
-                                     total=album.num_photos)
-
-    def create_album(self, title, access=ACCESS_PRIVATE, summary='', location=''):
-        """Creates an album on Google+ Photos.
-        """
-        ts = dt2ts(datetime.utcnow(), True)
-        url = self._url()
-        # reverse engineered XML from gdata APIs
-        data = '''
-        <?xml version="1.0"?>
-        <ns0:entry xmlns:ns0="http://www.w3.org/2005/Atom" xmlns:ns1="http://search.yahoo.com/mrss/" xmlns:ns2="http://www.georss.org/georss" xmlns:ns3="http://www.opengis.net/gml" xmlns:ns4="http://schemas.google.com/photos/2007">
-        <ns0:category scheme="http://schemas.google.com/g/2005#kind" term="http://schemas.google.com/photos/2007#album"/>
-        <ns1:group/>
-        <ns0:title type="text">{title}</ns0:title>
-        <ns0:summary type="text">{summary}</ns0:summary>
-        <ns2:where>
-            <ns3:Point>
-            <ns3:pos/>
-            </ns3:Point>
-        </ns2:where>
-        <ns4:timestamp>{ts}</ns4:timestamp>
-        <ns4:commentingEnabled>true</ns4:commentingEnabled>
-        <ns4:access>{access}</ns4:access>
-        </ns0:entry>
-        '''.format(ts=str(ts), title=title, access=access, summary=summary, location=location).strip()
-        res = request_with_retry('POST', url=url, data=data, headers=self._headers())
-        if res.status_code != 201:
-            raise ValueError("could not post new album: '%s'" % title)
-        return g_xml_value(res.text, 'id', 'gphoto')
+        return url, params
 
-    def get_album(self, album_id):
+    def _album_request(self, album_id):
         url = self._url('albumid/%s' % album_id)
         # XXX: PWA somehow keeps the previous max-results in memory, force it
         params = self._params(page_size=1, index=1)
@@ -173,12 +318,9 @@ class PicasaClient(object):
             # from a multiple album GET
             'fields': 'entry({album_fields}),gphoto:numphotos,author'.format(album_fields=ALBUM_FIELDS),
         })
-        res = request_with_retry('GET', url=url, params=params, headers=self._headers())
-        if res.status_code != 200:
-            raise ValueError("could not fetch album id: '%s'" % album_id)
-        return GoogleAlbum.from_raw_json(res.json()['feed'])
+        return url, params
 
-    def get_image(self, photo_id, album_id='default'):
+    def _image_request(self, photo_id, album_id):
         url = self._url('albumid/%s/photoid/%s' % (album_id, photo_id))
         # XXX: PWA somehow keeps the previous max-results in memory, force it
         params = self._params(page_size=1, index=1)
@@ -187,34 +329,255 @@ class PicasaClient(object):
             # from a multiple photo GET
             'fields': '{photo_fields}'.format(photo_fields=PHOTO_FIELDS),
         })
-        res = request_with_retry('GET', url=url, params=params, headers=self._headers())
-        if res.status_code != 200:
-            raise ValueError("could not fetch photo id: '%s'" % photo_id)
-        return GooglePhoto.from_raw_json(res.json()['feed'])
+        return url, params
 
-    def delete_album(self, album_id):
+    def _new_album_data(self, title, access, summary, location):
+        ts = dt2ts(datetime.utcnow(), True)
+        # reverse engineered XML from gdata APIs
+        return '''
+        <?xml version="1.0"?>
+        <ns0:entry xmlns:ns0="http://www.w3.org/2005/Atom" xmlns:ns1="http://search.yahoo.com/mrss/" xmlns:ns2="http://www.georss.org/georss" xmlns:ns3="http://www.opengis.net/gml" xmlns:ns4="http://schemas.google.com/photos/2007">
+        <ns0:category scheme="http://schemas.google.com/g/2005#kind" term="http://schemas.google.com/photos/2007#album"/>
+        <ns1:group/>
+        <ns0:title type="text">{title}</ns0:title>
+        <ns0:summary type="text">{summary}</ns0:summary>
+        <ns2:where>
+            <ns3:Point>
+            <ns3:pos/>
+            </ns3:Point>
+        </ns2:where>
+        <ns4:timestamp>{ts}</ns4:timestamp>
+        <ns4:commentingEnabled>true</ns4:commentingEnabled>
+        <ns4:access>{access}</ns4:access>
+        </ns0:entry>
+        '''.format(ts=str(ts), title=escape(title), access=access, summary=escape(summary),
+                 location=location).strip()
+
+    def _delete_album_request(self, album_id):
         url = self._url('albumid/%s' % album_id, selector='entry')
         headers = self._headers()
         headers.update({
             'If-Match': '*',  # delete the album regardless of version
         })
-        res = request_with_retry('DELETE', url=url, headers=headers)
-        if res.status_code != 200:
-            raise ValueError("could not delete album id: '%s'" % album_id)
+        return url, headers
 
-    def upload_image(self, path, title, album_id='default', summary=''):
+    def _upload_request(self, path, title, album_id):
         url = self._url('albumid/%s' % album_id)
         headers = self._headers()
         headers.update({
             'Slug': title,
             'Content-Type': 'image/jpeg',
-            'Content-Length': os.path.getsize(path),
+            'Content-Length': str(os.path.getsize(path)),
         })
+        return url, headers
+
+
+class PicasaClient(BasePicasaClient):
+
+    def __init__(self, data_type=None, page_size=None, pool_size=None, jobs=None, base_url=None):
+        super(PicasaClient, self).__init__(data_type, page_size, base_url)
+        self.jobs = jobs
+        if jobs is None:
+            self.jobs = settings.PICASA_CLIENT['JOBS']
+        self.session = new_session(pool_size)
+        self.retry_budget = RetryBudget()
+        self.throttle = Throttle()
+        self.response_cache = None  # a ResponseCache, to make the GETs conditional
+
+    def resize_pool(self, pool_size):
+        """Keeps up to <pool_size> connections alive, e.g. to match the number
+        of threads sharing the client.
+        """
+        self.session = new_session(pool_size)
+
+    def _request(self, method, url, **kwargs):
+        """Sends a request over the client's connection pool, see request_with_retry.
+        All the requests of the client share its retry budget and throttle.
+        """
+        return request_with_retry(method, session=self.session, budget=self.retry_budget,
+                                  throttle=self.throttle, url=url, **kwargs)
+
+    def pool_stats(self):
+        """Returns the connection reuse, retry and throttling counters of the client."""
+        stats = pool_stats(self.session)
+        stats.update(self.throttle.stats())
+        if self.response_cache is not None:
+            stats.update(self.response_cache.stats())
+        stats.update({
+            'retries': self.retry_budget.n_retries,
+            'denied_retries': self.retry_budget.n_denied,
+            'album_cache_hits': self.album_cache.hits,
+            'album_cache_misses': self.album_cache.misses,
+        })
+        return stats
+
+    def authenticate(self, login, password):
+        params, headers = self._auth_request(login, password)
+        res = self._request('POST', self.auth_url, params=params, headers=headers)
+        self._auth_token(res.status_code, res.text)
+
+    def _cached_get(self, url, params, parse, error, stream=False):
+        """GETs <url> and returns parse(response), or raises ValueError(<error>)
+        unless the status is 200. With a response cache, the request is
+        conditional: if the resource didn't change since its ETag was
+        stored, the cached result is returned as is.
+        """
+        headers = self._headers()
+        key, cached = None, None
+        if self.response_cache is not None:
+            key = self.response_cache.key(url, params)
+            etag, cached = self.response_cache.get(key)
+            if etag is not None:
+                headers['If-None-Match'] = etag
+
+        def read(res):  # within the retries, see request_with_retry
+            try:
+                if res.status_code == 304 and 'If-None-Match' in headers:
+                    self.response_cache.hit(key)
+                    return cached, None
+                if res.status_code != 200:
+                    raise ValueError(error)
+                return parse(res), res.headers.get('ETag')
+            finally:
+                res.close()
+
+        value, etag = self._request('GET', url, params=params, headers=headers, stream=stream,
+                                    read=read)
+        if key is not None and etag:
+            self.response_cache.put(key, etag, value)
+        return value
+
+    def _fetch_page(self, url, params, callback, page_size, index):
+        """Returns the items of a page, passed through <callback>, and the total
+        number of results announced by the server.
+        """
+        scope_params = self._params(page_size, index)
+        scope_params.update(params)
+
+        def parse(res):  # entries are parsed as they arrive
+            parser = FeedParser(res.iter_content(settings.PICASA_CLIENT['FEED_CHUNK_SIZE']))
+            items = [callback(item) for item in parser.entries()]
+            return items, g_json_value(parser.feed, 'totalResults', 'openSearch')
+
+        # get the page
+        log.debug("url = '%s', params = '%s'" % (url, json.dumps(scope_params)))
+        return self._cached_get(url, scope_params, parse,
+                                "could not fetch Google resource: '%s'" % url, stream=True)
+
+    def _paginated_fetch(self, url, params, callback, page_size=None, index=1, total=None,
+                         jobs=None):
+        """Returns an iterator to a paginated resource, of <total> items if known.
+        With <jobs> greater than 1, the pages are fetched by as many threads
+        (once the total is known) and pages are as large as the server
+        allows, as long as every thread gets one.
+        """
+        if page_size is None:
+            page_size = self.page_size
+        if jobs is None:
+            jobs = self.jobs
+
+        if jobs > 1 and total is None:  # the first page tells the total
+            items, total = self._fetch_page(url, params, callback, page_size, index)
+            for item in items:
+                yield item
+            if not items:
+                return
+            index += page_size
+
+        if jobs > 1 and total:
+            per_job = -(-(total - index + 1) // jobs)  # rounded up
+            page_size = max(page_size, min(settings.PICASA_CLIENT['MAX_PAGE_SIZE'], per_job))
+            fetch = lambda page_index: self._fetch_page(url, params, callback, page_size,
+                                                        page_index)[0]
+            for items in imap_bounded(fetch, range(index, total + 1, page_size), jobs):
+                for item in items:
+                    yield item
+            return
+
+        while True:
+            items, total_results = self._fetch_page(url, params, callback, page_size, index)
+            if not items:  # collection is empty, return.
+                return
+            for item in items:
+                yield item
+
+            # iterate every page
+            total_results = total if total else total_results
+            remaining_results = total_results - (index + page_size - 1)
+            if remaining_results <= 0:
+                return
+            index += page_size
+
+    def fetch_albums(self, page_size=None, **extra_params):
+        url, params = self._albums_feed(extra_params)
+        # cached pages hold records: albums get in the album cache once read
+        for album in self._paginated_fetch(url, params, AlbumRecord.from_raw_json, page_size):
+            self.album_cache.put(album)
+            yield album
+
+    def fetch_images(self, album_id, page_size=None, album=None, total=None, **extra_params):
+        """Returns an iterator to the photos of an album. Their number is
+        taken from <total> or <album> if given, else from get_album.
+        """
+        if total is None:
+            total = (album or self.get_album(album_id)).num_photos
+        url, params = self._images_feed(album_id, extra_params)
+        return self._paginated_fetch(url, params, PhotoRecord.from_raw_json, page_size,
+                                     total=total)
+
+    def create_album(self, title, access=ACCESS_PRIVATE, summary='', location=''):
+        """Creates an album on Google+ Photos.
+        """
+        data = self._new_album_data(title, access, summary, location)
+        # not retried: the album may have been created, see upload_photo
+        res = self._request('POST', self._url(), data=data, headers=self._headers(), n_retries=1)
+        if res.status_code != 201:
+            raise ValueError("could not post new album: '%s'" % title)
+        album_id = g_xml_value(res.text, 'id', 'gphoto')
+        self.album_cache.invalidate(album_id)
+        return album_id
+
+    def get_album(self, album_id):
+        album = self.album_cache.get(album_id)
+        if album is not None:
+            return album
+        url, params = self._album_request(album_id)
+        parse = lambda res: AlbumRecord.from_raw_json(res.json()['feed'])
+        album = self._cached_get(url, params, parse, "could not fetch album id: '%s'" % album_id)
+        self.album_cache.put(album)
+        return album
+
+    def get_image(self, photo_id, album_id='default'):
+        url, params = self._image_request(photo_id, album_id)
+        parse = lambda res: PhotoRecord.from_raw_json(res.json()['feed'])
+        return self._cached_get(url, params, parse, "could not fetch photo id: '%s'" % photo_id)
+
+    def delete_album(self, album_id):
+        url, headers = self._delete_album_request(album_id)
+        res = self._request('DELETE', url, headers=headers)
+        self.album_cache.invalidate(album_id)
+        if res.status_code != 200:
+            raise ValueError("could not delete album id: '%s'" % album_id)
+
+    def upload_photo(self, path, title, album_id='default'):
+        """Uploads the image at <path>, streamed from the disk, and returns
+        the new photo as a PhotoRecord. Raises a RequestError if the server
+        refuses it. The upload is sent once: the server may have stored the
+        photo before failing or being cut off, and sending it again would
+        make a duplicate. It's up to the caller to try again, see
+        RequestError.retryable.
+        """
+        url, headers = self._upload_request(path, title, album_id)
         with open(path, 'rb') as f:
-            res = request_with_retry('POST', url=url, headers=headers, data=f)
-        if res != 201:
-            raise ValueError("upload of picture: %s [title='%s'] failed." % path, title)
-        return g_xml_value(res.text, 'id', 'gphoto')
+            res = self._request('POST', url, headers=headers, data=f, n_retries=1)
+        self.album_cache.invalidate(album_id)  # its number of photos changed
+        if res.status_code != 201:
+            raise RequestError("upload of picture: %s [title='%s'] failed: status %d." % (
+                path, title, res.status_code), res.status_code)
+        return PhotoRecord.from_xml(res.content)
+
+    def upload_image(self, path, title, album_id='default', summary=''):
+        return self.upload_photo(path, title, album_id).uuid
 
 
 # Singleton to be used by importers
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio flavour of PicasaClient, for Python 3.6+ with aiohttp installed
+(pip install ptoolbox[async]). It is not imported by the package.
+
+Every request goes through one connection pool and a semaphore bounds the
+number of requests in flight, so that a single thread keeps thousands of
+them going, e.g.:
+
+    async with AsyncPicasaClient() as client:
+        await client.authenticate(login, password)
+        albums = [album async for album in client.fetch_albums()]
+        await asyncio.gather(*[fetch(client, album) for album in albums])
+"""
+
+import asyncio
+import json
+
+import aiohttp
+
+from ptoolbox import log
+from ptoolbox.conf import settings
+
+from . import BasePicasaClient, RetryBudget, RETRYABLE_STATUSES, backoff_delay
+from .utils import g_xml_value, g_json_value
+from .records import PhotoRecord
+from .constants import ACCESS_PRIVATE
+
+
+class AsyncPicasaClient(BasePicasaClient):
+    """Same surface as PicasaClient, with coroutines instead of blocking
+    methods and async iterators instead of iterators. Up to <concurrency>
+    requests are in flight at once, over up to <pool_size> connections
+    (as many as requests by default).
+    """
+
+    def __init__(self, data_type=None, page_size=None, pool_size=None, concurrency=None,
+                 base_url=None):
+        super().__init__(data_type, page_size, base_url)
+        if concurrency is None:
+            concurrency = settings.PICASA_CLIENT['CONCURRENCY']
+        if pool_size is None:
+            pool_size = concurrency
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.retry_budget = RetryBudget()
+        # created in the running event loop, on first use
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _request(self, method, url, n_retries=None, **kwargs):
+        """Sends a request, retried like google.request_with_retry does.
+        Returns the status and the text of the answer, the connection is
+        released as soon as the answer is read.
+        """
+        if n_retries is None:
+            n_retries = settings.N_MAX_ATTEMPTS
+        session = self._get_session()
+        attempt = 1
+        while True:
+            self.retry_budget.deposit()
+            try:
+                async with self._semaphore:
+                    async with session.request(method, url, **kwargs) as res:
+                        status, text = res.status, await res.text(errors='replace')
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= n_retries or not self.retry_budget.withdraw():
+                    raise
+                reason = 'failed'
+            else:
+                if status not in RETRYABLE_STATUSES or attempt >= n_retries or \
+                        not self.retry_budget.withdraw():
+                    return status, text
+                reason = 'got status %d' % status
+            delay = backoff_delay(attempt - 1)
+            log.debug("request: '%s %s' %s, retrying in %.1fs." % (method, url, reason, delay))
+            await asyncio.sleep(delay)
+            data = kwargs.get('data')
+            if hasattr(data, 'seek'):  # file bodies must be sent from the start again
+                data.seek(0)
+            attempt += 1
+
+    async def authenticate(self, login, password):
+        params, headers = self._auth_request(login, password)
+        status, text = await self._request('POST', self.auth_url, params=params, headers=headers)
+        self._auth_token(status, text)
+
+    async def _fetch_page(self, url, params, callback, page_size, index):
+        """Same as PicasaClient._fetch_page."""
+        scope_params = self._params(page_size, index)
+        scope_params.update(params)
+
+        log.debug("url = '%s', params = '%s'" % (url, json.dumps(scope_params)))
+        status, text = await self._request('GET', url, params=scope_params, headers=self._headers())
+        if status != 200:
+            raise ValueError("could not fetch Google resource: '%s'" % url)
+
+        data = json.loads(text)['feed']
+        items = [callback(item) for item in data.get('entry', ())]
+        return items, g_json_value(data, 'totalResults', 'openSearch')
+
+    async def _paginated_fetch(self, url, params, callback, page_size=None, index=1, total=None):
+        """Async iterator over a paginated resource, of <total> items if known.
+        Once the total is known, every page is requested at once (within the
+        concurrency of the client) and the items come in order.
+        """
+        if page_size is None:
+            page_size = self.page_size
+
+        if total is None:  # the first page tells the total
+            items, total = await self._fetch_page(url, params, callback, page_size, index)
+            for item in items:
+                yield item
+            if not items:
+                return
+            index += page_size
+
+        if total is None:  # the server did not tell, pages are fetched one after the other
+            while True:
+                items, _ = await self._fetch_page(url, params, callback, page_size, index)
+                if not items:
+                    return
+                for item in items:
+                    yield item
+                index += page_size
+
+        pages = [asyncio.ensure_future(self._fetch_page(url, params, callback, page_size, page_index))
+                 for page_index in range(index, total + 1, page_size)]
+        try:
+            for page in pages:
+                items, _ = await page
+                for item in items:
+                    yield item
+        finally:  # the iteration failed or was left early
+            for page in pages:
+                page.cancel()
+            # collects the outcome of every page, so that none gets logged as never retrieved
+            await asyncio.gather(*pages, return_exceptions=True)
+
+    def fetch_albums(self, page_size=None, **extra_params):
+        url, params = self._albums_feed(extra_params)
+        return self._paginated_fetch(url, params, self._cache_album, page_size)
+
+    async def fetch_images(self, album_id, page_size=None, album=None, total=None, **extra_params):
+        if total is None:
+            total = (album or await self.get_album(album_id)).num_photos
+        url, params = self._images_feed(album_id, extra_params)
+        async for image in self._paginated_fetch(url, params, PhotoRecord.from_raw_json,
+                                                 page_size, total=total):
+            yield image
+
+    async def create_album(self, title, access=ACCESS_PRIVATE, summary='', location=''):
+        data = self._new_album_data(title, access, summary, location)
+        status, text = await self._request('POST', self._url(), n_retries=1, data=data,
+                                           headers=self._headers())
+        if status != 201:
+            raise ValueError("could not post new album: '%s'" % title)
+        album_id = g_xml_value(text, 'id', 'gphoto')
+        self.album_cache.invalidate(album_id)
+        return album_id
+
+    async def get_album(self, album_id):
+        album = self.album_cache.get(album_id)
+        if album is not None:
+            return album
+        url, params = self._album_request(album_id)
+        status, text = await self._request('GET', url, params=params, headers=self._headers())
+        if status != 200:
+            raise ValueError("could not fetch album id: '%s'" % album_id)
+        return self._cache_album(json.loads(text)['feed'])
+
+    async def get_image(self, photo_id, album_id='default'):
+        url, params = self._image_request(photo_id, album_id)
+        status, text = await self._request('GET', url, params=params, headers=self._headers())
+        if status != 200:
+            raise ValueError("could not fetch photo id: '%s'" % photo_id)
+        return PhotoRecord.from_raw_json(json.loads(text)['feed'])
+
+    async def delete_album(self, album_id):
+        url, headers = self._delete_album_request(album_id)
+        status, _ = await self._request('DELETE', url, headers=headers)
+        self.album_cache.invalidate(album_id)
+        if status != 200:
+            raise ValueError("could not delete album id: '%s'" % album_id)
+
+    async def upload_image(self, path, title, album_id='default', summary=''):
+        url, headers = self._upload_request(path, title, album_id)
+        with open(path, 'rb') as f:
+            status, text = await self._request('POST', url, n_retries=1, headers=headers, data=f)
+        self.album_cache.invalidate(album_id)  # its number of photos changed
+        if status != 201:
+            raise ValueError("upload of picture: %s [title='%s'] failed." % (path, title))
+        return g_xml_value(text, 'id', 'gphoto')
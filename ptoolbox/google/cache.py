@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of the responses of the Picasa Web API.
+
+With GData-Version 2, feeds and entries come with an ETag. The parsed
+result of a GET is stored along with its ETag, keyed by URL and params, and
+the next GET of the same resource sends it in If-None-Match: if nothing
+changed the server answers 304, without a body, and the cached result is
+served as is. Re-crawling unchanged albums costs headers only.
+
+Every response is a file of the cache directory, named after its key.
+The least recently used files are dropped once the cache gets larger than
+<max_size> bytes.
+"""
+
+import hashlib
+import os
+import os.path
+import pickle
+import threading
+
+from collections import OrderedDict
+
+try:
+    from urllib import urlencode
+except ImportError:  # Python 3
+    from urllib.parse import urlencode
+
+from ptoolbox import log
+from ptoolbox.conf import settings
+
+
+class ResponseCache(object):
+    """Parsed responses and their ETags, in the <directory>, within
+    <max_size> bytes.
+    """
+
+    def __init__(self, directory, max_size=None):
+        if max_size is None:
+            max_size = settings.RESPONSE_CACHE['MAX_SIZE']
+        self.directory = directory
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> file size, most recently used last
+        self.size = 0
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._load()
+
+    def _load(self):
+        """Reads the index of the entries, by time of last use."""
+        entries = []
+        for name in os.listdir(self.directory):
+            if '.' in name:  # temporary file of an interrupted write
+                os.remove(os.path.join(self.directory, name))
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self.entries[key] = size
+            self.size += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def key(url, params=None):
+        request = url + '?' + urlencode(sorted((params or {}).items()))
+        return hashlib.sha1(request.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the (etag, value) stored under <key>, or (None, None)."""
+        with self.lock:
+            self.lookups += 1
+            if key not in self.entries:
+                return None, None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+            self._remove(key)  # evicted meanwhile, or corrupted
+            return None, None
+
+    def hit(self, key):
+        """Accounts for a value served from the cache, the entry is used."""
+        with self.lock:
+            self.hits += 1
+            if key in self.entries:
+                self.entries[key] = self.entries.pop(key)
+        try:
+            os.utime(self._path(key), None)  # the order of use survives the process
+        except OSError:
+            pass
+
+    def put(self, key, etag, value):
+        data = pickle.dumps((etag, value), pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_size:
+            return
+        tmp_path = '%s.%d.%d' % (self._path(key), os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, self._path(key))
+        with self.lock:
+            self.size += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            evicted = []
+            while self.size > self.max_size:
+                old_key, old_size = self.entries.popitem(last=False)
+                self.size -= old_size
+                evicted.append(old_key)
+            self.evictions += len(evicted)
+        for old_key in evicted:
+            self._unlink(old_key)
+
+    def _remove(self, key):
+        with self.lock:
+            self.size -= self.entries.pop(key, 0)
+        self._unlink(key)
+
+    def _unlink(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            keys = list(self.entries)
+            self.entries.clear()
+            self.size = 0
+        for key in keys:
+            self._unlink(key)
+        log.debug('response cache: %d entries dropped.' % len(keys))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'cache_entries': len(self.entries),
+                'cache_size': self.size,
+                'cache_lookups': self.lookups,
+                'cache_hits': self.hits,
+                'cache_hit_rate': float(self.hits) / self.lookups if self.lookups else 0.0,
+                'cache_evictions': self.evictions,
+            }
@@ -17,6 +17,7 @@ G_XML_NAMESPACES = {
     'gdata': 'http://www.w3.org/2005/Atom',
     'gphoto': 'http://schemas.google.com/photos/2007',
     'media': 'http://search.yahoo.com/mrss/',
+    'exif': 'http://schemas.google.com/photos/exif/2007',
 }
 
 ALBUM_FIELDS = ','.join((
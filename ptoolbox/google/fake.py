@@ -0,0 +1,429 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the Picasa Web API, to exercise and benchmark the
+clients without Google's servers.
+
+FakePWAServer implements what the clients use: ClientLogin
+authentication, the feeds of albums and photos with their pagination
+(start-index, max-results), the GET of an album or a photo, the creation
+and deletion of albums, the upload of photos, and the download of their
+content. Feeds and entries come with ETags and honour If-None-Match.
+
+Its FakeStore is seeded from the sample-*.json files of the project, or
+generated: N albums of M photos. Knobs make the server slower (latency),
+unreliable (error rate) or throttling (requests per second), so that the
+behaviour of the clients under load can be measured reproducibly:
+
+    server = FakePWAServer(FakeStore.synthetic(10, 1000), latency=0.05)
+    server.start()
+    client = PicasaClient(base_url=server.url)
+"""
+
+import hashlib
+import json
+import os.path
+import random
+import re
+import threading
+import time
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+from ptoolbox import log
+
+from .constants import ACCESS_PRIVATE, G_XML_ROOT, G_XML_NAMESPACES
+from .records import AlbumRecord, PhotoRecord
+from .utils import dt2ts
+
+FAKE_PWA_USER_PATH = re.compile(
+    r'^/data/(?P<selector>feed|entry)/api/user/(?P<user>[^/]+)/?'
+    r'(?:albumid/(?P<album_id>[^/]+)/?)?(?:photoid/(?P<photo_id>[^/]+)/?)?$')
+FAKE_PWA_MEDIA_PATH = re.compile(r'^/media/(?P<album_id>[^/]+)/(?P<photo_id>[^/.]+)\.jpg$')
+FAKE_PWA_DROP_BOX = 'Drop Box'  # album of the uploads to the 'default' album
+
+SAMPLE_ALBUMS = 'sample-albums-json.json'  # a feed of albums
+SAMPLE_PHOTOS = ('sample-recentpictures.json', 'sample-photo.json')  # photo entries
+
+
+def _iso8601(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (dt.microsecond // 1000)
+
+
+def album_entry(album, num_photos):
+    """The JSON entry of an AlbumRecord, as in the feeds."""
+    return {
+        'gphoto$id': {'$t': album.id},
+        'gphoto$name': {'$t': album.name},
+        'title': {'$t': album.title},
+        'author': [{'name': {'$t': album.author}}],
+        'gphoto$access': {'$t': album.access},
+        'summary': {'$t': album.summary or ''},
+        'gphoto$numphotos': {'$t': num_photos},
+        'updated': {'$t': _iso8601(album.updated)},
+        'published': {'$t': _iso8601(album.published)},
+    }
+
+
+def photo_entry(photo):
+    """The JSON entry of a PhotoRecord, as in the feeds."""
+    return {
+        'gphoto$id': {'$t': photo.uuid},
+        'gphoto$albumid': {'$t': photo.album},
+        'title': {'$t': photo.title},
+        'gphoto$timestamp': {'$t': str(dt2ts(photo.time, True))},
+        'gphoto$size': {'$t': str(photo.size)},
+        'gphoto$width': {'$t': str(photo.width)},
+        'gphoto$height': {'$t': str(photo.height)},
+        'media$group': {'media$content': [{'url': photo.url, 'medium': 'image'}]},
+        'exif$tags': {'exif$imageUniqueID': {'$t': photo.unique_id}} if photo.unique_id else {},
+    }
+
+
+def photo_xml(photo):
+    """The XML entry of a PhotoRecord, as answered to an upload."""
+    return (
+        u'<entry xmlns="{root}" xmlns:gphoto="{gphoto}" xmlns:exif="{exif}">'
+        '<title>{title}</title>'
+        '<content type="image/jpeg" src="{url}"/>'
+        '<gphoto:id>{p.uuid}</gphoto:id>'
+        '<gphoto:albumid>{p.album}</gphoto:albumid>'
+        '<gphoto:width>{p.width}</gphoto:width>'
+        '<gphoto:height>{p.height}</gphoto:height>'
+        '<gphoto:size>{p.size}</gphoto:size>'
+        '<gphoto:timestamp>{ts}</gphoto:timestamp>'
+        '<exif:tags>{unique_id}</exif:tags>'
+        '</entry>').format(
+            root=G_XML_NAMESPACES[G_XML_ROOT], gphoto=G_XML_NAMESPACES['gphoto'],
+            exif=G_XML_NAMESPACES['exif'], p=photo, title=escape(photo.title),
+            url=escape(photo.url), ts=dt2ts(photo.time, True),
+            unique_id=u'<exif:imageUniqueID>%s</exif:imageUniqueID>' % photo.unique_id
+            if photo.unique_id else '')
+
+
+def album_xml(album):
+    """The XML entry of an AlbumRecord, as answered to its creation."""
+    return (
+        u'<entry xmlns="{root}" xmlns:gphoto="{gphoto}">'
+        '<title>{title}</title><gphoto:id>{a.id}</gphoto:id><gphoto:name>{a.name}</gphoto:name>'
+        '<gphoto:access>{a.access}</gphoto:access></entry>').format(
+            root=G_XML_NAMESPACES[G_XML_ROOT], gphoto=G_XML_NAMESPACES['gphoto'],
+            a=album, title=escape(album.title))
+
+
+class FakeStore(object):
+    """Albums and photos of a fake account, as records. Photos without a URL
+    are served by the server itself, as <size> bytes of made up content.
+    """
+
+    def __init__(self, author='ptoolbox'):
+        self.author = author
+        self.albums = OrderedDict()  # id -> AlbumRecord
+        self.photos = {}  # album id -> OrderedDict(photo id -> PhotoRecord)
+        self.next_id = 5000000000000000000
+        self.lock = threading.RLock()
+
+    def _new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return str(self.next_id)
+
+    def add_album(self, title, access=ACCESS_PRIVATE, summary='', album_id=None, published=None):
+        now = datetime.utcnow().replace(microsecond=0)
+        album = AlbumRecord(id=album_id or self._new_id(),
+                            name=re.sub(r'\W', '', title.title()) or 'Album', title=title,
+                            author=self.author, access=access, summary=summary, num_photos=0,
+                            updated=published or now, published=published or now)
+        with self.lock:
+            self.albums[album.id] = album
+            self.photos.setdefault(album.id, OrderedDict())
+        return album
+
+    def add_photo(self, album_id, title, size, width=0, height=0, time=None, unique_id=None,
+                  photo_id=None, url=None):
+        photo = PhotoRecord(album=album_id, uuid=photo_id or self._new_id(), url=url,
+                            time=time or datetime.utcnow().replace(microsecond=0), size=size,
+                            title=title, width=width, height=height, unique_id=unique_id)
+        with self.lock:
+            self.photos[album_id][photo.uuid] = photo
+            album = self.albums[album_id]
+            self.albums[album_id] = album._replace(updated=max(album.updated, photo.time))
+        return photo
+
+    def delete_album(self, album_id):
+        with self.lock:
+            if album_id not in self.albums:
+                return False
+            del self.albums[album_id]
+            del self.photos[album_id]
+            return True
+
+    def drop_box(self):
+        """Returns the id of the album of the uploads to the 'default' album."""
+        with self.lock:
+            for album in self.albums.values():
+                if album.title == FAKE_PWA_DROP_BOX:
+                    return album.id
+            return self.add_album(FAKE_PWA_DROP_BOX).id
+
+    @classmethod
+    def synthetic(cls, n_albums, n_photos, seed=0):
+        """A store of <n_albums> albums of <n_photos> photos, the same for a
+        given <seed>. Half of the photos have a unique id.
+        """
+        rng = random.Random(seed)
+        store = cls()
+        start = datetime(2015, 1, 1)
+        for a in range(n_albums):
+            album = store.add_album('Album %d' % a, published=start + timedelta(days=a))
+            for p in range(n_photos):
+                store.add_photo(album.id, '%05d.jpg' % p, size=rng.randint(20000, 200000),
+                                width=4000, height=3000,
+                                time=start + timedelta(days=a, seconds=37 * p),
+                                unique_id='%032x' % rng.getrandbits(128) if p % 2 else None)
+        return store
+
+    @classmethod
+    def from_samples(cls, directory):
+        """A store of the albums and photos of the sample-*.json files in
+        <directory>. Photos get served by the server, whatever their URL.
+        """
+        store = cls()
+        with open(os.path.join(directory, SAMPLE_ALBUMS), 'rb') as f:
+            for raw in json.loads(f.read().decode('utf-8'))['feed'].get('entry', []):
+                album = AlbumRecord.from_raw_json(raw)
+                store.albums[album.id] = album._replace(num_photos=0)
+                store.photos[album.id] = OrderedDict()
+        for name in SAMPLE_PHOTOS:
+            with open(os.path.join(directory, name), 'rb') as f:
+                raws = json.loads(f.read().decode('utf-8'))
+            for raw in raws if isinstance(raws, list) else [raws]:
+                photo = PhotoRecord.from_raw_json(raw)._replace(url=None)
+                if photo.album not in store.albums:
+                    store.add_album('Album %s' % photo.album, album_id=photo.album,
+                                    published=photo.time)
+                store.photos[photo.album][photo.uuid] = photo
+        return store
+
+
+class FakePWAServer(ThreadingMixIn, HTTPServer):
+    """Serves the <store> on <host>:<port> (any free port by default).
+    Every request waits <latency> seconds, fails with a 500 at the given
+    <error_rate>, and gets a 503 beyond <throttle_rate> requests per
+    second (0 for no limit). Any login and password are accepted, unless
+    <password> is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, store=None, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0,
+                 throttle_rate=0, password=None, seed=None):
+        HTTPServer.__init__(self, (host, port), FakePWAHandler)
+        self.store = store if store is not None else FakeStore()
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.password = password
+        self.random = random.Random(seed)
+        self.tokens = set()
+        self.lock = threading.Lock()
+        self.window = (0, 0)  # (second, requests received in that second)
+        self.stats = dict.fromkeys(
+            ('requests', 'errors', 'throttled', 'not_modified', 'bytes_received', 'bytes_sent'), 0)
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def start(self):
+        """Serves in a background thread."""
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.stats[key] += n
+
+    def admit(self):
+        """Returns the status of an injected failure, or None."""
+        with self.lock:
+            self.stats['requests'] += 1
+            second = int(time.time())
+            window, n_requests = self.window
+            n_requests = n_requests + 1 if window == second else 1
+            self.window = (second, n_requests)
+            if self.throttle_rate and n_requests > self.throttle_rate:
+                self.stats['throttled'] += 1
+                return 503
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500
+        return None
+
+    def media_url(self, photo):
+        return photo.url or '%smedia/%s/%s.jpg' % (self.url, photo.album, photo.uuid)
+
+
+class FakePWAHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the real servers
+
+    def log_message(self, fmt, *args):
+        log.debug('fake pwa: ' + fmt % args)
+
+    def _send(self, status, data=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if data and self.command != 'HEAD':
+            self.wfile.write(data)
+        self.server.count('bytes_sent', len(data))
+
+    def _send_json(self, body):
+        """Sends a feed or an entry, or 304 if the client has it already."""
+        data = json.dumps(body).encode('utf-8')
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self._send(200, data, headers={'ETag': etag})
+
+    def _send_xml(self, status, xml):
+        self._send(status, xml.encode('utf-8'), 'application/atom+xml')
+
+    def _route(self):
+        """Returns the handler of the request and its arguments, once the
+        injected failures and the authentication are passed.
+        """
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        status = self.server.admit()
+        if status is not None:
+            return self._send, (status, b'', 'text/plain', {'Retry-After': '1'})
+        if url.path == '/accounts/ClientLogin':
+            return self._login, (params,)
+        match = FAKE_PWA_MEDIA_PATH.match(url.path)
+        if match:
+            return self._media, (match.group('album_id'), match.group('photo_id'))
+        match = FAKE_PWA_USER_PATH.match(url.path)
+        if not match:
+            return self._send, (404,)
+        token = self.headers.get('Authorization', '').replace('GoogleLogin auth=', '')
+        if token not in self.server.tokens:
+            return self._send, (403, b'Token invalid', 'text/plain')
+        handler = getattr(self, '_%s_%s' % (self.command.lower(), match.group('selector')), None)
+        if handler is None:
+            return self._send, (405,)
+        return handler, (match.group('album_id'), match.group('photo_id'), params)
+
+    def _dispatch(self):
+        # the body is read first, a connection kept alive must be left clean
+        self.data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.count('bytes_received', len(self.data))
+        handler, args = self._route()
+        handler(*args)
+
+    do_GET = do_POST = do_DELETE = _dispatch
+
+    def _login(self, params):
+        if self.command != 'POST':
+            return self._send(405)
+        if self.server.password is not None and params.get('Passwd') != self.server.password:
+            return self._send(403, b'Error=BadAuthentication\n', 'text/plain')
+        token = hashlib.sha1(('%s:%s' % (params.get('Email'), time.time())).encode('utf-8'))
+        self.server.tokens.add(token.hexdigest())
+        self._send(200, ('SID=x\nLSID=x\nAuth=%s\n' % token.hexdigest()).encode('utf-8'),
+                   'text/plain')
+
+    def _media(self, album_id, photo_id):
+        photo = self.server.store.photos.get(album_id, {}).get(photo_id)
+        if photo is None:
+            return self._send(404)
+        pattern = (photo_id.encode('ascii') + b' ') * 64
+        data = (b'\xff\xd8' + pattern * (photo.size // len(pattern) + 1))[:photo.size]
+        self._send(200, data, 'image/jpeg')
+
+    def _page(self, items, params):
+        index = int(params.get('start-index', 1))
+        page_size = int(params.get('max-results', 1000))
+        return {'feed': {'entry': items[index - 1:index - 1 + page_size],
+                         'openSearch$totalResults': {'$t': len(items)},
+                         'openSearch$startIndex': {'$t': index}}}
+
+    def _get_feed(self, album_id, photo_id, params):
+        store = self.server.store
+        with store.lock:
+            if album_id is None:  # the albums, with kind=album
+                albums = list(store.albums.values())
+                counts = dict((album.id, len(store.photos[album.id])) for album in albums)
+                entries = [album_entry(album, counts[album.id]) for album in albums]
+                return self._send_json(self._page(entries, params))
+            if album_id not in store.albums:
+                return self._send(404)
+            photos = store.photos[album_id]
+            if photo_id is not None:
+                if photo_id not in photos:
+                    return self._send(404)
+                photo = photos[photo_id]
+                return self._send_json({'feed': photo_entry(
+                    photo._replace(url=self.server.media_url(photo)))})
+            if params.get('kind') != 'photo':
+                return self._send_json({'feed': album_entry(store.albums[album_id], len(photos))})
+            page = self._page(list(photos.values()), params)
+        page['feed']['entry'] = [photo_entry(photo._replace(url=self.server.media_url(photo)))
+                                 for photo in page['feed']['entry']]
+        self._send_json(page)
+
+    def _post_feed(self, album_id, photo_id, params):
+        store = self.server.store
+        if album_id is None:  # a new album
+            try:
+                entry = ElementTree.fromstring(self.data.strip())
+            except ElementTree.ParseError:
+                return self._send(400)
+            value = lambda key, ns: entry.findtext('{%s}%s' % (G_XML_NAMESPACES[ns], key)) or ''
+            album = store.add_album(value('title', G_XML_ROOT), value('access', 'gphoto') or
+                                    ACCESS_PRIVATE, value('summary', G_XML_ROOT))
+            return self._send_xml(201, album_xml(album))
+        if photo_id is not None:
+            return self._send(405)
+        if album_id == 'default':
+            album_id = store.drop_box()
+        if album_id not in store.albums:
+            return self._send(404)
+        if self.headers.get('Content-Type') != 'image/jpeg' or not self.data:
+            return self._send(400)
+        photo = store.add_photo(album_id, self.headers.get('Slug') or 'untitled', len(self.data))
+        self._send_xml(201, photo_xml(photo._replace(url=self.server.media_url(photo))))
+
+    def _delete_entry(self, album_id, photo_id, params):
+        if album_id is None or photo_id is not None:
+            return self._send(405)
+        self._send(200 if self.server.store.delete_album(album_id) else 404)
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
+
 from peewee import (Model, SqliteDatabase, CharField, IntegerField,
                     DateTimeField, ForeignKeyField, CompositeKey)
 
-from .utils import g_json_key, g_json_value, iso8601str2datetime, ts2dt
+from ptoolbox.conf import settings
 
 db = SqliteDatabase(None)  # Un-initialized database.
 
@@ -13,6 +15,28 @@ class BaseModel(Model):
     class Meta:
         database = db
 
+    @classmethod
+    def insert_records(cls, records, upsert=False):
+        """Inserts <records> (see google.records) in a transaction. With
+        <upsert>, existing rows are replaced. The statement is prepared once
+        and run for every record: peewee's insert_many builds every value of
+        every row into the query, which costs more than the writes.
+        """
+        records = list(records)
+        if not records:
+            return
+        fields = [cls._meta.fields[name] for name in records[0]._fields]
+        sql = '%s INTO "%s" (%s) VALUES (%s)' % (
+            'INSERT OR REPLACE' if upsert else 'INSERT', cls._meta.db_table,
+            ', '.join('"%s"' % field.db_column for field in fields),
+            ', '.join('?' * len(fields)))
+        converters = [field.db_value for field in fields]
+        rows = ([convert(value) for convert, value in zip(converters, record)]
+                for record in records)
+        database = cls._meta.database
+        with database.atomic():
+            database.get_cursor().executemany(sql, rows)
+
 
 class GoogleAlbum(BaseModel):
     """Contains methods and accessors to Google Album BaseModels.
@@ -30,61 +54,152 @@ class GoogleAlbum(BaseModel):
 
     @classmethod
     def from_raw_json(cls, raw):
-        res = {
-            'id': g_json_value(raw, 'id', 'gphoto'),
-            'title': g_json_value(raw, 'title'),  # original title, may create doubles
-            'name': g_json_value(raw, 'name', 'gphoto'),  # camel-cased unique name identifier
-            'author': g_json_value(raw['author'][0], 'name'),
-            'access': g_json_value(raw, 'access', 'gphoto'),
-            'summary': g_json_value(raw, 'summary'),
-            'updated': iso8601str2datetime(g_json_value(raw, 'updated')),
-            'published': iso8601str2datetime(g_json_value(raw, 'published')),
-            'num_photos': int(g_json_value(raw, 'numphotos', 'gphoto')),
-        }
-        return GoogleAlbum(**res)
+        """Builds the model of a JSON entry, see google.records."""
+        from .records import AlbumRecord  # records are built on the models
+        return AlbumRecord.from_raw_json(raw).to_model()
+
+    @classmethod
+    def changes(cls, albums):
+        """Compares freshly fetched <albums> with the stored ones. Returns the
+        albums whose photos may have changed (new, or with a different
+        update time or number of photos) and the ids of the vanished albums.
+        """
+        stored = dict((album.id, (album.updated, album.num_photos)) for album in cls.select())
+        changed = [album for album in albums
+                   if stored.get(album.id) != (album.updated, album.num_photos)]
+        fetched_ids = set(album.id for album in albums)
+        return changed, [album_id for album_id in stored if album_id not in fetched_ids]
+
+    @classmethod
+    def prune(cls, album_ids):
+        """Deletes albums, and their photos."""
+        album_ids = list(album_ids)
+        for i in range(0, len(album_ids), 500):  # stay below the SQLite variables limit
+            chunk = album_ids[i:i + 500]
+            GooglePhoto.delete().where(GooglePhoto.album << chunk).execute()
+            cls.delete().where(cls.id << chunk).execute()
 
 
 class GooglePhoto(BaseModel):
     """Contains methods and accessors to Google Photo models."""
 
-    album = ForeignKeyField(GoogleAlbum, related_name='photos')
+    album = ForeignKeyField(GoogleAlbum, related_name='photos')  # indexed, as a foreign key
     uuid = CharField()
     url = CharField()
-    time = DateTimeField()
+    time = DateTimeField(index=True)
     size = IntegerField()
     title = CharField()
     width = IntegerField()
     height = IntegerField()
     status = IntegerField(null=True)  # transient field, considered blank every run
-    unique_id = CharField(null=True)
+    unique_id = CharField(null=True, index=True)
 
     class Meta:
         primary_key = CompositeKey('album', 'uuid')
+        indexes = (
+            (('size', 'width', 'height'), False),  # images matched by their properties
+        )
 
     @classmethod
     def from_raw_json(cls, raw):
-        media_group = raw[g_json_key('group', 'media')]
-        media_content = media_group[g_json_key('content', 'media')][0]
-        res = {
-            'uuid': g_json_value(raw, 'id', 'gphoto'),
-            'url': media_content['url'],
-            'time': ts2dt(int(g_json_value(raw, 'timestamp', 'gphoto')), millisecs=True),
-            'size': int(g_json_value(raw, 'size', 'gphoto')),
-            'title': g_json_value(raw, 'title'),
-            'width': int(g_json_value(raw, 'width', 'gphoto')),
-            'height': int(g_json_value(raw, 'height', 'gphoto')),
-            'album': g_json_value(raw, 'albumid', 'gphoto'),
-            'unique_id': g_json_value(raw['exif$tags'], 'imageUniqueID', 'exif'),
-        }
-        return GooglePhoto(**res)
-
-
-def init_database(name, reset=False):
+        """Builds the model of a JSON entry, see google.records."""
+        from .records import PhotoRecord
+        return PhotoRecord.from_raw_json(raw).to_model()
+
+
+class CatalogWriter(object):
+    """Writes records (see google.records) to the catalog in transactions of
+    about <batch_size> rows, rather than in one transaction per row. With
+    <upsert>, existing rows are replaced. The photos of an album given to
+    replace_photos are never split across transactions. Use it as a context
+    manager, which also writes what was added before an error, or call
+    flush() once done.
+    """
+
+    def __init__(self, batch_size=None, upsert=True):
+        if batch_size is None:
+            batch_size = settings.CATALOG['BATCH_SIZE']
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.pending = OrderedDict()  # model -> records, albums first
+        self.cleared_albums = []
+        self.n_pending = 0
+        self.n_rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def _add(self, records):
+        for record in records:
+            self.pending.setdefault(record.model, []).append(record)
+            self.n_pending += 1
+
+    def add(self, records):
+        for record in records:
+            self._add([record])
+            if self.n_pending >= self.batch_size:
+                self.flush()
+
+    def replace_photos(self, album, photos):
+        """Replaces the stored photos of <album> by <photos>, as records,
+        in the current batch. The <album> record is written after its
+        photos: a stored album always has its photos, see GoogleAlbum.changes.
+        """
+        photos = list(photos)  # all of them, or none if they can't be listed
+        self.cleared_albums.append(album.id)
+        self._add(photos)
+        self._add([album])
+        if self.n_pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with db.atomic():
+            for i in range(0, len(self.cleared_albums), 500):  # below the SQLite variables limit
+                chunk = self.cleared_albums[i:i + 500]
+                GooglePhoto.delete().where(GooglePhoto.album << chunk).execute()
+            for model, records in self.pending.items():
+                model.insert_records(records, self.upsert)
+        self.n_rows += self.n_pending
+        self.pending.clear()
+        self.cleared_albums = []
+        self.n_pending = 0
+
+
+def create_missing_indexes(model):
+    """Creates the indexes of <model> that its table lacks, e.g. when the
+    catalog was created by an older version of ptoolbox. Returns their
+    number.
+    """
+    existing = set(tuple(index.columns) for index in db.get_indexes(model._meta.db_table))
+    n_created = 0
+    for fields, unique in model._index_data():
+        fields = [model._meta.fields[f] if not hasattr(f, 'db_column') else f for f in fields]
+        if tuple(field.db_column for field in fields) not in existing:
+            db.create_index(model, fields, unique)
+            n_created += 1
+    return n_created
+
+
+def init_database(name, reset=False, pragmas=None):
+    """Opens the catalog <name>, and applies the <pragmas> (default:
+    settings.CATALOG['PRAGMAS']) to the connection. Catalogs of older
+    versions get the indexes they lack.
+    """
+    if pragmas is None:
+        pragmas = settings.CATALOG['PRAGMAS']
     db.init(name)
     db.connect()
+    for pragma, value in pragmas:
+        db.execute_sql('PRAGMA %s = %s' % (pragma, value))
     if reset:
         db.drop_tables([GoogleAlbum, GooglePhoto], safe=True)
-        db.create_tables([GoogleAlbum, GooglePhoto])
+    db.create_tables([GoogleAlbum, GooglePhoto], safe=True)
+    with db.atomic():
+        for model in (GoogleAlbum, GooglePhoto):
+            create_missing_indexes(model)
 
 
 def close_database(name):
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lightweight records of the albums and photos of the feeds.
+
+Building a peewee model per entry costs far more than reading the entry,
+and most entries are only written to the database anyway. The records below
+are plain tuples, filled by an extractor compiled once from the table of
+their fields: every key is formatted once and for all instead of once per
+entry. The same table reads the JSON entries of the feeds and the XML ones.
+Models are built on demand, with to_model(): the from_raw_json of the
+models go through the records as well.
+"""
+
+from collections import namedtuple
+from xml.etree import ElementTree
+
+from .constants import G_XML_ROOT, G_XML_NAMESPACES
+from .models import GoogleAlbum, GooglePhoto
+from .utils import g_json_key, iso8601str2datetime, ts2dt
+
+
+def _path(*keys):
+    """Keys leading to a value: strings are (key, namespace) pairs or plain
+    keys, ints are list indexes.
+    """
+    return tuple(g_json_key(*key) if isinstance(key, tuple) else key for key in keys)
+
+
+def compile_extractor(fields):
+    """Returns a function that reads the values of <fields> out of a raw
+    entry. <fields> is a list of (path, converter), a missing value is None
+    and is not converted.
+    """
+    getters = []
+    for path, convert in fields:
+        if len(path) == 2:  # most values are {key: {'$t': value}}
+            first, second = path
+
+            def get(raw, first=first, second=second):
+                try:
+                    return raw[first][second]
+                except (KeyError, IndexError, TypeError):
+                    return None
+        else:
+            def get(raw, path=path):
+                try:
+                    for key in path:
+                        raw = raw[key]
+                    return raw
+                except (KeyError, IndexError, TypeError):
+                    return None
+        getters.append((get, convert))
+
+    def extract(raw):
+        values = []
+        for get, convert in getters:
+            value = get(raw)
+            if convert is not None and value is not None:
+                value = convert(value)
+            values.append(value)
+        return values
+    return extract
+
+
+def _xml_path(*keys):
+    """Same as _path, for an XML entry: keys are (key, namespace) pairs or
+    keys of the root namespace, an attribute may come last as '@name'.
+    """
+    path = []
+    for key in keys:
+        if isinstance(key, tuple):
+            key, namespace = key
+        elif key.startswith('@'):
+            path.append(key)
+            continue
+        else:
+            namespace = G_XML_ROOT
+        path.append('{%s}%s' % (G_XML_NAMESPACES[namespace], key))
+    return tuple(path)
+
+
+_timestamp = lambda value: ts2dt(int(value), millisecs=True)
+
+# the fields of the records: name, path in a JSON entry of the feeds, path
+# in an XML entry (as answered to a creation or an upload), converter
+ALBUM_RECORD_FIELDS = (
+    ('id', _path(('id', 'gphoto'), '$t'), _xml_path(('id', 'gphoto')), None),
+    # camel-cased unique name, and the original title, which may be shared
+    ('name', _path(('name', 'gphoto'), '$t'), _xml_path(('name', 'gphoto')), None),
+    ('title', _path('title', '$t'), _xml_path('title'), None),
+    ('author', _path('author', 0, 'name', '$t'), _xml_path('author', 'name'), None),
+    ('access', _path(('access', 'gphoto'), '$t'), _xml_path(('access', 'gphoto')), None),
+    ('summary', _path('summary', '$t'), _xml_path('summary'), None),
+    ('num_photos', _path(('numphotos', 'gphoto'), '$t'), _xml_path(('numphotos', 'gphoto')),
+     int),
+    ('updated', _path('updated', '$t'), _xml_path('updated'), iso8601str2datetime),
+    ('published', _path('published', '$t'), _xml_path('published'), iso8601str2datetime),
+)
+
+PHOTO_RECORD_FIELDS = (
+    ('album', _path(('albumid', 'gphoto'), '$t'), _xml_path(('albumid', 'gphoto')), None),
+    ('uuid', _path(('id', 'gphoto'), '$t'), _xml_path(('id', 'gphoto')), None),
+    ('url', _path(('group', 'media'), ('content', 'media'), 0, 'url'),
+     _xml_path('content', '@src'), None),
+    ('time', _path(('timestamp', 'gphoto'), '$t'), _xml_path(('timestamp', 'gphoto')),
+     _timestamp),
+    ('size', _path(('size', 'gphoto'), '$t'), _xml_path(('size', 'gphoto')), int),
+    ('title', _path('title', '$t'), _xml_path('title'), None),
+    ('width', _path(('width', 'gphoto'), '$t'), _xml_path(('width', 'gphoto')), int),
+    ('height', _path(('height', 'gphoto'), '$t'), _xml_path(('height', 'gphoto')), int),
+    ('unique_id', _path(('tags', 'exif'), ('imageUniqueID', 'exif'), '$t'),
+     _xml_path(('tags', 'exif'), ('imageUniqueID', 'exif')), None),
+)
+
+
+def compile_xml_extractor(fields):
+    """Same as compile_extractor, for the XML entries."""
+    getters = []
+    for path, convert in fields:
+        attribute = path[-1][1:] if path[-1].startswith('@') else None
+        element = '/'.join(path[:-1] if attribute else path)
+        getters.append((element, attribute, convert))
+
+    def extract(entry):
+        values = []
+        for element, attribute, convert in getters:
+            node = entry.find(element)
+            value = None
+            if node is not None:
+                value = node.get(attribute) if attribute else node.text
+            if convert is not None and value is not None:
+                value = convert(value)
+            values.append(value)
+        return values
+    return extract
+
+
+class Record(object):
+    """Behaviour of the records, mixed with a namedtuple of the fields."""
+
+    __slots__ = ()
+    model = None
+    extract = None
+    extract_xml = None
+
+    @classmethod
+    def from_raw_json(cls, raw):
+        return cls._make(cls.extract(raw))
+
+    @classmethod
+    def from_xml(cls, data):
+        """Builds a record out of an XML entry, given as bytes."""
+        return cls._make(cls.extract_xml(ElementTree.fromstring(data)))
+
+    def to_model(self):
+        return self.model(**self._asdict())
+
+
+class AlbumRecord(namedtuple('AlbumRecord', [field[0] for field in ALBUM_RECORD_FIELDS]), Record):
+    __slots__ = ()
+    model = GoogleAlbum
+    extract = staticmethod(compile_extractor([(f[1], f[3]) for f in ALBUM_RECORD_FIELDS]))
+    extract_xml = staticmethod(compile_xml_extractor([(f[2], f[3]) for f in ALBUM_RECORD_FIELDS]))
+
+
+class PhotoRecord(namedtuple('PhotoRecord', [field[0] for field in PHOTO_RECORD_FIELDS]), Record):
+    __slots__ = ()
+    model = GooglePhoto
+    extract = staticmethod(compile_extractor([(f[1], f[3]) for f in PHOTO_RECORD_FIELDS]))
+    extract_xml = staticmethod(compile_xml_extractor([(f[2], f[3]) for f in PHOTO_RECORD_FIELDS]))
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming parser of the JSON feeds of the Picasa Web API.
+
+A feed page is one large object, {"feed": {"entry": [...], ...}}, whose
+entries make nearly all of its size. FeedParser reads it from an iterator
+of byte chunks (such as requests' iter_content) and yields every entry as
+soon as it is complete: neither the whole body nor the whole tree of the
+page are in memory at once, and entries get parsed while the rest of the
+page is still on the wire.
+
+The structure around the entries is walked one token at a time; values are
+decoded by json.JSONDecoder.raw_decode once the buffer holds all of them.
+"""
+
+import codecs
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class FeedParser(object):
+    """Parses a JSON feed out of byte <chunks>. entries() yields the entries
+    of the feed, the other values of the feed are in self.feed once it's
+    exhausted.
+    """
+
+    def __init__(self, chunks, encoding='utf-8'):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder(encoding)()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = u''
+        self.pos = 0
+        self.eof = False
+        self.feed = {}
+
+    def _read(self):
+        """Appends the next chunk to the buffer, dropping what was already
+        parsed. Returns False at the end of the stream.
+        """
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            text = self.text_decoder.decode(chunk)
+            if text:
+                break
+        else:
+            text = self.text_decoder.decode(b'', True)
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return bool(text)
+
+    def _peek(self):
+        """Returns the next non-blank character without consuming it, or ''
+        at the end of the stream.
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ''
+
+    def _expect(self, chars):
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError('invalid feed: expected one of %r at %r' % (chars, char))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """Decodes the next value. The buffer is grown until the value is
+        complete, doubling its size at every attempt to keep the number of
+        attempts low on large values.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if self.eof:
+                    raise
+            else:
+                # a number at the end of the buffer may go on in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            size = 2 * (len(self.buffer) - self.pos)
+            while len(self.buffer) - self.pos < size and self._read():
+                pass
+
+    def _members(self):
+        """Yields the keys of the object at the current position. The value
+        of every key must be consumed before the next key is asked.
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            yield key
+            if self._expect(',}') == '}':
+                return
+
+    def _elements(self):
+        """Same as _members, for the elements of an array."""
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self._expect(',]') == ']':
+                return
+
+    def entries(self):
+        for key in self._members():
+            if key != 'feed':
+                self._value()
+                continue
+            for feed_key in self._members():
+                if feed_key == 'entry':
+                    for _ in self._elements():
+                        yield self._value()
+                else:
+                    self.feed[feed_key] = self._value()
+        if self._peek():
+            raise ValueError('invalid feed: trailing data')
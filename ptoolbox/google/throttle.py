@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""
+Client-side throttling of the requests to the Picasa Web API.
+
+Retries alone don't help a throttling server: every thread keeps sending
+at its own pace, and the retries add to the load. A Throttle is shared by
+every request of a client and combines:
+
+- a token bucket, capping the rate of requests;
+- an AIMD controller of the requests in flight, as TCP does with its
+  window: the limit is halved when the server throttles (429, 503) or
+  answers too slowly, and grows back by one every <limit> successes;
+- a circuit breaker: after too many failures in a row, requests are
+  refused at once for a while, then a single one probes the server.
+"""
+
+import threading
+import time
+
+from requests.exceptions import RequestException
+
+from ptoolbox import log
+from ptoolbox.conf import settings
+
+THROTTLE_STATUSES = (429, 503)  # the server asks to slow down
+FAILURE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'  # requests are refused
+BREAKER_HALF_OPEN = 'half-open'  # a single request probes the server
+
+
+class CircuitOpenError(RequestException):
+    """A request refused without being sent, the server failing."""
+
+
+class TokenBucket(object):
+    """Allows <rate> acquisitions per second on average, and bursts of up to
+    <capacity>. A <rate> of 0 allows any rate.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _wait(self):
+        """Takes a token, or returns the delay until the next one."""
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Blocks until a token is available, returns the time waited."""
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            delay = self._wait()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+
+class Throttle(object):
+    """Admission of the requests of a client: acquire() before sending a
+    request, release() once it's answered, see the module documentation.
+    """
+
+    def __init__(self, rate=None, burst=None, min_limit=None, max_limit=None,
+                 latency_threshold=None, breaker_threshold=None, breaker_cooldown=None):
+        conf = settings.PICASA_CLIENT
+        self.bucket = TokenBucket(conf['RATE'] if rate is None else rate,
+                                  conf['BURST'] if burst is None else burst)
+        self.min_limit = conf['MIN_CONCURRENCY'] if min_limit is None else min_limit
+        self.max_limit = conf['MAX_CONCURRENCY'] if max_limit is None else max_limit
+        self.latency_threshold = latency_threshold
+        if latency_threshold is None:
+            self.latency_threshold = conf['LATENCY_THRESHOLD']
+        self.breaker_threshold = breaker_threshold
+        if breaker_threshold is None:
+            self.breaker_threshold = conf['BREAKER_THRESHOLD']
+        self.breaker_cooldown = breaker_cooldown
+        if breaker_cooldown is None:
+            self.breaker_cooldown = conf['BREAKER_COOLDOWN']
+
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.n_failures = 0  # in a row
+        self.breaker = BREAKER_CLOSED
+        self.opened_at = 0.0
+        self.throttle_events = 0
+        self.breaker_trips = 0
+        self.waited = 0.0  # seconds spent waiting for admission
+        self.condition = threading.Condition()
+
+    def _admit(self, probe):
+        """Raises CircuitOpenError unless the breaker lets a request through.
+        Once the cooldown is over, the <probe> request gets through alone.
+        """
+        if self.breaker == BREAKER_CLOSED:
+            return
+        if self.breaker == BREAKER_OPEN and time.time() - self.opened_at >= self.breaker_cooldown:
+            if probe:
+                self.breaker = BREAKER_HALF_OPEN
+            return
+        raise CircuitOpenError('too many failures, requests suspended.')
+
+    def acquire(self):
+        """Blocks until the request may be sent, returns its start time to be
+        given to release(). Raises CircuitOpenError if the breaker is open.
+        """
+        start = time.time()
+        with self.condition:
+            self._admit(probe=False)  # fail fast, before waiting
+        self.bucket.acquire()
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self._admit(probe=True)  # the breaker may have opened meanwhile
+            self.in_flight += 1
+            now = time.time()
+            self.waited += now - start
+            return now
+
+    def release(self, started, status_code=None, timed=True):
+        """Accounts for a request sent at <started>, answered with
+        <status_code>, or failed if None. Unless <timed>, its latency is not
+        taken as a sign of throttling, e.g. for an upload of a large body.
+        """
+        now = time.time()
+        failed = status_code is None or status_code in FAILURE_STATUSES
+        throttled = status_code in THROTTLE_STATUSES or \
+            timed and now - started > self.latency_threshold
+        with self.condition:
+            self.in_flight -= 1
+            if throttled and started >= self.last_decrease:
+                # one decrease per window: the requests in flight meanwhile
+                # were sent at the previous limit
+                self.limit = max(float(self.min_limit), self.limit / 2)
+                self.last_decrease = now
+                self.throttle_events += 1
+                log.debug('throttle: concurrency limited to %d.' % self.limit)
+            elif not throttled and not failed:
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+            if failed:
+                self.n_failures += 1
+                if self.breaker == BREAKER_HALF_OPEN or self.n_failures >= self.breaker_threshold:
+                    if self.breaker != BREAKER_OPEN:
+                        self.breaker_trips += 1
+                        log.debug('throttle: %d failures, requests suspended.' % self.n_failures)
+                    self.breaker = BREAKER_OPEN
+                    self.opened_at = now
+            else:
+                self.n_failures = 0
+                self.breaker = BREAKER_CLOSED
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'concurrency_limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'throttle_events': self.throttle_events,
+                'breaker': self.breaker,
+                'breaker_trips': self.breaker_trips,
+                'throttle_wait': self.waited,
+            }
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 
+import os.path
+import re
+
+from peewee import (Model, SqliteDatabase, CharField, IntegerField, FloatField,
+                    DateTimeField, SQL)
+
 from .path import get_filename, get_dirname
 
+index_db = SqliteDatabase(None)  # Un-initialized local scan index.
+
 
 def directory2album(name):
     return None if name == '.' else name
@@ -12,7 +20,8 @@ class ImageInfo(object):
     directory, album title...
     """
 
-    def __init__(self, path, width, height, checksum, time=None, unique_id=None, rel_path=None):
+    def __init__(self, path, width, height, checksum, time=None, unique_id=None, rel_path=None,
+                 phash=None):
         self.path = path
         self.time = time
         self.unique_id = unique_id
@@ -21,6 +30,7 @@ class ImageInfo(object):
         self.directory = get_dirname(path)
         self.album_title = directory2album(get_dirname(rel_path if rel_path else path))
         self.width, self.height = width, height
+        self.phash = phash  # perceptual hash, see ptoolbox.phash
 
     def __repr__(self):
         return self.path
@@ -30,3 +40,88 @@ class ImageInfo(object):
 
     def __unicode__(self):
         return self.__repr__()
+
+
+class IndexedImage(Model):
+    """Scan index entry: what was learned about a local file the last time it
+    was probed. It stays valid as long as the file size, mtime and inode
+    are unchanged. Files that are not valid images are indexed as well, with
+    a null checksum, so that they are not probed again.
+    """
+
+    path = CharField(primary_key=True)
+    size = IntegerField()
+    mtime = FloatField()
+    inode = IntegerField()
+    checksum = CharField(null=True)
+    time = DateTimeField(null=True)
+    unique_id = CharField(null=True)
+    width = IntegerField(null=True)
+    height = IntegerField(null=True)
+    phash = CharField(null=True)  # hexadecimal, as it overflows SQLite integers
+
+    class Meta:
+        database = index_db
+
+    @classmethod
+    def under(cls, root):
+        """Returns the entries found under <root>, indexed by path. The
+        prefix match is a LIKE, served by the primary key index (see
+        init_index).
+        """
+        prefix = os.path.join(root, '')
+        pattern = re.sub(r'([\\%_])', r'\\\1', prefix) + '%'
+        query = cls.select().where(SQL("path LIKE ? ESCAPE '\\'", pattern))
+        return dict((e.path, e) for e in query)
+
+    @classmethod
+    def store(cls, path, stat, img=None):
+        res = {
+            'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'inode': stat.st_ino,
+        }
+        if img is not None:
+            res.update({
+                'checksum': img.checksum,
+                'time': img.time,
+                'unique_id': img.unique_id,
+                'width': img.width,
+                'height': img.height,
+                'phash': '%016x' % img.phash if img.phash is not None else None,
+            })
+        cls.insert(**res).upsert().execute()
+
+    @classmethod
+    def prune(cls, paths):
+        paths = list(paths)
+        for i in range(0, len(paths), 500):  # stay below the SQLite variables limit
+            cls.delete().where(cls.path << paths[i:i + 500]).execute()
+
+    def matches(self, stat):
+        return (self.size == stat.st_size and self.mtime == stat.st_mtime and
+                self.inode == stat.st_ino)
+
+    def is_valid(self):
+        return self.checksum is not None
+
+    def to_image_info(self, root):
+        return ImageInfo(self.path, self.width, self.height, self.checksum, self.time,
+                         self.unique_id, rel_path=os.path.relpath(self.path, root),
+                         phash=int(self.phash, 16) if self.phash is not None else None)
+
+
+def init_index(name, reset=False):
+    index_db.init(name)
+    index_db.connect()
+    # paths are case sensitive, and SQLite only uses an index for LIKE if it is too
+    index_db.execute_sql('PRAGMA case_sensitive_like = ON')
+    table = IndexedImage._meta.db_table
+    if table in index_db.get_tables():
+        columns = set(c.name for c in index_db.get_columns(table))
+        if columns != set(f.db_column for f in IndexedImage._meta.sorted_fields):
+            reset = True  # the index is only a cache: rebuild it rather than migrate it
+    if reset:
+        index_db.drop_tables([IndexedImage], safe=True)
+    index_db.create_tables([IndexedImage], safe=True)
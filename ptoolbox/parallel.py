@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+"""
+Concurrency primitives, for I/O bound work (HTTP requests mostly): threads
+are enough, as the GIL is released while waiting for the network.
+"""
+
+import sys
+
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+try:
+    from Queue import Queue
+except ImportError:  # Python 3
+    from queue import Queue
+
+
+def imap_bounded(func, iterable, jobs, window=None, ordered=True):
+    """Same as map(func, iterable), with <jobs> threads calling <func>.
+    Results are yielded in order, or as soon as they are available if not
+    <ordered>. At most <window> calls (default: twice the number of threads)
+    are pending or waiting to be consumed, so that a slow consumer does not
+    pile results up in memory.
+    """
+    if window is None:
+        window = 2 * jobs
+    pool = ThreadPool(jobs)
+    try:
+        results = _ordered_results if ordered else _unordered_results
+        for res in results(pool, func, iterable, window):
+            yield res
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _ordered_results(pool, func, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _unordered_results(pool, func, iterable, window):
+    done = Queue()
+
+    def call(item):
+        try:
+            done.put((func(item), None))
+        except Exception:
+            done.put((None, sys.exc_info()[1]))
+
+    def result():
+        res, error = done.get()
+        if error is not None:
+            raise error
+        return res
+
+    n_pending = 0
+    for item in iterable:
+        pool.apply_async(call, (item,))
+        n_pending += 1
+        if n_pending >= window:
+            n_pending -= 1
+            yield result()
+    while n_pending:
+        n_pending -= 1
+        yield result()
@@ -6,16 +6,26 @@ Contains all file manipulation primitives.
 """
 
 import exifread
-import hashlib
 import imghdr
+import io
+import mmap
 import os
 import os.path
-import requests
 import struct
 
 from scandir import scandir
 
+from .checksum import checksum, checksum_data, CHECKSUM_MD5, CHECKSUM_BLOCK_SIZE
+from .conf import settings, EXIF_ENGINE_FAST
+from .download import download
+from .exif import read_tags, TAG_NAMES
+from .phash import image_dhash
+
 IMGHDR_JPEG_TYPE = 'jpeg'
+JPEG_SOI = b'\xff\xd8\xff'  # start of image marker, followed by any other marker
+JPEG_APP1 = 0xffe1
+JPEG_SOS = 0xffda
+EXIF_HEADER = b'Exif\x00\x00'
 PTOOLBOX_BASE_DIR = '.ptoolbox'
 
 
@@ -39,6 +49,30 @@ def get_tags(path, details=False):
     return tags
 
 
+def native_tag_value(tag):
+    """Converts an exifread tag to the native values returned by exif.read_tags."""
+    if tag.field_type == 2:  # ASCII
+        return str(tag.values).strip('\0 ')
+    values = [float(x.num) / x.den if x.den else 0.0 for x in tag.values] \
+        if tag.field_type in (5, 10) else list(tag.values)
+    return values[0] if len(values) == 1 else values
+
+
+def parse_tags(exif, engine=None):
+    """Returns the tags we use (see exif.TAG_NAMES) from the TIFF payload of
+    an APP1 Exif segment, as native values. <engine> defaults to
+    settings.EXIF_ENGINE.
+    """
+    if not exif:
+        return {}
+    if engine is None:
+        engine = settings.EXIF_ENGINE
+    if engine == EXIF_ENGINE_FAST:
+        return read_tags(exif)
+    tags = exifread.process_file(io.BytesIO(exif), details=False)
+    return {name: native_tag_value(tags[name]) for name in TAG_NAMES.values() if name in tags}
+
+
 def get_filename(path):
     return os.path.basename(path)
 
@@ -62,12 +96,8 @@ def fastwalk(path, deep=True):
         yield(e)
 
 
-def md5sum(filename, blocksize=65536):
-    h = hashlib.md5()
-    with open(filename, "rb") as f:
-        for block in iter(lambda: f.read(blocksize), ''):
-            h.update(block)
-    return h.hexdigest()
+def md5sum(filename, blocksize=CHECKSUM_BLOCK_SIZE):
+    return checksum(filename, CHECKSUM_MD5, blocksize)
 
 
 def is_jpeg_header(header_type):
@@ -96,15 +126,83 @@ def jpeg_size(path):
     raise ValueError('the file does not bear a valid SOF0 header')
 
 
-def download_file(url, filename=None):
-    """Downloads a file using its URL; does not accept special headers yet.
+def jpeg_segments(data):
+    """Walks the JPEG headers of <data> (see jpeg_size) until the SOFx header.
+    Returns the TIFF payload of the APP1 Exif segment (or None), the width
+    and the height of the image.
+    """
+    exif = None
+    offset = 2
+    while offset + 4 <= len(data):
+        header_type, size = struct.unpack_from('>HH', data, offset)
+        if not is_jpeg_header(header_type) or header_type == JPEG_SOS:
+            break
+        if is_sof0_header(header_type):
+            bpi, height, width = struct.unpack_from('>BHH', data, offset + 4)
+            return exif, width, height
+        if header_type == JPEG_APP1 and exif is None:
+            segment = data[offset + 4:offset + 2 + size]
+            if segment.startswith(EXIF_HEADER):
+                exif = segment[len(EXIF_HEADER):]
+        offset += 2 + size
+    raise ValueError('the file does not bear a valid SOF0 header')
+
+
+class ImageProbe(object):
+    """Everything we need to know about an image file, gathered from a
+    single read of its content. Fields are None when they do not apply,
+    e.g. the checksum of a file that is not an image.
+    """
+
+    def __init__(self, path, size, image_type=None, checksum=None, exif=None,
+                 width=None, height=None, phash=None):
+        self.path = path
+        self.size = size
+        self.image_type = image_type
+        self.checksum = checksum
+        self.exif = exif
+        self.width, self.height = width, height
+        self.phash = phash
+
+    def is_jpeg(self):
+        return self.image_type == IMGHDR_JPEG_TYPE
+
+    def has_size(self):
+        return self.width is not None
+
+
+def probe_image(path, checksum=True, phash=False):
+    """Opens and maps the file once: sniffs its type and, for JPEGs, hashes
+    the whole content (unless not <checksum>) and extracts the Exif payload
+    and the image size. With <phash>, the perceptual hash is computed from
+    the same mapping, see phash.image_dhash.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(JPEG_SOI):  # also, empty files can't be mapped
+            return ImageProbe(path, size)
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(JPEG_SOI)] != JPEG_SOI:
+                return ImageProbe(path, size)
+            probe = ImageProbe(path, size, IMGHDR_JPEG_TYPE)
+            if checksum:
+                probe.checksum = checksum_data(data, CHECKSUM_MD5)
+            try:
+                probe.exif, probe.width, probe.height = jpeg_segments(data)
+            except (ValueError, struct.error):
+                pass
+            if phash:
+                probe.phash = image_dhash(data, probe.exif)
+            return probe
+        finally:
+            data.close()
+
+
+def download_file(url, filename=None, size=None):
+    """Downloads a file using its URL, see download.download.
     """
     if not filename:
         filename = url.split('/')[-1]
-    r = requests.get(url, stream=True)
-    with open(filename, 'wb') as f:
-        for chunk in r.iter_content(chunk_size=1024):
-            if chunk:  # filter-out keep-alive new chunks
-                f.write(chunk)
-                f.flush()
+    download(url, filename, size)
     return filename
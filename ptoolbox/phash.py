@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Perceptual hashing, to find the same picture once resized, re-exported or
+recompressed, which checksums can't do.
+
+Images are hashed with dHash: the picture is reduced to 9x8 grey pixels
+and every bit tells if a pixel is brighter than its right neighbour. Close
+pictures get hashes at a small Hamming distance; BKTree indexes the hashes
+so that the neighbours of a hash are found without comparing it to every
+other hash.
+Pixels come from the EXIF thumbnail when there is one, otherwise from a
+reduced-scale decode of the JPEG (see PIL.Image.draft): full images are
+never decoded. Requires Pillow, which is optional.
+"""
+
+import io
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from .exif import read_thumbnail
+
+DHASH_SIZE = 8  # the hash is DHASH_SIZE * DHASH_SIZE bits long
+DHASH_DRAFT_SIZE = 64  # minimal size of the reduced-scale decode
+
+
+def is_available():
+    return Image is not None
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def dhash(image, size=DHASH_SIZE):
+    """Returns the dHash of a PIL image, as an integer."""
+    image.draft('L', (DHASH_DRAFT_SIZE, DHASH_DRAFT_SIZE))
+    pixels = list(image.convert('L').resize((size + 1, size), Image.LANCZOS).getdata())
+    h = 0
+    for row in range(size):
+        for col in range(size):
+            left, right = pixels[row * (size + 1) + col], pixels[row * (size + 1) + col + 1]
+            h = (h << 1) | (left > right)
+    return h
+
+
+def image_dhash(source, exif=None):
+    """Returns the dHash of a JPEG, from the thumbnail of its <exif> payload
+    if possible. <source> is the path of the file or its content as a
+    seekable file-like object, e.g. the mapping of path.probe_image. Returns
+    None if Pillow is missing or the image can't be decoded.
+    """
+    if Image is None:
+        return None
+    thumbnail = read_thumbnail(exif)
+    try:
+        if thumbnail:
+            return dhash(Image.open(io.BytesIO(thumbnail)))
+        if not hasattr(source, 'read'):
+            with open(source, 'rb') as f:
+                return dhash(Image.open(f))
+        source.seek(0)
+        return dhash(Image.open(source))
+    except (IOError, ValueError):
+        return None
+
+
+class BKTree(object):
+    """Burkhard-Keller tree of hashes, for Hamming distance queries.
+    Every node keeps its children by their distance to it; the triangle
+    inequality tells which children may hold hashes close to the query.
+    """
+
+    def __init__(self, distance=hamming_distance):
+        self.distance = distance
+        self.root = None  # (hash, items, {distance: child node})
+        self.n_hashes = 0
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = (h, [item], {})
+            self.n_hashes += 1
+            return
+        node = self.root
+        while True:
+            node_hash, items, children = node
+            d = self.distance(h, node_hash)
+            if d == 0:
+                items.append(item)
+                return
+            if d not in children:
+                children[d] = (h, [item], {})
+                self.n_hashes += 1
+                return
+            node = children[d]
+
+    def search(self, h, max_distance):
+        """Returns the (distance, item) within <max_distance> of <h>."""
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_hash, items, children = nodes.pop()
+            d = self.distance(h, node_hash)
+            if d <= max_distance:
+                found.extend((d, item) for item in items)
+            for child_d, child in children.items():
+                if d - max_distance <= child_d <= d + max_distance:
+                    nodes.append(child)
+        return sorted(found, key=lambda found_item: found_item[0])
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reconciliation of a local library with the remote catalog.
+
+The remote photos are loaded once into hash maps keyed by unique id and by
+time, then every local image is looked up in them: planning is a single
+pass over both sides instead of a few catalog queries per local image.
+The local images are planned as they are scanned, never held in memory.
+The catalog knows no checksum: checksums only tell local copies of a same
+file apart, which are planned once.
+
+The result is a SyncPlan, which can be reviewed and saved as JSON before
+being executed.
+"""
+
+import json
+
+from collections import defaultdict
+from datetime import datetime
+
+from .google import models
+
+SYNC_UPLOAD = 'upload'  # local image missing from the catalog
+SYNC_DOWNLOAD = 'download'  # remote photo missing from the local library
+SYNC_CONFLICT = 'conflict'  # local image matching several remote photos
+SYNC_MATCHED = 'matched'
+SYNC_IGNORED = 'ignored'  # local image that can't be planned, with a reason
+
+SYNC_ACTIONS = (SYNC_UPLOAD, SYNC_DOWNLOAD, SYNC_CONFLICT, SYNC_MATCHED, SYNC_IGNORED)
+
+SYNC_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+# columns of the remote photos read by the planner
+REMOTE_FIELDS = ('album', 'uuid', 'url', 'time', 'width', 'height', 'unique_id', 'size')
+
+
+class SyncPlan(object):
+    """What to do with every image, one list of actions per SYNC_ACTIONS.
+    Actions are dicts of JSON-friendly values, but times.
+    """
+
+    def __init__(self, actions=None):
+        for action in SYNC_ACTIONS:
+            setattr(self, action, list(actions.get(action, ())) if actions else [])
+
+    def summary(self):
+        return dict((action, len(getattr(self, action))) for action in SYNC_ACTIONS)
+
+    def to_json(self):
+        actions = dict((action, getattr(self, action)) for action in SYNC_ACTIONS)
+        return json.dumps(actions, indent=1, sort_keys=True,
+                          default=lambda dt: dt.strftime(SYNC_TIME_FORMAT))
+
+    @classmethod
+    def from_json(cls, data):
+        actions = json.loads(data)
+        for action in actions.get(SYNC_DOWNLOAD, ()):
+            action['time'] = datetime.strptime(action['time'], SYNC_TIME_FORMAT)
+        return cls(actions)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_json().encode('utf-8'))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_json(f.read().decode('utf-8'))
+
+
+def load_remote_photos():
+    """Returns the photos of the catalog as tuples of REMOTE_FIELDS, without
+    building a model per photo.
+    """
+    fields = [getattr(models.GooglePhoto, name) for name in REMOTE_FIELDS]
+    return models.GooglePhoto.select(*fields).tuples()
+
+
+def load_album_names():
+    return dict(models.GoogleAlbum.select(models.GoogleAlbum.id, models.GoogleAlbum.name).tuples())
+
+
+def plan_sync(images, photos, album_names=None):
+    """Returns the SyncPlan of the local <images> (ImageInfo objects, read
+    once) against the remote <photos> (tuples of REMOTE_FIELDS, see
+    load_remote_photos). An image matches the photos of same unique id,
+    or else of same time; photos of same time are told apart by their
+    dimensions. Remote photos matched by no image are to be downloaded in
+    the directory named after their album (see <album_names>).
+    """
+    if album_names is None:
+        album_names = {}
+    photos = list(photos)
+    by_unique_id = defaultdict(list)
+    by_time = defaultdict(list)
+    for photo in photos:
+        album_id, uuid, url, time, width, height, unique_id, size = photo
+        if unique_id:
+            by_unique_id[unique_id].append(photo)
+        by_time[time].append(photo)
+
+    plan = SyncPlan()
+    planned = {}  # checksum -> path of the first local copy
+    matched = set()  # (album id, uuid) of the photos found locally
+    for img in images:
+        if img.checksum in planned:
+            plan.ignored.append({'path': img.path, 'reason': 'copy of %s' % planned[img.checksum]})
+            continue
+        planned[img.checksum] = img.path
+
+        candidates = by_unique_id.get(img.unique_id, ()) if img.unique_id else ()
+        if not candidates:
+            if img.time is None:  # would pollute the online albums
+                plan.ignored.append({'path': img.path, 'reason': 'no time'})
+                continue
+            candidates = by_time.get(img.time, ())
+            if len(candidates) > 1:
+                dimensions = sorted((img.width, img.height))
+                candidates = [photo for photo in candidates
+                              if sorted((photo[4], photo[5])) == dimensions] or candidates
+
+        if not candidates:
+            plan.upload.append({'path': img.path, 'album': img.album_title})
+            continue
+        matched.update((photo[0], photo[1]) for photo in candidates)
+        if len(candidates) == 1:
+            plan.matched.append({'path': img.path, 'album_id': candidates[0][0],
+                                 'uuid': candidates[0][1]})
+        else:
+            plan.conflict.append({'path': img.path,
+                                  'photos': [[photo[0], photo[1]] for photo in candidates]})
+
+    for album_id, uuid, url, time, width, height, unique_id, size in photos:
+        if (album_id, uuid) not in matched:
+            plan.download.append({'album_id': album_id, 'uuid': uuid, 'url': url, 'time': time,
+                                  'size': size, 'album': album_names.get(album_id, album_id)})
+    return plan
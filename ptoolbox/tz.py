@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timezone resolution of GPS coordinates.
+
+The offline engine works from a spatial index of the timezone boundaries,
+built once from a GeoJSON file such as the ones released by the
+timezone-boundary-builder project (one feature per timezone, with a 'tzid'
+property). The world is cut into a grid of square cells; for every timezone
+polygon crossing a cell, the cell only keeps the polygon edges that cross it
+and whether its reference point is inside the polygon. A point is then
+located by counting the edges crossed on the way to the reference point of
+its cell, which only involves a handful of edges whatever the size of the
+polygon.
+
+Lookups of the online engine are memoized by TimezoneCache: photos are
+heavily clustered in space and time, so coordinates and timestamps are
+quantized into buckets and the answers persisted across runs.
+
+The offline engine requires pytz (pip install ptoolbox[offline-tz]).
+"""
+
+import bisect
+import json
+import math
+import os
+import os.path
+import pickle
+
+from collections import defaultdict, OrderedDict
+from datetime import datetime
+from multiprocessing.util import Finalize
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from ptoolbox import log
+
+from .conf import settings, TZ_ENGINE_OFFLINE
+from .google.utils import latlon2tz as google_latlon2tz, dt2ts
+from .path import ptoolbox_dir, ensure_directory
+
+TZ_INDEX_FILENAME = 'tz-index.pickle'
+TZ_CACHE_FILENAME = 'tz-cache.json'
+
+# Position of the reference point within its cell. Boundaries often have
+# vertices on round coordinates, the reference point must not be one of them.
+TZ_INDEX_REFERENCE = (0.5190283, 0.4637519)
+
+tz_index_path = os.path.join(ptoolbox_dir, TZ_INDEX_FILENAME)
+tz_cache_path = os.path.join(ptoolbox_dir, TZ_CACHE_FILENAME)
+
+
+def _crossings(y, edges):
+    """Sorted abscissas where the horizontal line at <y> crosses <edges>."""
+    xs = []
+    for (x1, y1), (x2, y2) in edges:
+        if (y1 > y) != (y2 > y):
+            xs.append(x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+    xs.sort()
+    return xs
+
+
+def _path_crossings(x, y, x0, y0, edges):
+    """Number of <edges> crossed on the way from (x, y) to (x0, y0), along
+    the horizontal line then along the vertical line.
+    """
+    x_min, x_max = min(x, x0), max(x, x0)
+    y_min, y_max = min(y, y0), max(y, y0)
+    n = 0
+    for (x1, y1), (x2, y2) in edges:
+        if (y1 > y) != (y2 > y):
+            if x_min < x1 + (y - y1) * (x2 - x1) / (y2 - y1) <= x_max:
+                n += 1
+        if (x1 > x0) != (x2 > x0):
+            if y_min < y1 + (x0 - x1) * (y2 - y1) / (x2 - x1) < y_max:
+                n += 1
+    return n
+
+
+class TimezoneIndex(object):
+    """Grid index of the timezone polygons, see module documentation."""
+
+    def __init__(self, grid_size=1.0):
+        self.grid_size = grid_size
+        # (row, col) -> list of (tzid, is_reference_inside, edges)
+        self.cells = defaultdict(list)
+
+    def _cell(self, lon, lat):
+        return (int(math.floor((lat + 90.0) / self.grid_size)),
+                int(math.floor((lon + 180.0) / self.grid_size)))
+
+    def _reference(self, row, col):
+        dx, dy = TZ_INDEX_REFERENCE
+        return ((col + dx) * self.grid_size - 180.0,
+                (row + dy) * self.grid_size - 90.0)
+
+    def add_polygon(self, tzid, rings):
+        """Adds a polygon given as a list of rings (exterior, then holes) of
+        (lon, lat) points. Holes are handled by the even-odd rule.
+        """
+        edges = []
+        for ring in rings:
+            points = [(float(point[0]), float(point[1])) for point in ring]
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()  # GeoJSON rings are closed
+            edges.extend(zip(points, points[1:] + points[:1]))
+        if not edges:
+            return
+
+        # dispatch the edges to the cells of their bounding box
+        cell_edges = defaultdict(list)
+        for edge in edges:
+            (x1, y1), (x2, y2) = edge
+            r1, c1 = self._cell(min(x1, x2), min(y1, y2))
+            r2, c2 = self._cell(max(x1, x2), max(y1, y2))
+            for row in range(r1, r2 + 1):
+                for col in range(c1, c2 + 1):
+                    cell_edges[row, col].append(edge)
+
+        # the inside-ness of every reference point, one row of the grid at a time
+        xs = [x for edge in edges for x, _ in edge]
+        ys = [y for edge in edges for _, y in edge]
+        r1, c1 = self._cell(min(xs), min(ys))
+        r2, c2 = self._cell(max(xs), max(ys))
+        for row in range(r1, r2 + 1):
+            _, y0 = self._reference(row, c1)
+            crossings = _crossings(y0, edges)
+            for col in range(c1, c2 + 1):
+                x0, _ = self._reference(row, col)
+                inside = (len(crossings) - bisect.bisect_right(crossings, x0)) % 2 == 1
+                local_edges = cell_edges.get((row, col), [])
+                if inside or local_edges:
+                    self.cells[row, col].append((tzid, inside, local_edges))
+
+    def add_geojson(self, data):
+        for feature in data['features']:
+            tzid = feature['properties']['tzid']
+            geometry = feature['geometry']
+            if geometry['type'] == 'Polygon':
+                self.add_polygon(tzid, geometry['coordinates'])
+            elif geometry['type'] == 'MultiPolygon':
+                for polygon in geometry['coordinates']:
+                    self.add_polygon(tzid, polygon)
+
+    def lookup(self, lat, lon):
+        """Returns the tzid at the given coordinates. Points outside of any
+        polygon (at sea) get the nautical timezone of their longitude.
+        """
+        row, col = self._cell(lon, lat)
+        x0, y0 = self._reference(row, col)
+        for tzid, inside, edges in self.cells.get((row, col), ()):
+            if inside != (_path_crossings(lon, lat, x0, y0, edges) % 2 == 1):
+                return tzid
+        offset = int(round(lon / 15.0))
+        return 'Etc/GMT%+d' % -offset if offset else 'Etc/GMT'
+
+    def latlon2tz(self, lat, lon, dt=None):
+        """Same as google.utils.latlon2tz, for <dt> as a local time."""
+        import pytz  # only required by the offline engine
+
+        if dt is None:
+            dt = datetime.now()
+        tzid = self.lookup(lat, lon)
+        local_dt = pytz.timezone(tzid).localize(dt)
+        dst_offset = int(local_dt.dst().total_seconds())
+        return {
+            u'status': u'OK',
+            u'timeZoneId': tzid,
+            u'rawOffset': int(local_dt.utcoffset().total_seconds()) - dst_offset,
+            u'dstOffset': dst_offset,
+        }
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((self.grid_size, dict(self.cells)), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            grid_size, cells = pickle.load(f)
+        index = cls(grid_size)
+        index.cells.update(cells)
+        return index
+
+
+def build_tz_index(geojson_path, index_path=None, grid_size=None):
+    """Builds the offline timezone index from a GeoJSON boundaries file and
+    saves it where the offline engine looks for it.
+    """
+    if index_path is None:
+        ensure_directory(ptoolbox_dir)
+        index_path = tz_index_path
+    if grid_size is None:
+        grid_size = settings.TIMEZONE['GRID_SIZE']
+    index = TimezoneIndex(grid_size)
+    with open(geojson_path, 'rb') as f:
+        index.add_geojson(json.loads(f.read().decode('utf-8')))
+    index.save(index_path)
+    return index
+
+
+_tz_index = None
+
+
+def get_tz_index():
+    global _tz_index
+    if _tz_index is None:
+        if not os.path.exists(tz_index_path):
+            raise ValueError("no offline timezone index, build one with 'ptoolbox tz-index'.")
+        _tz_index = TimezoneIndex.load(tz_index_path)
+    return _tz_index
+
+
+class TimezoneCache(object):
+    """LRU cache in front of a latlon2tz-like <lookup> function. Answers are
+    shared by every lookup in the same bucket of <precision> degrees and
+    <period> seconds, and are persisted in <path> (if any) every
+    <save_every> misses and when the process exits.
+    """
+
+    def __init__(self, lookup, path=None, max_size=100000, precision=0.01, period=86400,
+                 save_every=20):
+        self.lookup = lookup
+        self.path = path
+        self.max_size = max_size
+        self.precision = precision
+        self.period = period
+        self.save_every = save_every
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = 0
+        if path and os.path.exists(path):
+            self.entries.update(self._read())
+            self._trim(self.entries)
+
+    def _key(self, lat, lon, dt):
+        return '%d,%d,%d' % (int(round(lat / self.precision)), int(round(lon / self.precision)),
+                             dt2ts(dt) // self.period)
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            return json.loads(f.read().decode('utf-8'), object_pairs_hook=OrderedDict)
+
+    def _trim(self, entries):
+        """Evicts the least recently used of <entries> beyond max_size."""
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def __call__(self, lat, lon, dt=None):
+        if dt is None:
+            dt = datetime.now()
+        key = self._key(lat, lon, dt)
+        if key in self.entries:
+            self.hits += 1
+            value = self.entries.pop(key)
+        else:
+            self.misses += 1
+            value = self.lookup(lat, lon, dt)
+            self.unsaved += 1
+        self.entries[key] = value  # most recently used last
+        self._trim(self.entries)
+        if self.path and self.unsaved >= self.save_every:
+            self.save()
+        return value
+
+    def save(self):
+        """Merges the entries into the cache file, which keeps the
+        <max_size> most recently used ones. Several processes may share the
+        file: merges are serialized by a lock file (where supported), and the
+        file is replaced atomically.
+        """
+        if not self.unsaved:
+            return
+        with open(self.path + '.lock', 'wb') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)  # released when closed
+            entries = self._read() if os.path.exists(self.path) else OrderedDict()
+            for key, value in self.entries.items():
+                entries.pop(key, None)
+                entries[key] = value  # ours are the most recently used
+            self._trim(entries)
+            tmp_path = '%s.%d' % (self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(entries).encode('utf-8'))
+            os.rename(tmp_path, self.path)
+        self.unsaved = 0
+        log.debug('timezone cache: %d hits, %d misses, %d entries saved.' % (
+            self.hits, self.misses, len(entries)))
+
+
+_tz_cache = None
+_tz_cache_pid = None
+
+
+def get_tz_cache():
+    """Returns the cache of online lookups. It gets saved when the process
+    exits, including scan worker processes (see multiprocessing.util).
+    """
+    global _tz_cache, _tz_cache_pid
+    if _tz_cache is None:
+        ensure_directory(ptoolbox_dir)
+        _tz_cache = TimezoneCache(
+            google_latlon2tz, tz_cache_path,
+            max_size=settings.TIMEZONE['CACHE_SIZE'],
+            precision=settings.TIMEZONE['CACHE_PRECISION'],
+            period=settings.TIMEZONE['CACHE_PERIOD'])
+    if _tz_cache_pid != os.getpid():  # finalizers are not inherited by forked processes
+        _tz_cache_pid = os.getpid()
+        Finalize(_tz_cache, _tz_cache.save, exitpriority=10)
+    return _tz_cache
+
+
+def latlon2tz(lat, lon, dt=None, engine=None):
+    """Same as google.utils.latlon2tz, resolved by <engine>, by default the
+    one set in settings.TIMEZONE.
+    """
+    if engine is None:
+        engine = settings.TIMEZONE['ENGINE']
+    if engine == TZ_ENGINE_OFFLINE:
+        return get_tz_index().latlon2tz(lat, lon, dt)
+    if settings.TIMEZONE['CACHE']:
+        return get_tz_cache()(lat, lon, dt)
+    return google_latlon2tz(lat, lon, dt)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+"""
+Uploads of the local pictures.
+
+UploadManager feeds a bounded queue of files to a few worker threads, which
+share the connection pool of the client: there are never more files in
+flight than the queue holds, however many are to be uploaded. Bodies are
+streamed from the disk by requests, a file is never read into memory.
+
+Uploads are not retried by the client, which could duplicate a photo the
+server stored before failing. Every failure is kept along with its file
+instead, and tells whether the upload may succeed if tried again (network
+error, server overloaded) or not (file unreadable, picture refused). The
+uploaded photos are written to the catalog in batches, so that the next
+sync knows them without fetching their albums again.
+"""
+
+import os.path
+import time
+
+from requests.exceptions import RequestException
+
+from ptoolbox import log
+
+from .conf import settings
+from .google import picasa_client, RequestError
+from .google.models import CatalogWriter
+from .parallel import imap_bounded
+
+
+class UploadManager(object):
+    """Uploads files <jobs> at a time through <client>, at most <queue_size>
+    more waiting for a worker. Uploaded photos are written to the catalog
+    through <writer> (default: a CatalogWriter), unless it's False.
+    Failed uploads do not stop the others, see self.failures.
+    """
+
+    def __init__(self, client=None, jobs=None, queue_size=None, writer=None):
+        if client is None:
+            client = picasa_client
+        if jobs is None:
+            jobs = settings.UPLOAD['JOBS']
+        if queue_size is None:
+            queue_size = settings.UPLOAD['QUEUE_SIZE']
+        if writer is None:
+            writer = CatalogWriter(settings.UPLOAD['BATCH_SIZE'])
+        self.client = client
+        self.jobs = jobs
+        self.queue_size = queue_size
+        self.writer = writer
+        self.n_files = 0
+        self.n_bytes = 0
+        self.failures = []  # (path, error, retryable)
+        self.seconds = 0.0
+
+    def _upload(self, item):
+        path, title, album_id = item
+        try:
+            size = os.path.getsize(path)
+            return path, size, self.client.upload_photo(path, title, album_id), None, False
+        except RequestError as e:
+            return path, 0, None, e, e.retryable
+        except RequestException as e:  # network errors
+            return path, 0, None, e, True
+        except (ValueError, IOError, OSError) as e:  # unreadable file, or answer
+            return path, 0, None, e, False
+
+    def run(self, uploads):
+        """Uploads the (path, title, album id) of <uploads>, yields (path,
+        PhotoRecord or None, error or None) as they complete.
+        """
+        start = time.time()
+        try:
+            for path, size, photo, error, retryable in imap_bounded(
+                    self._upload, uploads, self.jobs, self.jobs + self.queue_size, ordered=False):
+                if error is None:
+                    self.n_files += 1
+                    self.n_bytes += size
+                    if self.writer:
+                        self.writer.add([photo])
+                else:
+                    log.debug("upload: '%s' failed (%s): %s" % (
+                        path, 'retryable' if retryable else 'fatal', error))
+                    self.failures.append((path, error, retryable))
+                yield path, photo, error
+        finally:
+            if self.writer:  # even if interrupted, not to upload the same photos again
+                self.writer.flush()
+            self.seconds += time.time() - start
+
+    @property
+    def retryable(self):
+        """Paths of the failed uploads worth trying again."""
+        return [path for path, _, retryable in self.failures if retryable]
+
+    @property
+    def throughput(self):
+        """Bytes sent per second, all uploads together."""
+        return self.n_bytes / self.seconds if self.seconds else 0.0
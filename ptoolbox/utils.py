@@ -3,10 +3,12 @@
 import os
 
 from datetime import datetime, timedelta
+from multiprocessing import Pool
 
-from .path import fastwalk, get_tags, jpeg_size, is_jpeg, md5sum
-from .models import ImageInfo
-from .google.utils import latlon2tz
+from .conf import settings
+from .path import fastwalk, parse_tags, probe_image
+from .models import ImageInfo, IndexedImage, index_db
+from .tz import latlon2tz
 
 TAG_GPS_LAT = 'GPS GPSLatitude'
 TAG_GPS_LON = 'GPS GPSLongitude'
@@ -22,13 +24,11 @@ TAG_DATETIME_KEYS = (
 )
 
 
-def gps_convert(s):
-    direction = {'N':1, 'S':-1, 'E': 1, 'W':-1}
-    x = s.replace(u'°',' ').replace('\'',' ').replace('"',' ')
-    x = x.split()
-    x_dir = x.pop()
-    x.extend([0,0,0])
-    return (int(x[0])+int(x[1])/60.0+int(x[2])/3600.0) * direction[x_dir]
+def gps2deg(values, ref):
+    """Converts (degrees, minutes, seconds) and a N/S/E/W reference to degrees."""
+    direction = {'N': 1, 'S': -1, 'E': 1, 'W': -1}
+    values = list(values) + [0, 0, 0]
+    return (values[0] + values[1] / 60.0 + values[2] / 3600.0) * direction[ref[0].upper()]
 
 
 def count_files(path):
@@ -47,10 +47,14 @@ def dt2str(dt, separator=' '):
 
 
 def parse_exif_unique_id(tags):
-    return tags.get(TAG_IMAGE_UNIQUE_ID, None)
+    return tags.get(TAG_IMAGE_UNIQUE_ID, None) or None
 
 
-def parse_exif_time(tags):
+def parse_exif_time(tags, tz_engine=None):
+    """Returns the time of the image from its tags (see path.parse_tags), as
+    UTC if the image is GPS-tagged. <tz_engine> resolves the timezone, see
+    tz.latlon2tz.
+    """
     values = [tags.get(key, None) for key in TAG_DATETIME_KEYS]
     if not any(values):
         return None
@@ -63,35 +67,121 @@ def parse_exif_time(tags):
     gps_lat_ref = tags.get(TAG_GPS_LAT_REF, None)
     gps_lon_ref = tags.get(TAG_GPS_LON_REF, None)
     if gps_lat and gps_lon and gps_lat_ref and gps_lon_ref:
-        fmt = u'{0}°{1}\'{2}"{3}'
-        gps_lat = [eval(str(x)) for x in gps_lat.values]
-        gps_lon = [eval(str(x)) for x in gps_lon.values]
-        lat_args = gps_lat + [str(gps_lat_ref)[0]]
-        lon_args = gps_lon + [str(gps_lon_ref)[0]]
-        gps_lat = gps_convert(fmt.format(*lat_args))
-        gps_lon = gps_convert(fmt.format(*lon_args))
-        zone_data = latlon2tz(gps_lat, gps_lon, dt)
+        zone_data = latlon2tz(gps2deg(gps_lat, gps_lat_ref), gps2deg(gps_lon, gps_lon_ref), dt,
+                              engine=tz_engine)
         offset = zone_data[u'rawOffset']
         dt = dt - timedelta(seconds=offset)
     return dt
 
 
-def list_valid_images(path, deep=True):
+def image_info(path, root, tz_engine=None):
+    """Returns the ImageInfo of the file at <path>, or None if it is not a
+    'valid' image. <root> is the scanned directory, used for the album title.
+    """
+    # the only time the file is read
+    probe = probe_image(path, phash=settings.LOCAL_SCAN['PHASH'])
+    if not probe.is_jpeg() or not probe.has_size():
+        return None
+    rel_path = os.path.relpath(path, root)
+    tags = parse_tags(probe.exif)
+    # this step may take time, may rely on online timezone service
+    time = parse_exif_time(tags, tz_engine)
+    unique_id = parse_exif_unique_id(tags)
+    return ImageInfo(path, probe.width, probe.height, probe.checksum, time, unique_id,
+                     rel_path=rel_path, phash=probe.phash)
+
+
+def _image_info_worker(args):
+    # multiprocessing only hands a single argument to its workers
+    return args[0], image_info(*args)
+
+
+def scan_images(files, jobs=1, ordered=True):
+    """Yields (path, ImageInfo or None) for every (path, root, tz_engine)
+    in <files>, see list_valid_images.
+    """
+    if jobs <= 1:
+        for args in files:
+            yield _image_info_worker(args)
+        return
+
+    pool = Pool(jobs)
+    try:
+        scan = pool.imap if ordered else pool.imap_unordered
+        for res in scan(_image_info_worker, files, settings.LOCAL_SCAN['CHUNK_SIZE']):
+            yield res
+    except BaseException:  # includes GeneratorExit, when the caller stops early
+        pool.terminate()
+        raise
+    else:
+        pool.close()  # workers exit cleanly, e.g. to save the timezone cache
+    finally:
+        pool.join()
+
+
+def list_indexed_images(path, deep=True, jobs=1, ordered=True, rescan=False, tz_engine=None):
+    """Same as list_valid_images, but images that did not change since
+    the last scan are served from the scan index (see IndexedImage) and only
+    new or modified files are probed. Unchanged images come first.
+    With <rescan>, every file is probed again.
+    """
+    known = IndexedImage.under(path)
+    stale = {}
+    for e in fastwalk(path, deep):
+        entry = known.pop(e.path, None)
+        stat = e.stat()
+        if entry is not None and settings.LOCAL_SCAN['PHASH'] and entry.is_valid() and \
+                entry.phash is None:
+            entry = None  # indexed before perceptual hashes were enabled
+        if entry is not None and not rescan and entry.matches(stat):
+            if entry.is_valid():
+                yield entry.to_image_info(path)
+        else:
+            stale[e.path] = stat
+    IndexedImage.prune(known.keys())  # files that were deleted since last scan
+
+    # entries are written in batches, between two images rather than across
+    # them: a caller that stops early still gets the scanned ones indexed
+    batch_size = settings.LOCAL_SCAN['INDEX_BATCH_SIZE']
+    files = ((p, path, tz_engine) for p in stale)
+    scanned = []
+
+    def store():
+        with index_db.atomic():
+            for p, img in scanned:
+                IndexedImage.store(p, stale[p], img)
+        del scanned[:]
+
+    try:
+        for p, img in scan_images(files, jobs, ordered):
+            scanned.append((p, img))
+            if len(scanned) >= batch_size:
+                store()
+            if img is not None:
+                yield img
+    finally:
+        store()
+
+
+def list_valid_images(path, deep=True, jobs=None, ordered=True, index=False, rescan=False,
+                      tz_engine=None):
     """Walks down a path, yields ImageInfo objects for every 'valid' image.
     A 'valid' image is any file that is JPEG, has minimum info (width, height)
     Time is optional and may be None.
+    With <jobs> greater than 1, images are scanned by a pool of worker
+    processes; <ordered> tells if the images are yielded in walk order or
+    as soon as they have been scanned.
+    With <index>, the scan index is used, see list_indexed_images.
+    <tz_engine> resolves the timezone of GPS-tagged images, the one set in
+    settings.TIMEZONE by default.
     """
-    for e in fastwalk(path, deep):
-        if not is_jpeg(e.path):
-            continue
-        rel_path = os.path.relpath(e.path, path)
-        md5 = md5sum(e.path)
-        tags = get_tags(e.path)
-        time = parse_exif_time(tags)  # this step may take time, may rely on online timezone service
-        unique_id = parse_exif_unique_id(tags)
-        try:
-            width, height = jpeg_size(e.path)
-        except ValueError, e:
-            continue
-        img = ImageInfo(e.path, width, height, md5, time, unique_id, rel_path=rel_path)
-        yield img
+    if jobs is None:
+        jobs = settings.LOCAL_SCAN['JOBS']
+    if index:
+        images = list_indexed_images(path, deep, jobs, ordered, rescan, tz_engine)
+    else:
+        files = ((e.path, path, tz_engine) for e in fastwalk(path, deep))
+        images = (img for _, img in scan_images(files, jobs, ordered))
+    for img in images:
+        if img is not None:
+            yield img
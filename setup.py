@@ -25,6 +25,8 @@ setup(name='ptoolbox',
       ],
       extras_require={
           'test': ['pytest'],
+          'async': ['aiohttp'],  # ptoolbox.google.aio, Python 3.6+
+          'offline-tz': ['pytz'],  # ptoolbox.tz, offline engine
       },
       entry_points="""
       [console_scripts]
@@ -0,0 +1,181 @@
+import struct
+import threading
+
+import pytest
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from ptoolbox.google.fake import FakePWAServer, FakeStore
+
+
+def _ifd(entries, offset, next_ifd=0):
+    """Packs a big-endian TIFF IFD located at <offset>. <entries> is a list
+    of (tag, type, count, value) where value is packed bytes.
+    Returns the IFD bytes, followed by its out-of-line data.
+    """
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    body, data = b'', b''
+    for tag, typ, count, value in entries:
+        if len(value) <= 4:
+            body += struct.pack('>HHI', tag, typ, count) + value.ljust(4, b'\0')
+        else:
+            body += struct.pack('>HHII', tag, typ, count, data_offset + len(data))
+            data += value
+    return struct.pack('>H', len(entries)) + body + struct.pack('>I', next_ifd) + data
+
+
+def _ascii(s):
+    value = s.encode('ascii') + b'\0'
+    return (2, len(value), value)
+
+
+def _rationals(*values):
+    return (5, len(values), b''.join(struct.pack('>II', n, d) for n, d in values))
+
+
+def build_exif(datetime_original=None, unique_id=None, gps=None, thumbnail=None):
+    """Builds the TIFF payload of an APP1 Exif segment."""
+    exif_entries = []
+    if datetime_original:
+        exif_entries.append((0x9003,) + _ascii(datetime_original))
+    if unique_id:
+        exif_entries.append((0xa420,) + _ascii(unique_id))
+
+    ifd0_entries = [(0x0110,) + _ascii('ptoolbox')]
+    n_ifd0 = len(ifd0_entries) + 1 + (1 if gps else 0)
+    ifd0_size = 2 + 12 * n_ifd0 + 4 + 9  # 'ptoolbox\0' is out of line
+
+    exif_offset = 8 + ifd0_size
+    exif_ifd = _ifd(exif_entries, exif_offset)
+    ifd0_entries.append((0x8769, 4, 1, struct.pack('>I', exif_offset)))
+
+    gps_ifd = b''
+    if gps:
+        (lat, lat_ref), (lon, lon_ref) = gps
+        gps_offset = exif_offset + len(exif_ifd)
+        gps_ifd = _ifd([
+            (0x0001,) + _ascii(lat_ref),
+            (0x0002,) + _rationals(*lat),
+            (0x0003,) + _ascii(lon_ref),
+            (0x0004,) + _rationals(*lon),
+        ], gps_offset)
+        ifd0_entries.append((0x8825, 4, 1, struct.pack('>I', gps_offset)))
+
+    ifd1 = b''
+    ifd1_offset = 0
+    if thumbnail:
+        ifd1_offset = exif_offset + len(exif_ifd) + len(gps_ifd)
+        ifd1 = _ifd([
+            (0x0201, 4, 1, struct.pack('>I', ifd1_offset + 2 + 2 * 12 + 4)),
+            (0x0202, 4, 1, struct.pack('>I', len(thumbnail))),
+        ], ifd1_offset) + thumbnail
+
+    ifd0 = _ifd(ifd0_entries, 8, next_ifd=ifd1_offset)
+    assert len(ifd0) == ifd0_size
+    return b'MM\0*' + struct.pack('>I', 8) + ifd0 + exif_ifd + gps_ifd + ifd1
+
+
+def build_jpeg(width=64, height=48, payload=b'', **exif):
+    """Builds a syntactically valid (if undecodable) JPEG file content."""
+    tiff = build_exif(**exif)
+    app1 = b'Exif\0\0' + tiff
+    sof0 = struct.pack('>BHHB', 8, height, width, 1) + b'\x01\x11\x00'
+    return (b'\xff\xd8' +
+            b'\xff\xe1' + struct.pack('>H', len(app1) + 2) + app1 +
+            b'\xff\xc0' + struct.pack('>H', len(sof0) + 2) + sof0 +
+            b'\xff\xda' + struct.pack('>H', 8) + b'\x01\x01\x00\x00\x3f\x00' +
+            payload + b'\xff\xd9')
+
+
+@pytest.fixture
+def jpeg_tree(tmpdir):
+    """A small local library: two albums, a duplicate and a non-image."""
+    album = tmpdir.mkdir('holidays')
+    album.join('a.jpg').write(build_jpeg(
+        100, 50, b'a', datetime_original='2015:02:16 10:00:00', unique_id='ID-A'), 'wb')
+    album.join('b.jpg').write(build_jpeg(
+        200, 100, b'b', datetime_original='2015:02:17 11:30:00'), 'wb')
+    other = tmpdir.mkdir('other')
+    other.join('c.jpg').write(build_jpeg(10, 20, b'c'), 'wb')
+    other.join('notes.txt').write('not an image')
+    tmpdir.join('orphan.jpg').write(build_jpeg(
+        100, 50, b'a', datetime_original='2015:02:16 10:00:00', unique_id='ID-A'), 'wb')
+    return tmpdir
+
+
+class LocalServer(ThreadingMixIn, HTTPServer):
+    """Answers with <handler> on a free local port. Keeps the requests it
+    received, as (method, path, headers, body), and tracks those in flight.
+    """
+    daemon_threads = True
+
+    def __init__(self, handler):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), handler)
+        self.url = 'http://127.0.0.1:%d/' % self.server_address[1]
+        self.lock = threading.Lock()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    """Answers every request with the (status, headers, body) returned by
+    answer(). self.rank is the rank of the request, from 0.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def answer(self, body):
+        raise NotImplementedError
+
+    def _dispatch(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with server.lock:
+            self.rank = len(server.requests)
+            server.requests.append((self.command, self.path, self.headers, body))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            status, headers, data = self.answer(body)
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    do_GET = do_POST = _dispatch
+
+
+@pytest.fixture
+def local_server(request):
+    """A LocalServer, of the handler class given by indirect parametrization."""
+    server = LocalServer(request.param)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_pwa(request):
+    """A FakePWAServer of 3 albums of 25 photos, with the password 'secret'.
+    Other options may be given by indirect parametrization.
+    """
+    options = dict(store=FakeStore.synthetic(3, 25), password='secret', seed=0)
+    options.update(getattr(request, 'param', {}))
+    server = FakePWAServer(**options).start()
+    yield server
+    server.stop()
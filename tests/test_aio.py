@@ -0,0 +1,108 @@
+import json
+import sys
+import time
+
+import pytest
+
+if sys.version_info < (3, 6):
+    pytest.skip('the asyncio client requires Python 3.6+', allow_module_level=True)
+pytest.importorskip('aiohttp')
+
+import asyncio
+
+from urllib.parse import urlparse, parse_qs
+
+from ptoolbox.google import aio
+from ptoolbox.google.fake import FakeStore, album_entry, photo_entry
+
+from conftest import LocalHandler
+
+N_PHOTOS = 23
+STORE = FakeStore()
+STORE.add_album('holidays', album_id='1')
+for n in range(1, N_PHOTOS + 1):
+    STORE.add_photo('1', '%d.jpg' % n, 1000, 100, 50, photo_id=str(n), url='http://x/%d.jpg' % n)
+
+
+class FeedHandler(LocalHandler):
+    """Serves the album of STORE, whose feeds tell their total. The first
+    request gets a 503 answer.
+    """
+    with_total = True
+
+    def answer(self, body):
+        time.sleep(0.05)
+        if self.rank == 0:
+            return 503, {}, b''
+        params = parse_qs(urlparse(self.path).query)
+        if params.get('kind') == ['photo']:
+            index, page_size = int(params['start-index'][0]), int(params['max-results'][0])
+            photos = list(STORE.photos['1'].values())[index - 1:index - 1 + page_size]
+            body = {'feed': {'entry': [photo_entry(photo) for photo in photos]}}
+            if self.with_total:
+                body['feed']['openSearch$totalResults'] = {'$t': N_PHOTOS}
+        else:
+            body = {'feed': album_entry(STORE.albums['1'], N_PHOTOS)}
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body).encode('utf-8')
+
+
+class NoTotalFeedHandler(FeedHandler):
+    with_total = False
+
+
+def _collect(aiterator):
+    loop = asyncio.get_event_loop()
+    items = []
+    while True:
+        try:
+            items.append(loop.run_until_complete(aiterator.__anext__()))
+        except StopAsyncIteration:
+            return items
+
+
+@pytest.mark.parametrize('local_server', [FeedHandler], indirect=True)
+def test_fetch_images(local_server, monkeypatch):
+    monkeypatch.setattr(aio, 'backoff_delay', lambda attempt: 0)
+    client = aio.AsyncPicasaClient(page_size=5, concurrency=3)
+    client._url = lambda suffix='', selector='feed': local_server.url + suffix
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        album = loop.run_until_complete(client.get_album('1'))
+        assert (album.title, album.num_photos) == ('holidays', N_PHOTOS)
+
+        photos = _collect(client.fetch_images('1'))
+        assert [photo.uuid for photo in photos] == [str(n) for n in range(1, N_PHOTOS + 1)]
+        assert photos[0].album == '1' and photos[0].width == 100
+
+        # 1 retried album request, the album is then cached, and 5 concurrent pages
+        assert len(local_server.requests) == 2 + 5
+        assert 1 < local_server.max_in_flight <= 3
+        assert client.retry_budget.n_retries == 1
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
+
+
+@pytest.mark.parametrize('local_server', [NoTotalFeedHandler], indirect=True)
+def test_fetch_without_total(local_server, monkeypatch):
+    monkeypatch.setattr(aio, 'backoff_delay', lambda attempt: 0)
+    client = aio.AsyncPicasaClient(page_size=5, concurrency=3)
+    client._url = lambda suffix='', selector='feed': local_server.url + suffix
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        url, params = client._images_feed('1', {})
+        photos = _collect(client._paginated_fetch(url, params, aio.PhotoRecord.from_raw_json))
+        assert [photo.uuid for photo in photos] == [str(n) for n in range(1, N_PHOTOS + 1)]
+
+        # pages left behind are cancelled and collected
+        pages = client._paginated_fetch(url, params, aio.PhotoRecord.from_raw_json, total=N_PHOTOS)
+        loop.run_until_complete(pages.__anext__())
+        loop.run_until_complete(pages.aclose())
+        assert not [task for task in asyncio.all_tasks(loop) if not task.done()]
+    finally:
+        loop.run_until_complete(client.close())
+        loop.close()
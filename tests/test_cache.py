@@ -0,0 +1,55 @@
+import os
+
+from ptoolbox.google import PicasaClient
+from ptoolbox.google.cache import ResponseCache
+
+
+def test_response_cache(tmpdir):
+    directory = str(tmpdir.join('cache'))
+    cache = ResponseCache(directory, max_size=1000)
+    key = cache.key('http://x/feed', {'b': 2, 'a': 1})
+    assert key == cache.key('http://x/feed', {'a': 1, 'b': 2})
+    assert cache.get(key) == (None, None)
+
+    cache.put(key, '"v1"', [1, 2, 3])
+    assert cache.get(key) == ('"v1"', [1, 2, 3])
+    cache.hit(key)
+    assert cache.stats()['cache_hit_rate'] == 0.5
+
+    # least recently used first out
+    for n in range(3):
+        cache.put(cache.key('http://x/%d' % n), '"v1"', 'x' * 400)
+    assert cache.size <= 1000 and cache.evictions == 2
+    assert cache.get(key) == (None, None)
+    assert len(os.listdir(directory)) == 2
+
+    # the entries survive the process
+    reloaded = ResponseCache(directory, max_size=1000)
+    assert reloaded.size == cache.size
+    assert reloaded.get(cache.key('http://x/2')) == ('"v1"', 'x' * 400)
+
+
+def test_conditional_get(fake_pwa, tmpdir):
+    client = PicasaClient(page_size=10, jobs=1, base_url=fake_pwa.url)
+    client.authenticate('bob', 'secret')
+    client.response_cache = ResponseCache(str(tmpdir.join('cache')))
+    album_id = list(fake_pwa.store.albums)[0]
+
+    def crawl():
+        client.album_cache.invalidate()
+        album = client.get_album(album_id)
+        return album, [photo.uuid for photo in client.fetch_images(album_id, album=album)]
+
+    album, uuids = crawl()
+    assert album.num_photos == 25 and uuids == list(fake_pwa.store.photos[album_id])
+    assert fake_pwa.stats['not_modified'] == 0
+
+    # unchanged: headers only, the same results
+    assert crawl() == (album, uuids)
+    assert fake_pwa.stats['not_modified'] == 4  # the album and its 3 pages
+    assert client.pool_stats()['cache_hits'] == 4
+
+    photo = fake_pwa.store.add_photo(album_id, 'new.jpg', 1000)
+    album, new_uuids = crawl()
+    assert album.num_photos == 26 and new_uuids == uuids + [photo.uuid]
+    assert fake_pwa.stats['not_modified'] == 4
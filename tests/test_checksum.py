@@ -0,0 +1,27 @@
+import hashlib
+
+import pytest
+
+from ptoolbox.checksum import checksum, checksum_many, CHECKSUM_ALGORITHMS
+
+
+def test_checksum(tmpdir):
+    content = b''.join(bytes(bytearray([i % 256])) for i in range(3000))
+    tmpdir.join('file').write(content, 'wb')
+    tmpdir.join('empty').write(b'', 'wb')
+    for algorithm in CHECKSUM_ALGORITHMS:
+        expected = hashlib.new(algorithm, content).hexdigest()
+        assert checksum(str(tmpdir.join('file')), algorithm) == expected
+        assert checksum(str(tmpdir.join('empty')), algorithm) == hashlib.new(algorithm).hexdigest()
+    with pytest.raises(ValueError):
+        checksum(str(tmpdir.join('file')), 'crc0')
+
+
+def test_checksum_many(tmpdir):
+    paths = []
+    for i in range(10):
+        tmpdir.join(str(i)).write(str(i) * (i * 1000))
+        paths.append(str(tmpdir.join(str(i))))
+    serial = list(checksum_many(paths))
+    assert [p for p, _ in serial] == paths
+    assert list(checksum_many(paths, jobs=4)) == serial
@@ -1,6 +1,56 @@
+from datetime import datetime
+
+import click
+import pytest
+
 from click.testing import CliRunner
+from requests.exceptions import ConnectionError
 
+from ptoolbox import cli as cli_module
 from ptoolbox.cli import cli
+from ptoolbox.conf import settings
+from ptoolbox.google import PicasaClient
+from ptoolbox.google.fake import FakeStore
+from ptoolbox.google.models import GoogleAlbum, GooglePhoto
+from ptoolbox.sync import plan_sync, load_remote_photos, load_album_names
+from ptoolbox.utils import list_valid_images
+
+from conftest import build_jpeg
+
+
+def _burst_store():
+    """An album of two photos taken within the same second."""
+    store = FakeStore()
+    album = store.add_album('Trip')
+    for title in ('a.jpg', 'b.jpg'):
+        store.add_photo(album.id, title, size=3000, time=datetime(2015, 2, 16, 10))
+    return store
+
+
+def _road_trip_store():
+    """An album 'Road trip' of a photo, downloaded to the folder 'RoadTrip'."""
+    store = FakeStore()
+    album = store.add_album('Road trip')
+    store.add_photo(album.id, 'a.jpg', size=3000, time=datetime(2015, 2, 16, 10))
+    return store
+
+
+def _titles_store():
+    """An album 'Holidays', and two albums titled 'Misc'."""
+    store = FakeStore()
+    for title in ('Holidays', 'Misc', 'Misc'):
+        store.add_album(title)
+    return store
+
+
+@pytest.fixture
+def client(fake_pwa, tmpdir, monkeypatch):
+    """The client of the commands, on <fake_pwa>, with a catalog in <tmpdir>."""
+    monkeypatch.setattr(cli_module, 'ptoolbox_dir', str(tmpdir))
+    monkeypatch.setitem(settings.RESPONSE_CACHE, 'ENABLED', False)
+    client = PicasaClient(page_size=10, base_url=fake_pwa.url)
+    monkeypatch.setattr(cli_module, 'pc', client)
+    return client
 
 
 def test_cli_count():
@@ -8,3 +58,82 @@ def test_cli_count():
     result = runner.invoke(cli, ['3'])
     assert result.exit_code == 0
     assert result.output == "False\nFalse\nFalse\n"
+
+
+@pytest.mark.parametrize('fake_pwa', [{'store': FakeStore.synthetic(3, 5)}], indirect=True)
+def test_interrupted_refresh(fake_pwa, client, monkeypatch):
+    cli_module.fetch_catalog('bob', 'secret', 'bob')
+    albums = list(fake_pwa.store.albums)
+    for album_id in albums[:2]:
+        fake_pwa.store.add_photo(album_id, 'new.jpg', size=1000)
+
+    fetched = []
+    fetch_images = client.fetch_images
+
+    def interrupted(album_id, **kwargs):
+        if fetched:
+            raise ConnectionError('connection lost')
+        fetched.append(album_id)
+        return fetch_images(album_id, **kwargs)
+    monkeypatch.setattr(client, 'fetch_images', interrupted)
+    with pytest.raises(ConnectionError):
+        cli_module.fetch_catalog('bob', 'secret', 'bob', jobs=1, refresh=True)
+
+    # the album whose photos were not fetched is fetched again
+    refetched = []
+    monkeypatch.setattr(client, 'fetch_images', lambda album_id, **kwargs: (
+        refetched.append(album_id) or fetch_images(album_id, **kwargs)))
+    cli_module.fetch_catalog('bob', 'secret', 'bob', jobs=1, refresh=True)
+    assert refetched == [albums[1]]
+    assert GooglePhoto.select().count() == 3 * 5 + 2
+    assert GoogleAlbum.select().count() == 3
+
+
+@pytest.mark.parametrize('fake_pwa', [{'store': _burst_store()}], indirect=True)
+def test_download_same_second(client, tmpdir, monkeypatch):
+    jobs = []
+    imap_bounded = cli_module.imap_bounded
+    monkeypatch.setattr(cli_module, 'imap_bounded', lambda func, items, n_jobs, **kwargs: (
+        jobs.append(n_jobs) or imap_bounded(func, items, n_jobs, **kwargs)))
+    cli_module.fetch_catalog('bob', 'secret', 'bob')  # as sync does
+    assert jobs == [settings.CATALOG['JOBS']]
+    cli_module.init_user_database('bob')
+    plan = plan_sync([], load_remote_photos(), load_album_names())
+    cli_module.execute_plan(plan, str(tmpdir.join('photos')))
+    assert len(tmpdir.join('photos', 'Trip').listdir()) == 2
+
+
+@pytest.mark.parametrize('fake_pwa', [{'store': _titles_store()}], indirect=True)
+def test_resolve_albums(fake_pwa, client):
+    cli_module.fetch_catalog('bob', 'secret', 'bob')
+    cli_module.init_user_database('bob')
+    album_ids = cli_module.resolve_albums(['Holidays', 'Trip', None, 'Trip'])
+    assert fake_pwa.store.albums[album_ids['Holidays']].title == 'Holidays'
+    assert album_ids['Trip'] in fake_pwa.store.albums and album_ids[None] == 'default'
+    assert GoogleAlbum.get(GoogleAlbum.id == album_ids['Trip']).title == 'Trip'
+    assert cli_module.resolve_albums(['Trip'])['Trip'] == album_ids['Trip']  # not created again
+
+    with pytest.raises(click.ClickException):  # which one?
+        cli_module.resolve_albums(['Misc'])
+
+
+@pytest.mark.parametrize('fake_pwa', [{'store': _road_trip_store()}], indirect=True)
+def test_sync_back(fake_pwa, client, tmpdir):
+    # the photos of an album are downloaded to the folder of its name...
+    cli_module.fetch_catalog('bob', 'secret', 'bob')
+    cli_module.init_user_database('bob')
+    photos_dir = tmpdir.join('photos')
+    cli_module.execute_plan(plan_sync([], load_remote_photos(), load_album_names()),
+                            str(photos_dir))
+    assert [folder.basename for folder in photos_dir.listdir()] == ['RoadTrip']
+
+    # ...where new photos are uploaded to the same album
+    photos_dir.join('RoadTrip', 'new.jpg').write(build_jpeg(
+        100, 50, b'new', datetime_original='2015:03:01 12:00:00'), 'wb')
+    images = list_valid_images(str(photos_dir), jobs=1)
+    cli_module.execute_plan(plan_sync(images, load_remote_photos(), load_album_names()),
+                            str(photos_dir))
+    album_id = list(fake_pwa.store.albums)[0]
+    assert len(fake_pwa.store.albums) == 1
+    assert [photo.title for photo in fake_pwa.store.photos[album_id].values()] == \
+        ['a.jpg', 'new.jpg']
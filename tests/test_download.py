@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from ptoolbox.download import download, DownloadManager, DOWNLOAD_PART_SUFFIX
+from ptoolbox.path import download_file
+
+from conftest import LocalHandler
+
+CONTENT = bytes(bytearray(range(256))) * 1000
+
+
+class FileHandler(LocalHandler):
+    """Serves CONTENT on any path, honouring Range requests, except on
+    /missing.
+    """
+
+    def answer(self, body):
+        if self.path == '/missing':
+            return 404, {}, b''
+        header = self.headers.get('Range')
+        if not header:
+            return 200, {}, CONTENT
+        start = int(header.split('=')[1].rstrip('-'))
+        if start >= len(CONTENT):
+            return 416, {'Content-Range': 'bytes */%d' % len(CONTENT)}, b''
+        return 206, {'Content-Range': 'bytes %d-%d/%d' % (start, len(CONTENT) - 1, len(CONTENT))}, \
+            CONTENT[start:]
+
+
+pytestmark = pytest.mark.parametrize('local_server', [FileHandler], indirect=True)
+
+
+def _ranges(server):
+    """The Range headers received by the <server>."""
+    return [headers.get('Range') for _, path, headers, _ in server.requests if path != '/missing']
+
+
+def test_download_resume(local_server, tmpdir):
+    path = str(tmpdir.join('a.jpg'))
+    with open(path + DOWNLOAD_PART_SUFFIX, 'wb') as f:
+        f.write(CONTENT[:1000])  # left by an interrupted run
+    assert download(local_server.url + 'a.jpg', path, len(CONTENT)) == len(CONTENT) - 1000
+    assert _ranges(local_server) == ['bytes=1000-']
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(path + DOWNLOAD_PART_SUFFIX)
+
+    assert download_file(local_server.url + 'b.jpg', str(tmpdir.join('b.jpg'))) == \
+        str(tmpdir.join('b.jpg'))
+    assert tmpdir.join('b.jpg').size() == len(CONTENT)
+
+
+def test_download_wrong_size(local_server, tmpdir):
+    # the server tells the size of the file, the expected one may be wrong
+    path = str(tmpdir.join('a.jpg'))
+    assert download(local_server.url + 'a.jpg', path, len(CONTENT) - 1) == len(CONTENT)
+    assert tmpdir.join('a.jpg').size() == len(CONTENT)
+
+    # a complete part file left by a run that expected another size
+    tmpdir.join('b.jpg' + DOWNLOAD_PART_SUFFIX).write(CONTENT, 'wb')
+    path = str(tmpdir.join('b.jpg'))
+    assert download(local_server.url + 'b.jpg', path, len(CONTENT) + 1) == 0
+    assert tmpdir.join('b.jpg').size() == len(CONTENT)
+    assert _ranges(local_server)[-1] == 'bytes=%d-' % len(CONTENT)
+
+    # a part file larger than the file can't be resumed, it is dropped
+    tmpdir.join('c.jpg' + DOWNLOAD_PART_SUFFIX).write(CONTENT + b'x', 'wb')
+    path = str(tmpdir.join('c.jpg'))
+    with pytest.raises(ValueError):
+        download(local_server.url + 'c.jpg', path, len(CONTENT))
+    assert not os.path.exists(path + DOWNLOAD_PART_SUFFIX)
+    download(local_server.url + 'c.jpg', path, len(CONTENT))
+    assert tmpdir.join('c.jpg').size() == len(CONTENT)
+
+
+def test_download_manager(local_server, tmpdir):
+    downloads = [(local_server.url + '%d.jpg' % n, str(tmpdir.join('%d.jpg' % n)), len(CONTENT))
+                 for n in range(10)]
+    downloads.append((local_server.url + 'missing', str(tmpdir.join('missing.jpg')), None))
+    manager = DownloadManager(jobs=4)
+    results = list(manager.run(downloads))
+    assert len(results) == 11
+    assert (manager.n_files, manager.n_bytes) == (10, 10 * len(CONTENT))
+    assert [path for path, error in manager.failures] == [str(tmpdir.join('missing.jpg'))]
+    assert manager.throughput > 0
+    assert sorted(os.listdir(str(tmpdir))) == sorted('%d.jpg' % n for n in range(10))
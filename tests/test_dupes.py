@@ -0,0 +1,28 @@
+from ptoolbox.dupes import find_duplicates
+
+
+def test_find_duplicates(jpeg_tree):
+    report = find_duplicates(str(jpeg_tree))
+    a, orphan = str(jpeg_tree.join('holidays', 'a.jpg')), str(jpeg_tree.join('orphan.jpg'))
+    assert report.groups == [[a, orphan]]
+    assert report.reclaimable_bytes == jpeg_tree.join('orphan.jpg').size()
+    assert report.n_files == 5
+    assert report.n_full_hashes == 0  # small files are fully covered by the chunks
+
+
+def test_find_duplicates_funnel(tmpdir):
+    head, tail = b'h' * 100, b't' * 100
+    tmpdir.join('same1').write(head + b'x' * 1000 + tail, 'wb')
+    tmpdir.join('same2').write(head + b'x' * 1000 + tail, 'wb')
+    tmpdir.join('middle').write(head + b'y' * 1000 + tail, 'wb')  # same chunks
+    tmpdir.join('tail').write(head + b'x' * 1000 + b'u' * 100, 'wb')  # same size
+    tmpdir.join('small').write(b'x')
+    tmpdir.join('empty1').write(b'')
+    tmpdir.join('empty2').write(b'')
+
+    report = find_duplicates(str(tmpdir), chunk_size=100)
+    assert report.groups == [[str(tmpdir.join('same1')), str(tmpdir.join('same2'))]]
+    assert report.reclaimable_bytes == 1200
+    assert report.n_partial_hashes == 4
+    assert report.n_full_hashes == 3
+    assert report.bytes_read == 4 * 200 + 3 * 1200
@@ -0,0 +1,41 @@
+from ptoolbox.conf import EXIF_ENGINE_EXIFREAD, EXIF_ENGINE_FAST
+from ptoolbox.exif import read_tags, read_thumbnail
+from ptoolbox.path import parse_tags
+
+from conftest import build_exif
+
+GPS = (((48, 1), (51, 1), (2400, 100)), 'N'), (((2, 1), (21, 1), (800, 100)), 'E')
+
+
+def test_read_tags():
+    tiff = build_exif(datetime_original='2015:02:16 10:00:00', unique_id='ID-A', gps=GPS)
+    assert read_tags(tiff) == {
+        'EXIF DateTimeOriginal': '2015:02:16 10:00:00',
+        'EXIF ImageUniqueID': 'ID-A',
+        'GPS GPSLatitudeRef': 'N',
+        'GPS GPSLatitude': [48.0, 51.0, 24.0],
+        'GPS GPSLongitudeRef': 'E',
+        'GPS GPSLongitude': [2.0, 21.0, 8.0],
+    }
+    assert read_tags(tiff, ['EXIF ImageUniqueID']) == {'EXIF ImageUniqueID': 'ID-A'}
+
+
+def test_read_tags_corrupted():
+    tiff = build_exif(datetime_original='2015:02:16 10:00:00')
+    assert read_tags(b'') == {}
+    assert read_tags(b'JUNK' + tiff[4:]) == {}
+    assert read_tags(tiff[:40]) == {}
+
+
+def test_engines_agree():
+    for exif in ({}, {'unique_id': 'ID-A'}, {'datetime_original': '2015:02:16 10:00:00', 'gps': GPS}):
+        tiff = build_exif(**exif)
+        assert parse_tags(tiff, EXIF_ENGINE_FAST) == parse_tags(tiff, EXIF_ENGINE_EXIFREAD)
+
+
+def test_read_thumbnail():
+    tiff = build_exif(datetime_original='2015:02:16 10:00:00', gps=GPS, thumbnail=b'\xff\xd8JPEG')
+    assert read_thumbnail(tiff) == b'\xff\xd8JPEG'
+    assert read_tags(tiff)['GPS GPSLatitudeRef'] == 'N'
+    assert read_thumbnail(build_exif()) is None
+    assert read_thumbnail(tiff[:-2]) is None
@@ -0,0 +1,120 @@
+import os.path
+
+import pytest
+import requests
+
+from ptoolbox import google
+from ptoolbox.download import DownloadManager
+from ptoolbox.google import PicasaClient
+from ptoolbox.google.cache import ResponseCache
+from ptoolbox.google.fake import FakePWAServer, FakeStore
+from ptoolbox.upload import UploadManager
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+
+def _client(server, **kwargs):
+    client = PicasaClient(page_size=10, base_url=server.url, **kwargs)
+    client.authenticate('bob@gmail.com', 'secret')
+    return client
+
+
+def test_authentication(fake_pwa):
+    client = PicasaClient(base_url=fake_pwa.url)
+    assert client.auth_url == fake_pwa.url + 'accounts/ClientLogin'
+    with pytest.raises(ValueError):
+        client.authenticate('bob', 'wrong')
+    with pytest.raises(ValueError):  # no token
+        list(client.fetch_albums())
+    client.authenticate('bob', 'secret')
+    assert len(list(client.fetch_albums())) == 3
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_crawl(fake_pwa, jobs):
+    client = _client(fake_pwa, jobs=jobs)
+    albums = list(client.fetch_albums(page_size=2))
+    assert [album.title for album in albums] == ['Album 0', 'Album 1', 'Album 2']
+    assert [album.num_photos for album in albums] == [25, 25, 25]
+
+    photos = list(client.fetch_images(albums[1].id))
+    assert [photo.title for photo in photos] == ['%05d.jpg' % n for n in range(25)]
+    assert photos[1].unique_id and photos[0].unique_id is None
+    assert client.get_image(photos[3].uuid, albums[1].id) == photos[3]
+    assert client.get_album(albums[0].id) == albums[0]
+
+
+def test_albums_and_uploads(fake_pwa, tmpdir):
+    client = _client(fake_pwa)
+    album_id = client.create_album('Road <trip>', summary='west')
+    album = client.get_album(album_id)
+    assert (album.title, album.summary, album.num_photos) == ('Road <trip>', 'west', 0)
+
+    for name in ('a.jpg', 'b.jpg'):
+        tmpdir.join(name).write(b'\xff\xd8' + name.encode('ascii') * 500, 'wb')
+    manager = UploadManager(client, jobs=2, writer=False)
+    uploaded = list(manager.run([(str(tmpdir.join('a.jpg')), 'a.jpg', album_id),
+                                 (str(tmpdir.join('b.jpg')), 'b.jpg', 'default')]))
+    assert [error for _, _, error in uploaded] == [None, None]
+    assert client.get_album(album_id).num_photos == 1
+    photo = [photo for _, photo, _ in uploaded if photo.title == 'b.jpg'][0]
+    assert fake_pwa.store.albums[photo.album].title == 'Drop Box'
+
+    # the uploaded content is served back
+    path = str(tmpdir.join('copy.jpg'))
+    list(DownloadManager(jobs=1).run([(photo.url, path, photo.size)]))
+    assert os.path.getsize(path) == 2 + 5 * 500
+
+    client.delete_album(album_id)
+    with pytest.raises(ValueError):
+        client.get_album(album_id)
+    with pytest.raises(ValueError):
+        client.delete_album(album_id)
+
+
+def test_faults(monkeypatch):
+    monkeypatch.setattr(google, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(google.time, 'sleep', lambda delay: None)  # Retry-After
+    server = FakePWAServer(FakeStore.synthetic(4, 30), error_rate=0.2, seed=1).start()
+    try:
+        client = _client(server, jobs=2)
+        albums = list(client.fetch_albums())
+        photos = [photo for album in albums for photo in client.fetch_images(album.id, album=album)]
+        assert len(photos) == 4 * 30
+        assert server.stats['errors'] > 0
+        assert client.pool_stats()['retries'] == server.stats['errors']
+    finally:
+        server.stop()
+
+    server = FakePWAServer(throttle_rate=2).start()
+    try:
+        statuses = [requests.get(server.url + 'data/feed/api/user/bob/').status_code
+                    for _ in range(4)]
+        assert statuses.count(503) >= 1 and server.stats['throttled'] == statuses.count(503)
+    finally:
+        server.stop()
+
+
+def test_conditional_crawl(fake_pwa, tmpdir):
+    client = _client(fake_pwa)
+    client.response_cache = ResponseCache(str(tmpdir.join('cache')))
+    album = list(client.fetch_albums())[0]
+    first = list(client.fetch_images(album.id, album=album))
+    assert fake_pwa.stats['not_modified'] == 0
+    assert list(client.fetch_images(album.id, album=album)) == first
+    assert fake_pwa.stats['not_modified'] == 3  # pages of 10 out of 25
+
+
+def test_samples():
+    store = FakeStore.from_samples(SAMPLES_DIR)
+    assert store.albums and any(store.photos.values())
+    server = FakePWAServer(store).start()
+    try:
+        client = _client(server)
+        albums = list(client.fetch_albums())
+        assert len(albums) == len(store.albums)
+        n_photos = sum(len(list(client.fetch_images(album.id, album=album)))
+                       for album in albums)
+        assert n_photos == sum(len(photos) for photos in store.photos.values())
+    finally:
+        server.stop()
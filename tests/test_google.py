@@ -0,0 +1,323 @@
+import json
+import os.path
+
+import pytest
+
+from requests.exceptions import ChunkedEncodingError, ConnectionError
+
+from ptoolbox import google
+from ptoolbox.google import request_with_retry, AlbumCache, RetryBudget, backoff_delay
+from ptoolbox.google.models import GoogleAlbum, GooglePhoto
+from ptoolbox.google.records import AlbumRecord, PhotoRecord
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    """Answers with the given statuses, or raises the given exceptions."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.n_requests = 0
+        self.responses = []
+
+    def request(self, method, **kwargs):
+        self.n_requests += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        self.responses.append(FakeResponse(answer))
+        return self.responses[-1]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(google.time, 'sleep', delays.append)
+    return delays
+
+
+def test_request_with_retry(sleeps):
+    session = FakeSession(503, ConnectionError(), 429, 200)
+    res = request_with_retry('GET', n_retries=5, session=session, url='http://x')
+    assert res.status_code == 200
+    assert session.n_requests == 4
+    assert len(sleeps) == 3
+
+    session = FakeSession(404, 200)
+    assert request_with_retry('GET', session=session, url='http://x').status_code == 404
+    assert session.n_requests == 1
+
+    session = FakeSession(500, 500)
+    assert request_with_retry('GET', n_retries=2, session=session, url='http://x').status_code == 500
+    session = FakeSession(ConnectionError(), ConnectionError())
+    with pytest.raises(ConnectionError):
+        request_with_retry('GET', n_retries=2, session=session, url='http://x')
+
+
+def test_request_with_retry_read(sleeps):
+    reads = []
+
+    def read(res):  # the first body is cut short
+        reads.append(res)
+        if len(reads) == 1:
+            raise ChunkedEncodingError()
+        return 'body'
+
+    session = FakeSession(503, 200, 200)
+    assert request_with_retry('GET', session=session, read=read, url='http://x') == 'body'
+    assert session.n_requests == 3 and len(reads) == 2
+    assert [res.closed for res in session.responses] == [True, True, False]
+
+    def cut_short(res):
+        raise ChunkedEncodingError()
+
+    session = FakeSession(200, 200)
+    with pytest.raises(ChunkedEncodingError):
+        request_with_retry('GET', n_retries=2, session=session, read=cut_short, url='http://x')
+    assert session.n_requests == 2
+
+
+def test_retry_budget(sleeps):
+    budget = RetryBudget(ratio=0.5, min_retries=2)
+    session = FakeSession(*([503] * 10))
+    res = request_with_retry('GET', n_retries=10, session=session, budget=budget, url='http://x')
+    assert res.status_code == 503
+    # 2 tokens at most, each request earns 0.5 and each retry costs 1
+    assert session.n_requests == 4
+    assert (budget.n_retries, budget.n_denied) == (3, 1)
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=0.5, cap=4) <= min(4, 0.5 * 2 ** attempt)
+
+
+class FakeFeedResponse(object):
+
+    def __init__(self, feed):
+        self.status_code = 200
+        self.headers = {}
+        self.feed = feed
+
+    def json(self):
+        return {'feed': self.feed}
+
+    def iter_content(self, chunk_size=1):
+        data = json.dumps({'feed': self.feed}).encode('utf-8')
+        return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+    def close(self):
+        pass
+
+
+class FakeFeedClient(google.PicasaClient):
+    """Serves a feed of <n_items> numbered items, without any network."""
+
+    def __init__(self, n_items, **kwargs):
+        super(FakeFeedClient, self).__init__(**kwargs)
+        self.n_items = n_items
+        self.pages = []
+
+    def _request(self, method, url, params=None, read=None, **kwargs):
+        index, page_size = params['start-index'], params['max-results']
+        self.pages.append((index, page_size))
+        items = range(index, min(index + page_size, self.n_items + 1))
+        feed = {'openSearch$totalResults': {'$t': self.n_items}}
+        if items:
+            feed['entry'] = [{'n': n} for n in items]
+        res = FakeFeedResponse(feed)
+        return read(res) if read is not None else res
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+@pytest.mark.parametrize('n_items', [0, 1, 50, 51, 1234])
+def test_paginated_fetch(jobs, n_items):
+    client = FakeFeedClient(n_items, page_size=50, jobs=jobs)
+    items = client._paginated_fetch('http://x', {}, lambda item: item['n'])
+    assert list(items) == list(range(1, n_items + 1))
+
+    client = FakeFeedClient(n_items, page_size=50, jobs=jobs)
+    items = client._paginated_fetch('http://x', {}, lambda item: item['n'], total=n_items)
+    assert list(items) == list(range(1, n_items + 1))
+    if jobs > 1 and n_items == 1234:  # pages as large as possible, one per thread at least
+        assert sorted(client.pages) == [(1, 412), (413, 412), (825, 412)]
+
+
+def test_album_cache(monkeypatch):
+    album = GoogleAlbum(id='1', num_photos=7)
+    cache = AlbumCache(ttl=60)
+    assert cache.get('1') is None
+    cache.put(album)
+    assert cache.get('1') is album
+    cache.invalidate('1')
+    assert cache.get('1') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    cache.put(album)
+    now = google.time.time()
+    monkeypatch.setattr(google.time, 'time', lambda: now + 61)
+    assert cache.get('1') is None
+
+
+class FakePhoto(object):
+
+    @staticmethod
+    def from_raw_json(raw):
+        return raw['n']
+
+
+def test_fetch_images_known_total(monkeypatch):
+    monkeypatch.setattr(google, 'PhotoRecord', FakePhoto)
+    # the fake feed has no album to serve: get_album must not be called
+    client = FakeFeedClient(7, page_size=50, jobs=1)
+    images = client.fetch_images('1', album=GoogleAlbum(id='1', num_photos=7))
+    assert len(list(images)) == 7
+    assert client.pages == [(1, 50)]
+
+    client.album_cache.put(GoogleAlbum(id='2', num_photos=7))
+    assert len(list(client.fetch_images('2'))) == 7
+    assert len(list(client.fetch_images('3', total=7))) == 7
+    assert client.album_cache.hits == 1
+
+
+def test_album_changes(tmpdir):
+    from datetime import datetime
+    from ptoolbox.google.models import CatalogWriter, GooglePhoto, db, init_database
+
+    def album(album_id, num_photos, updated):
+        return AlbumRecord(id=album_id, name=album_id, title=album_id, author='bob',
+                           access='private', summary='', num_photos=num_photos,
+                           updated=datetime(2015, 2, updated), published=datetime(2015, 2, 1))
+
+    def photo(album_id, uuid):
+        return PhotoRecord(album=album_id, uuid=uuid, url='http://x', time=datetime(2015, 2, 1),
+                           size=1, title=uuid, width=1, height=1, unique_id=None)
+
+    init_database(str(tmpdir.join('catalog.db')), reset=True)
+    try:
+        GoogleAlbum.insert_records([album('2', 2, 1)])
+        with CatalogWriter() as writer:
+            writer.replace_photos(album('1', 1, 1), [photo('1', 'a')])
+            writer.replace_photos(album('3', 1, 1), [photo('3', 'c')])
+
+        fetched = [album('1', 1, 1), album('2', 3, 1), album('4', 1, 1)]
+        changed, vanished = GoogleAlbum.changes(fetched)
+        assert [a.id for a in changed] == ['2', '4']
+        assert vanished == ['3']
+
+        GoogleAlbum.prune(vanished)
+        fetched[1] = fetched[1]._replace(title='renamed')
+        GoogleAlbum.insert_records(fetched, upsert=True)
+        with CatalogWriter() as writer:
+            writer.replace_photos(fetched[1], [photo('2', 'b1'), photo('2', 'b2')])
+        assert GoogleAlbum.changes(fetched) == ([], [])
+        assert sorted(a.id for a in GoogleAlbum.select()) == ['1', '2', '4']
+        assert GoogleAlbum.get(GoogleAlbum.id == '2').title == 'renamed'
+        assert sorted(p.uuid for p in GooglePhoto.select()) == ['a', 'b1', 'b2']
+    finally:
+        db.close()
+
+
+def test_records():
+    from datetime import datetime
+    from ptoolbox.google.fake import album_xml, photo_xml
+
+    with open(os.path.join(SAMPLES_DIR, 'sample-recentpictures.json'), 'rb') as f:
+        entries = json.loads(f.read().decode('utf-8'))
+    for entry in entries:
+        record = PhotoRecord.from_raw_json(entry)
+        assert record.uuid == entry['gphoto$id']['$t']
+        assert record.url == entry['media$group']['media$content'][0]['url']
+        assert record.size == int(entry['gphoto$size']['$t'])
+        assert isinstance(record.time, datetime)
+        assert record.to_model()._data == GooglePhoto.from_raw_json(entry)._data
+        # the same fields are read out of the XML entries
+        assert PhotoRecord.from_xml(photo_xml(record).encode('utf-8')) == record
+
+    with open(os.path.join(SAMPLES_DIR, 'sample-albums-json.json'), 'rb') as f:
+        entries = json.loads(f.read().decode('utf-8'))['feed']['entry']
+    for entry in entries:
+        record = AlbumRecord.from_raw_json(entry)
+        assert (record.id, record.author) == (entry['gphoto$id']['$t'],
+                                              entry['author'][0]['name']['$t'])
+        assert record.num_photos == int(entry['gphoto$numphotos']['$t'])
+        assert record.to_model()._data == GoogleAlbum.from_raw_json(entry)._data
+        created = AlbumRecord.from_xml(album_xml(record).encode('utf-8'))
+        assert created[:3] + (created.access,) == record[:3] + (record.access,)
+    assert PhotoRecord.from_raw_json({}) == PhotoRecord(*[None] * len(PhotoRecord._fields))
+
+
+def test_catalog_writer(tmpdir):
+    from datetime import datetime
+    from ptoolbox.google.models import CatalogWriter, db, init_database
+
+    def photo(album_id, uuid, title='photo'):
+        return PhotoRecord(album=album_id, uuid=uuid, url='http://x', time=datetime(2015, 2, 1),
+                           size=1, title=title, width=1, height=1, unique_id=None)
+    album = AlbumRecord(id='1', name='1', title='1', author='bob', access='private', summary='',
+                        num_photos=1, updated=datetime(2015, 2, 1), published=datetime(2015, 2, 1))
+
+    init_database(str(tmpdir.join('catalog.db')), reset=True)
+    try:
+        assert db.execute_sql('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        with CatalogWriter(batch_size=2) as writer:
+            writer.add([photo('1', 'a'), photo('1', 'b'), photo('2', 'c')])
+            assert writer.n_rows == 2
+        assert writer.n_rows == 3
+
+        with CatalogWriter(batch_size=2) as writer:
+            writer.add([photo('2', 'c', 'renamed')])  # upserted
+            writer.replace_photos(album, [photo('1', 'd')])
+        rows = sorted((p.album_id, p.uuid, p.title) for p in GooglePhoto.select())
+        assert rows == [('1', 'd', 'photo'), ('2', 'c', 'renamed')]
+        assert GoogleAlbum.get(GoogleAlbum.id == '1').num_photos == 1
+        assert GooglePhoto.get(GooglePhoto.uuid == 'd').time == datetime(2015, 2, 1)
+
+        # an album is written at once, and what was added before an error is kept
+        with pytest.raises(KeyboardInterrupt):
+            with CatalogWriter(batch_size=2) as writer:
+                writer.replace_photos(album, [photo('1', uuid) for uuid in 'efg'])
+                assert (writer.n_rows, writer.n_pending) == (4, 0)
+                writer.replace_photos(album._replace(id='2'), [photo('2', 'h')])
+                raise KeyboardInterrupt()
+        rows = sorted((p.album_id, p.uuid) for p in GooglePhoto.select())
+        assert rows == [('1', 'e'), ('1', 'f'), ('1', 'g'), ('2', 'h')]
+    finally:
+        db.close()
+
+
+def test_catalog_indexes(tmpdir):
+    from ptoolbox.google.models import db, init_database
+
+    def indexes():
+        return set(tuple(index.columns) for index in db.get_indexes('googlephoto'))
+
+    path = str(tmpdir.join('catalog.db'))
+    init_database(path)
+    expected = set([('album_id',), ('time',), ('unique_id',), ('size', 'width', 'height')])
+    try:
+        assert expected <= indexes()
+        for index in db.get_indexes('googlephoto'):  # as created by older versions
+            if not index.name.startswith('sqlite_') and index.columns != ['album_id']:
+                db.execute_sql('DROP INDEX "%s"' % index.name)
+        db.close()
+
+        init_database(path)
+        assert expected <= indexes()
+        plan = db.execute_sql('EXPLAIN QUERY PLAN SELECT COUNT(*) FROM googlephoto '
+                              'WHERE unique_id = ?', ('x',)).fetchall()
+        assert 'INDEX' in str(plan)
+    finally:
+        db.close()
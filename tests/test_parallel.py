@@ -0,0 +1,26 @@
+import time
+
+import pytest
+
+from ptoolbox.parallel import imap_bounded
+
+
+def slow_square(n):
+    time.sleep(0.01 * (n % 3))
+    return n * n
+
+
+def test_imap_bounded():
+    assert list(imap_bounded(slow_square, range(20), jobs=4)) == [n * n for n in range(20)]
+    unordered = list(imap_bounded(slow_square, range(20), jobs=4, ordered=False))
+    assert sorted(unordered) == [n * n for n in range(20)]
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_imap_bounded_errors(ordered):
+    def fail(n):
+        if n == 5:
+            raise ValueError(n)
+        return n
+    with pytest.raises(ValueError):
+        list(imap_bounded(fail, range(10), jobs=2, ordered=ordered))
@@ -0,0 +1,35 @@
+from ptoolbox.path import get_tags, jpeg_size, md5sum, parse_tags, probe_image
+
+from conftest import build_jpeg
+
+
+def test_probe_image(tmpdir):
+    path = tmpdir.join('a.jpg')
+    path.write(build_jpeg(640, 480, datetime_original='2015:02:16 10:00:00'), 'wb')
+    path = str(path)
+
+    probe = probe_image(path)
+    assert probe.is_jpeg()
+    assert (probe.width, probe.height) == jpeg_size(path)
+    assert probe.checksum == md5sum(path)
+    tags = parse_tags(probe.exif)
+    assert tags['EXIF DateTimeOriginal'] == str(get_tags(path)['EXIF DateTimeOriginal'])
+
+
+def test_probe_not_an_image(tmpdir):
+    text = tmpdir.join('notes.txt')
+    text.write('not an image')
+    empty = tmpdir.join('empty.jpg')
+    empty.write('')
+    for path in (text, empty):
+        probe = probe_image(str(path))
+        assert not probe.is_jpeg()
+        assert probe.checksum is None
+
+
+def test_probe_truncated_jpeg(tmpdir):
+    path = tmpdir.join('truncated.jpg')
+    path.write(build_jpeg()[:30], 'wb')
+    probe = probe_image(str(path))
+    assert probe.is_jpeg()
+    assert not probe.has_size()
@@ -0,0 +1,70 @@
+import io
+import random
+
+import pytest
+
+from ptoolbox.dupes import find_similar_images, hash_images
+from ptoolbox.models import ImageInfo
+from ptoolbox.path import probe_image
+from ptoolbox.phash import BKTree, hamming_distance, image_dhash
+
+from conftest import build_exif
+
+
+def test_bktree():
+    random.seed(42)
+    hashes = [random.getrandbits(64) for i in range(500)]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+    tree.add(hashes[0], 'copy')
+    for h in hashes[:20]:
+        query = h ^ 0b1011  # 3 bits away
+        expected = sorted((hamming_distance(query, x), i) for i, x in enumerate(hashes)
+                          if hamming_distance(query, x) <= 8)
+        assert sorted(x for x in tree.search(query, 8) if x[1] != 'copy') == expected
+    assert (0, 'copy') in tree.search(hashes[0], 0)
+
+
+def test_find_similar_images():
+    images = [ImageInfo('/%d.jpg' % i, 1, 1, 'md5', phash=h) for i, h in enumerate(
+        [0b0, 0b11, 0b111111, 0xff00, 0xff01, None])]
+    groups = find_similar_images(images, max_distance=2)
+    assert [[img.path for img in group] for group in groups] == [
+        ['/0.jpg', '/1.jpg'], ['/3.jpg', '/4.jpg']]
+    groups = find_similar_images(images, max_distance=4)
+    assert [[img.path for img in group] for group in groups] == [
+        ['/0.jpg', '/1.jpg', '/2.jpg'], ['/3.jpg', '/4.jpg']]
+
+
+def test_image_dhash(tmpdir):
+    Image = pytest.importorskip('PIL.Image')
+    random.seed(1)
+    original = Image.new('L', (640, 480))
+    original.putdata([(x // 40 * 37 + y // 60 * 91) % 256 for y in range(480) for x in range(640)])
+    original.save(str(tmpdir.join('original.jpg')), quality=95)
+    original.resize((320, 240)).save(str(tmpdir.join('resized.jpg')), quality=40)
+    other = Image.new('L', (640, 480))
+    other.putdata([random.randint(0, 255) for i in range(640 * 480)])
+    other.save(str(tmpdir.join('other.jpg')))
+
+    h1, h2, h3 = [image_dhash(str(tmpdir.join(name)))
+                  for name in ('original.jpg', 'resized.jpg', 'other.jpg')]
+    assert hamming_distance(h1, h2) <= 4
+    assert hamming_distance(h1, h3) > 12
+    assert image_dhash(str(tmpdir.join('missing.jpg'))) is None
+
+    # the EXIF thumbnail is used instead of the image itself
+    thumbnail = io.BytesIO()
+    original.resize((160, 120)).save(thumbnail, 'JPEG')
+    exif = build_exif(thumbnail=thumbnail.getvalue())
+    assert hamming_distance(image_dhash(str(tmpdir.join('other.jpg')), exif), h1) <= 4
+
+    # probing computes the same hash from the mapped file
+    probe = probe_image(str(tmpdir.join('original.jpg')), checksum=False, phash=True)
+    assert (probe.phash, probe.checksum) == (h1, None)
+
+    tmpdir.join('notes.txt').write('not an image')
+    images = sorted(hash_images(str(tmpdir)), key=lambda img: img.path)
+    assert [(img.name, img.width, img.phash) for img in images] == [
+        ('original.jpg', 640, h1), ('other.jpg', 640, h3), ('resized.jpg', 320, h2)]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os.path
+
+import pytest
+
+from ptoolbox.google.stream import FeedParser
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), '..', 'sample-recentpictures.json')
+
+
+def _chunks(data, chunk_size):
+    return (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+
+
+def _feed():
+    with open(SAMPLE_PATH, 'rb') as f:
+        entries = json.loads(f.read().decode('utf-8'))
+    return {
+        'version': '1.0',
+        'feed': {
+            'title': {'$t': u'Récentes'},
+            'entry': entries,
+            'openSearch$totalResults': {'$t': 1234},
+        },
+    }
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 65536])
+def test_feed_parser(chunk_size):
+    feed = _feed()
+    data = json.dumps(feed, indent=1, ensure_ascii=False).encode('utf-8')
+    parser = FeedParser(_chunks(data, chunk_size))
+    assert list(parser.entries()) == feed['feed']['entry']
+    assert parser.feed == {'title': {'$t': u'Récentes'}, 'openSearch$totalResults': {'$t': 1234}}
+
+
+def test_feed_parser_edge_cases():
+    for data in (b'{}', b'{"feed": {}}', b' {"feed": {"entry": []}} '):
+        parser = FeedParser(_chunks(data, 1))
+        assert list(parser.entries()) == []
+    parser = FeedParser(_chunks(b'{"feed": {"entry": [1, 23], "n": 456}}', 1))
+    assert list(parser.entries()) == [1, 23]
+    assert parser.feed == {'n': 456}
+
+    for data in (b'', b'{"feed": {"entry": [{"a": 1}', b'{"feed": {"entry": [1 2]}}', b'{} {}'):
+        with pytest.raises(ValueError):
+            list(FeedParser(_chunks(data, 3)).entries())
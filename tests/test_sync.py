@@ -0,0 +1,61 @@
+from datetime import datetime
+
+from ptoolbox.models import ImageInfo
+from ptoolbox.sync import SyncPlan, plan_sync, load_remote_photos
+
+T1, T2, T3 = datetime(2015, 2, 16, 10), datetime(2015, 2, 17, 11), datetime(2015, 2, 18, 12)
+
+
+def _image(path, checksum, time=None, unique_id=None, width=100, height=50):
+    return ImageInfo(path, width, height, checksum, time, unique_id, rel_path=path)
+
+
+def _photo(uuid, time, unique_id=None, width=100, height=50, album='1'):
+    return (album, uuid, 'http://x/%s.jpg' % uuid, time, width, height, unique_id, 1000)
+
+
+def test_plan_sync():
+    images = [
+        _image('holidays/a.jpg', 'A', T1, 'ID-A'),
+        _image('holidays/b.jpg', 'B', T2, width=200, height=100),
+        _image('holidays/c.jpg', 'C', T2, width=50, height=100),  # rotated, still a match
+        _image('holidays/d.jpg', 'D', T3),
+        _image('other/copy-of-a.jpg', 'A', T1, 'ID-A'),
+        _image('other/e.jpg', 'E'),
+        _image('other/f.jpg', 'F', datetime(2015, 3, 1)),
+    ]
+    photos = [
+        _photo('a', datetime(2001, 1, 1), 'ID-A'),  # wrong time, same unique id
+        _photo('b', T2, width=200, height=100),
+        _photo('c', T2),
+        _photo('d1', T3),
+        _photo('d2', T3),
+        _photo('g', T1, album='2'),
+    ]
+    plan = plan_sync(iter(images), photos, {'1': 'holidays', '2': 'other'})
+    assert plan.summary() == {'upload': 1, 'download': 1, 'conflict': 1, 'matched': 3,
+                              'ignored': 2}
+    assert plan.upload == [{'path': 'other/f.jpg', 'album': 'other'}]
+    assert [(a['path'], a['uuid']) for a in plan.matched] == [
+        ('holidays/a.jpg', 'a'), ('holidays/b.jpg', 'b'), ('holidays/c.jpg', 'c')]
+    assert plan.conflict == [{'path': 'holidays/d.jpg', 'photos': [['1', 'd1'], ['1', 'd2']]}]
+    assert [(a['uuid'], a['album'], a['time']) for a in plan.download] == [('g', 'other', T1)]
+    assert [a['reason'] for a in plan.ignored] == ['copy of holidays/a.jpg', 'no time']
+
+    restored = SyncPlan.from_json(plan.to_json())
+    for action in ('upload', 'download', 'conflict', 'matched', 'ignored'):
+        assert getattr(restored, action) == getattr(plan, action)
+
+
+def test_load_remote_photos(tmpdir):
+    from ptoolbox.google.models import GooglePhoto, db, init_database
+    from ptoolbox.google.records import PhotoRecord
+
+    init_database(str(tmpdir.join('catalog.db')), reset=True)
+    try:
+        record = PhotoRecord(album='1', uuid='a', url='http://x/a.jpg', time=T1, size=1000,
+                             title='a.jpg', width=100, height=50, unique_id='ID-A')
+        GooglePhoto.insert_records([record])
+        assert list(load_remote_photos()) == [_photo('a', T1, 'ID-A')]
+    finally:
+        db.close()
@@ -0,0 +1,168 @@
+import threading
+import time
+
+import pytest
+
+from requests.exceptions import ConnectionError
+
+from ptoolbox.google import request_with_retry
+from ptoolbox.google.throttle import (Throttle, TokenBucket, CircuitOpenError, BREAKER_CLOSED,
+                                      BREAKER_OPEN, BREAKER_HALF_OPEN)
+
+
+def _throttle(**kwargs):
+    options = dict(rate=0, min_limit=1, max_limit=8, latency_threshold=10,
+                   breaker_threshold=3, breaker_cooldown=0.05)
+    options.update(kwargs)
+    return Throttle(**options)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=100, capacity=1)
+    start = time.time()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.time() - start >= 0.09
+    assert TokenBucket(rate=0).acquire() == 0
+
+
+def test_aimd():
+    throttle = _throttle(breaker_threshold=100)
+    started = [throttle.acquire() for _ in range(4)]
+    for start in started:  # a single decrease for the requests of a same window
+        throttle.release(start, 429)
+    assert (throttle.limit, throttle.throttle_events) == (4, 1)
+
+    throttle.release(throttle.acquire(), 503)
+    throttle.release(throttle.acquire(), 503)
+    assert throttle.limit == 1
+    throttle.release(throttle.acquire(), 503)
+    assert throttle.limit == 1  # no less than min_limit
+
+    for _ in range(7):  # additive increase, by about one per window
+        throttle.release(throttle.acquire(), 200)
+    assert int(throttle.limit) == 4
+    assert throttle.stats()['throttle_events'] == 4
+
+
+def test_latency_spike():
+    throttle = _throttle(latency_threshold=0.01)
+    start = throttle.acquire()
+    time.sleep(0.02)
+    throttle.release(start, 200)
+    assert throttle.limit == 4
+
+    start = throttle.acquire()
+    time.sleep(0.02)
+    throttle.release(start, 200, timed=False)  # e.g. a slow upload
+    assert throttle.throttle_events == 1
+
+
+def test_concurrency_limit():
+    throttle = _throttle(max_limit=2)
+    started = [throttle.acquire(), throttle.acquire()]
+    admitted = []
+    thread = threading.Thread(target=lambda: admitted.append(throttle.acquire()))
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted  # waits for a slot
+    throttle.release(started[0], 200)
+    thread.join(1)
+    assert admitted and throttle.in_flight == 2
+
+
+def test_circuit_breaker():
+    throttle = _throttle()
+    for status in (500, None, 502):
+        throttle.release(throttle.acquire(), status)
+    assert throttle.breaker == BREAKER_OPEN
+    with pytest.raises(CircuitOpenError):
+        throttle.acquire()
+
+    time.sleep(0.06)
+    probe = throttle.acquire()
+    assert throttle.breaker == BREAKER_HALF_OPEN
+    with pytest.raises(CircuitOpenError):  # one probe at a time
+        throttle.acquire()
+    throttle.release(probe, 503)
+    assert throttle.breaker == BREAKER_OPEN and throttle.breaker_trips == 2
+
+    time.sleep(0.06)
+    throttle.release(throttle.acquire(), 200)
+    assert throttle.breaker == BREAKER_CLOSED
+    assert throttle.stats()['breaker'] == BREAKER_CLOSED
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+
+    def request(self, method, **kwargs):
+        answer = self.answers.pop(0)
+        if isinstance(answer, BaseException):
+            raise answer
+        return answer
+
+
+def test_request_with_throttle(monkeypatch):
+    from ptoolbox import google
+
+    delays = []
+    monkeypatch.setattr(google.time, 'sleep', delays.append)
+    monkeypatch.setattr(google, 'backoff_delay', lambda attempt: 0)
+    throttle = _throttle()
+    session = FakeSession(FakeResponse(429, {'Retry-After': '7'}), FakeResponse(200))
+    res = request_with_retry('GET', session=session, throttle=throttle, url='http://x')
+    assert res.status_code == 200
+    assert delays == [7]  # as asked by the server
+    assert (throttle.throttle_events, throttle.in_flight) == (1, 0)
+
+    for status in (500, 500, 500):
+        throttle.release(throttle.acquire(), status)
+    with pytest.raises(CircuitOpenError):
+        request_with_retry('GET', session=FakeSession(), throttle=throttle, url='http://x')
+
+
+def test_request_released(monkeypatch):
+    from ptoolbox import google
+
+    monkeypatch.setattr(google.time, 'sleep', lambda delay: None)
+    throttle = _throttle()
+    with pytest.raises(KeyboardInterrupt):
+        request_with_retry('GET', session=FakeSession(KeyboardInterrupt()), throttle=throttle,
+                           url='http://x')
+    assert throttle.in_flight == 0  # no slot leaked
+
+    throttle = _throttle(latency_threshold=0)
+    res = request_with_retry('POST', session=FakeSession(FakeResponse(201)), throttle=throttle,
+                             url='http://x', data=b'photo')
+    assert res.status_code == 201
+    assert throttle.throttle_events == 0  # the time to send the body is not latency
+
+
+def test_request_released_once_read():
+    throttle = _throttle()
+    in_flight = []
+    status = request_with_retry('GET', session=FakeSession(FakeResponse(200)), throttle=throttle,
+                                url='http://x', read=lambda res: (
+                                    in_flight.append(throttle.in_flight) or res.status_code))
+    assert status == 200 and in_flight == [1]  # in flight while its body is read
+    assert throttle.in_flight == 0
+
+    def cut_short(res):
+        raise ConnectionError('connection reset')
+    with pytest.raises(ConnectionError):
+        request_with_retry('GET', n_retries=1, session=FakeSession(FakeResponse(200)),
+                           throttle=throttle, url='http://x', read=cut_short)
+    assert (throttle.in_flight, throttle.n_failures) == (0, 1)
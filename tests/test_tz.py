@@ -0,0 +1,110 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from ptoolbox.tz import TimezoneIndex, build_tz_index
+
+BOUNDARIES = {
+    'type': 'FeatureCollection',
+    'features': [{
+        'type': 'Feature',
+        'properties': {'tzid': 'Europe/Paris'},
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [
+                [[-2.5, 42.2], [8.3, 42.2], [8.3, 51.1], [-2.5, 51.1], [-2.5, 42.2]],
+                [[2.1, 48.1], [2.6, 48.1], [2.6, 48.6], [2.1, 48.6], [2.1, 48.1]],  # hole
+            ],
+        },
+    }, {
+        'type': 'Feature',
+        'properties': {'tzid': 'America/New_York'},
+        'geometry': {
+            'type': 'MultiPolygon',
+            'coordinates': [
+                [[[-80.0, 35.0], [-70.0, 35.0], [-75.0, 45.5], [-80.0, 35.0]]],
+                [[[-69.5, 44.0], [-68.5, 44.0], [-69.0, 44.5], [-69.5, 44.0]]],
+            ],
+        },
+    }],
+}
+
+
+def test_lookup(tmpdir):
+    geojson = tmpdir.join('boundaries.json')
+    geojson.write(json.dumps(BOUNDARIES))
+    build_tz_index(str(geojson), str(tmpdir.join('index')), grid_size=1.0)
+    index = TimezoneIndex.load(str(tmpdir.join('index')))
+
+    assert index.lookup(48.35, 2.35) == 'Etc/GMT'  # in the hole
+    assert index.lookup(48.35, 2.75) == 'Europe/Paris'
+    assert index.lookup(45.0, 5.0) == 'Europe/Paris'  # cell fully inside
+    assert index.lookup(43.6, 8.4) == 'Etc/GMT-1'  # at sea, east of the border
+    assert index.lookup(40.0, -75.0) == 'America/New_York'
+    assert index.lookup(44.1, -69.0) == 'America/New_York'
+    assert index.lookup(44.0, -71.5) == 'Etc/GMT+5'  # east of the triangle side
+
+
+def test_historical_offsets():
+    pytest.importorskip('pytz')
+    index = TimezoneIndex()
+    index.add_geojson(BOUNDARIES)
+    winter = index.latlon2tz(45.0, 5.0, datetime(2015, 1, 1, 12))
+    summer = index.latlon2tz(45.0, 5.0, datetime(2015, 7, 1, 12))
+    assert (winter['rawOffset'], winter['dstOffset']) == (3600, 0)
+    assert (summer['rawOffset'], summer['dstOffset']) == (3600, 3600)
+    assert index.latlon2tz(40.0, -75.0, datetime(1930, 1, 1))['rawOffset'] == -5 * 3600
+
+
+def test_cache(tmpdir):
+    from ptoolbox.tz import TimezoneCache
+
+    calls = []
+
+    def lookup(lat, lon, dt):
+        calls.append((lat, lon, dt))
+        return {u'rawOffset': 3600, u'dstOffset': 0}
+
+    path = str(tmpdir.join('cache.json'))
+    cache = TimezoneCache(lookup, path, max_size=2, save_every=100)
+    day = datetime(2015, 2, 16, 10)
+    assert cache(48.8566, 2.3522, day) == {u'rawOffset': 3600, u'dstOffset': 0}
+    cache(48.8567, 2.3521, day.replace(hour=18))  # same bucket
+    cache(48.8566, 2.3522, datetime(2015, 2, 17))
+    assert (cache.hits, cache.misses, len(calls)) == (1, 2, 2)
+
+    cache(45.0, 5.0, day)  # evicts the least recently used entry
+    cache(48.8566, 2.3522, day)
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.save()
+
+    reloaded = TimezoneCache(lookup, path)
+    for lat, lon, dt in list(calls):
+        reloaded(lat, lon, dt)
+    assert (reloaded.hits, reloaded.misses) == (3, 1)  # the evicted entry was not saved
+
+
+def test_cache_shared(tmpdir):
+    from ptoolbox.tz import TimezoneCache
+
+    def lookup(lat, lon, dt):
+        return {u'rawOffset': int(lat) * 3600, u'dstOffset': 0}
+
+    path = str(tmpdir.join('cache.json'))
+    day = datetime(2015, 2, 16, 10)
+    first, second = TimezoneCache(lookup, path, max_size=3), TimezoneCache(lookup, path, max_size=3)
+    for lat in (1, 2):
+        first(lat, 0, day)
+    for lat in (3, 4):
+        second(lat, 0, day)
+    first.save()
+    second.save()
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert len(saved) == 3  # the file is not allowed to grow beyond max_size
+    reloaded = TimezoneCache(lookup, path, max_size=3)
+    for lat in (2, 3, 4):  # the most recently used entries of both processes
+        reloaded(lat, 0, day)
+    assert reloaded.misses == 0
@@ -0,0 +1,94 @@
+import os
+import time
+
+from datetime import datetime
+
+import pytest
+
+from ptoolbox import google
+from ptoolbox.google import PicasaClient
+from ptoolbox.google.fake import photo_xml
+from ptoolbox.google.records import PhotoRecord
+from ptoolbox.upload import UploadManager
+
+from conftest import LocalHandler
+
+class UploadHandler(LocalHandler):
+    """Accepts uploads, but of the titles starting with 'busy' (503) or
+    'bad' (400).
+    """
+
+    def answer(self, body):
+        time.sleep(0.02)
+        title = self.headers['Slug']
+        if title.startswith('busy'):
+            return 503, {}, b''
+        if title.startswith('bad'):
+            return 400, {}, b''
+        photo = PhotoRecord(album=self.path.rsplit('/', 1)[-1], uuid=str(self.rank + 1),
+                            url='http://x/' + title, time=datetime(2015, 2, 19, 13, 48, 58),
+                            size=len(body), title=title, width=100, height=50,
+                            unique_id='ID-' + title)
+        return 201, {}, photo_xml(photo).encode('utf-8')
+
+
+pytestmark = pytest.mark.parametrize('local_server', [UploadHandler], indirect=True)
+
+
+def _uploads(server, title):
+    """The bodies of the uploads of <title> received by the <server>."""
+    return [body for _, _, headers, body in server.requests if headers['Slug'] == title]
+
+
+def _client(server):
+    client = PicasaClient()
+    client._url = lambda suffix='', selector='feed': server.url + suffix
+    return client
+
+
+def test_upload_photo(local_server, tmpdir):
+    path = tmpdir.join('a.jpg')
+    path.write(b'jpeg' * 100, 'wb')
+    client = _client(local_server)
+    photo = client.upload_photo(str(path), 'a.jpg', '42')
+    assert isinstance(photo, PhotoRecord)
+    assert (photo.album, photo.uuid, photo.size, photo.unique_id) == ('42', '1', 400, 'ID-a.jpg')
+    assert _uploads(local_server, 'a.jpg') == [b'jpeg' * 100]
+    assert client.upload_image(str(path), 'b.jpg', '42') == '2'
+
+    path.write(b'', 'wb')
+    with pytest.raises(google.RequestError) as error:
+        client.upload_image(str(path), 'bad.jpg')
+    assert error.value.status_code == 400 and not error.value.retryable
+
+
+def test_upload_manager(local_server, tmpdir, monkeypatch):
+    from ptoolbox.google.models import CatalogWriter, GooglePhoto, db, init_database
+
+    monkeypatch.setattr(google, 'backoff_delay', lambda attempt: 0)
+    init_database(str(tmpdir.join('catalog.db')), reset=True)
+    uploads = []
+    for name in ['%02d.jpg' % n for n in range(20)] + ['busy.jpg', 'bad.jpg', 'missing.jpg']:
+        if name != 'missing.jpg':
+            tmpdir.join(name).write(name.encode('ascii') * 1000, 'wb')
+        uploads.append((str(tmpdir.join(name)), name, '1'))
+
+    manager = UploadManager(_client(local_server), jobs=4, queue_size=2,
+                            writer=CatalogWriter(batch_size=3))
+    results = dict((os.path.basename(path), (photo, error))
+                   for path, photo, error in manager.run(iter(uploads)))
+
+    assert len(results) == 23
+    assert results['05.jpg'][0].title == '05.jpg' and results['05.jpg'][1] is None
+    assert _uploads(local_server, '05.jpg') == [b'05.jpg' * 1000]
+    assert 1 < local_server.max_in_flight <= 4
+    assert (manager.n_files, manager.n_bytes) == (20, 20 * 6000)
+    failures = dict((os.path.basename(path), retryable) for path, _, retryable in manager.failures)
+    assert failures == {'busy.jpg': True, 'bad.jpg': False, 'missing.jpg': False}
+    assert manager.retryable == [str(tmpdir.join('busy.jpg'))]
+    assert len(_uploads(local_server, 'busy.jpg')) == 1  # uploads are not retried by the client
+
+    # every uploaded photo is in the catalog, the last batch included
+    assert sorted(photo.title for photo in GooglePhoto.select()) == \
+        ['%02d.jpg' % n for n in range(20)]
+    db.close()
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+from ptoolbox.utils import list_valid_images, parse_exif_time
+
+
+def _summary(images):
+    return sorted((img.name, img.album_title, img.width, img.height, img.time, img.unique_id)
+                  for img in images)
+
+
+def test_list_valid_images(jpeg_tree):
+    images = list(list_valid_images(str(jpeg_tree)))
+    assert _summary(images) == [
+        ('a.jpg', 'holidays', 100, 50, datetime(2015, 2, 16, 10), 'ID-A'),
+        ('b.jpg', 'holidays', 200, 100, datetime(2015, 2, 17, 11, 30), None),
+        ('c.jpg', 'other', 10, 20, None, None),
+        ('orphan.jpg', None, 100, 50, datetime(2015, 2, 16, 10), 'ID-A'),
+    ]
+    assert len(set(img.checksum for img in images)) == 3  # orphan.jpg is a copy of a.jpg
+
+
+def test_list_valid_images_parallel(jpeg_tree):
+    serial = list(list_valid_images(str(jpeg_tree)))
+    ordered = list(list_valid_images(str(jpeg_tree), jobs=2))
+    unordered = list(list_valid_images(str(jpeg_tree), jobs=2, ordered=False))
+    assert [img.path for img in ordered] == [img.path for img in serial]
+    assert _summary(unordered) == _summary(serial)
+    assert sorted(img.checksum for img in unordered) == sorted(img.checksum for img in serial)
+
+
+def test_list_indexed_images(jpeg_tree, tmpdir_factory, monkeypatch):
+    from ptoolbox import utils
+    from ptoolbox.models import index_db, init_index
+
+    init_index(str(tmpdir_factory.mktemp('index').join('index.db')))
+    probed = []
+
+    def image_info(path, *args):
+        probed.append(path)
+        return real_image_info(path, *args)
+    real_image_info = utils.image_info
+    monkeypatch.setattr(utils, 'image_info', image_info)
+
+    try:
+        first = list(list_valid_images(str(jpeg_tree), index=True))
+        assert len(probed) == 5
+        assert _summary(first) == _summary(list_valid_images(str(jpeg_tree)))
+
+        del probed[:]
+        assert _summary(list_valid_images(str(jpeg_tree), index=True)) == _summary(first)
+        assert probed == []
+
+        jpeg_tree.join('other', 'c.jpg').remove()
+        jpeg_tree.join('holidays', 'b.jpg').write('now a text file')
+        images = list(list_valid_images(str(jpeg_tree), index=True))
+        assert sorted(img.name for img in images) == ['a.jpg', 'orphan.jpg']
+        assert probed == [str(jpeg_tree.join('holidays', 'b.jpg'))]
+
+        del probed[:]
+        list(list_valid_images(str(jpeg_tree), index=True, rescan=True))
+        assert len(probed) == 4
+    finally:
+        index_db.close()
+
+
+def test_list_indexed_images_stopped(jpeg_tree, tmpdir, monkeypatch):
+    from ptoolbox import utils
+    from ptoolbox.conf import settings
+    from ptoolbox.models import IndexedImage, index_db, init_index
+
+    init_index(str(tmpdir.join('index.db')))
+    monkeypatch.setitem(settings.LOCAL_SCAN, 'INDEX_BATCH_SIZE', 100)
+    # a sibling directory sharing the prefix, and a LIKE wildcard in a name
+    tmpdir.mkdir(jpeg_tree.basename + '_x').join('d.jpg').write('not an image')
+    jpeg_tree.join('other', '100%_.jpg').write('not an image')
+    try:
+        images = utils.list_valid_images(str(jpeg_tree), index=True)
+        next(images)
+        images.close()  # the caller stops early: the scanned entries are kept
+        assert len(IndexedImage.under(str(jpeg_tree))) >= 1
+
+        list(utils.list_valid_images(str(tmpdir.join(jpeg_tree.basename + '_x')), index=True))
+        indexed = IndexedImage.under(str(jpeg_tree))
+        assert all(p.startswith(str(jpeg_tree) + '/') for p in indexed)
+        assert len(IndexedImage.under(str(jpeg_tree.join('other', '100%_')))) == 0
+    finally:
+        index_db.close()
+
+
+def test_parse_exif_time(monkeypatch):
+    from ptoolbox import utils
+
+    lookups = []
+
+    def latlon2tz(lat, lon, dt, engine=None):
+        lookups.append((round(lat, 4), round(lon, 4), dt, engine))
+        return {u'rawOffset': 3600, u'dstOffset': 0}
+    monkeypatch.setattr(utils, 'latlon2tz', latlon2tz)
+
+    tags = {'Image DateTime': '2015:02:16 10:00:00', 'EXIF DateTimeDigitized': '2015:02:16 09:00:00'}
+    assert parse_exif_time(tags) == datetime(2015, 2, 16, 9)
+    assert parse_exif_time({}) is None
+    assert lookups == []
+
+    tags.update({
+        'GPS GPSLatitude': [48.0, 51.0, 24.0], 'GPS GPSLatitudeRef': 'N',
+        'GPS GPSLongitude': [2.0, 21.0, 8.0], 'GPS GPSLongitudeRef': 'W',
+    })
+    assert parse_exif_time(tags) == datetime(2015, 2, 16, 8)
+    assert parse_exif_time(tags, 'offline') == datetime(2015, 2, 16, 8)
+    assert lookups == [(48.8567, -2.3522, datetime(2015, 2, 16, 9), None),
+                       (48.8567, -2.3522, datetime(2015, 2, 16, 9), 'offline')]